@@ -0,0 +1,132 @@
+# api/loadgen.py
+# Load generator for api.server: seeds customers into a file-backed database,
+# signs each client in, then fires a mix of balance, deposit, withdraw and
+# history requests over keep-alive connections and reports p50/p99 and req/s.
+# Run from the project folder: python -m api.loadgen --clients 50 --requests 5000
+# Pass --port to target a server that is already running on --db.
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import database
+from benchmarks.common import seed_customers, SEED_PASSWORD
+from models.money import Money
+from api.server import BankServer
+
+MIX = [("GET", "/balance", None), ("POST", "/operations", "wallet_deposit"),
+       ("POST", "/operations", "wallet_withdraw"), ("GET", "/history?limit=20", None)]
+
+
+class Client:
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.token = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, body=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(payload)}\r\n"
+        if self.token:
+            head += f"Authorization: Bearer {self.token}\r\n"
+        self.writer.write(head.encode() + b"\r\n" + payload)
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        self.writer.close()
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+async def sign_in_client(host, port, name, errors):
+    client = Client(host, port)
+    await client.connect()
+    status, body = await client.request("POST", "/signin", {"name": name, "password": SEED_PASSWORD, "role": "customer"})
+    if status != 200:
+        errors.append(status)
+        client.close()
+        return None
+    client.token = body["token"]
+    return client
+
+
+async def run_client(client, count, latencies, errors, rng):
+    for _ in range(count):
+        method, path, operation = rng.choice(MIX)
+        body = {"operation": operation, "amount": str(Money(rng.randrange(100, 5000)))} if operation else None
+        started = time.perf_counter()
+        status, _ = await client.request(method, path, body)
+        latencies.append(time.perf_counter() - started)
+        # 409 is an expected insufficient-funds answer, not a failure
+        if status not in (200, 409):
+            errors.append(status)
+    client.close()
+
+
+async def main_async(args):
+    server = None
+    port = args.port
+    if port is None:
+        server = await BankServer().serve("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+    customers = await asyncio.get_running_loop().run_in_executor(None, seed_customers, args.clients)
+    latencies, errors = [], []
+    rng = random.Random(7)
+    per_client = max(1, args.requests // args.clients)
+    # Sign-ins pay for bcrypt and are timed apart from the request mix
+    started = time.perf_counter()
+    clients = await asyncio.gather(*(sign_in_client("127.0.0.1", port, c.name, errors) for c in customers))
+    sign_in_elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    await asyncio.gather(*(run_client(c, per_client, latencies, errors, rng) for c in clients if c))
+    elapsed = time.perf_counter() - started
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    latencies.sort()
+    print(f"requests: {len(latencies)}  errors: {len(errors)}  clients: {args.clients}  sign-in: {sign_in_elapsed:.2f}s")
+    if latencies:
+        print(f"req/s: {len(latencies) / elapsed:.0f}")
+        print(f"p50: {percentile(latencies, 50) * 1000:.2f} ms  p99: {percentile(latencies, 99) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API load generator")
+    parser.add_argument("--db", help="database file (default: a fresh temporary file)")
+    parser.add_argument("--port", type=int, help="target an already running server instead of starting one")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    path = args.db
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="bank_load_", suffix=".db")
+        os.close(fd)
+    database.configure(path, size=max(database.pool.size, 16))
+    database.create_tables()
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        database.pool.close()
+        if args.db is None:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    main()
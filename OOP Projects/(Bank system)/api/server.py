@@ -0,0 +1,326 @@
+# api/server.py
+# asyncio HTTP/JSON front end over the services layer. Each connection is
+# handled on the event loop; SQLite and bcrypt calls run on a thread pool sized
+# to the connection pool, and the ledger's BEGIN IMMEDIATE transactions keep
+# concurrent writers consistent.
+# Run from the project folder: python -m api.server --port 8080
+import argparse
+import asyncio
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit, parse_qs
+import database
+from database import create_tables
+from models import journal, scheduler
+from models.models import Admin, HISTORY_PAGE_SIZE, CUSTOMER_PAGE_SIZE
+from models.money import Money
+from services import auth, accounts, admin as admin_service
+from utils import metrics, session
+from utils.logger import log_action
+
+MAX_BODY = 64 * 1024
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
+           404: "Not Found", 409: "Conflict", 413: "Payload Too Large", 429: "Too Many Requests",
+           500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def page_params(query, maximum, cursor):
+    # (limit clamped to 1..maximum, keyset cursor or None) from the query string;
+    # cursor is the (text field, id field) pair that continues a page
+    try:
+        limit = max(1, min(int(query.get("limit", maximum)), maximum))
+        after = None
+        if cursor[0] in query and cursor[1] in query:
+            after = (query[cursor[0]], int(query[cursor[1]]))
+    except ValueError:
+        raise HTTPError(400, f"limit and {cursor[1]} must be integers.")
+    return limit, after
+
+
+class BankServer:
+    def __init__(self, workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers or database.pool.size, thread_name_prefix="bank-api")
+        self.routes = {
+            ("POST", "signin"): self.signin,
+            ("GET", "balance"): self.balance,
+            ("POST", "operations"): self.operation,
+            ("POST", "transfers"): self.transfer,
+            ("GET", "history"): self.history,
+            ("POST", "schedules"): self.add_schedule,
+            ("GET", "schedules"): self.list_schedules,
+            ("DELETE", "schedules"): self.cancel_schedule,
+            ("GET", "customers"): self.list_customers,
+            ("POST", "customers"): self.add_customer,
+            ("POST", "lock"): partial(self.account_action, admin_service.lock),
+            ("POST", "unlock"): partial(self.account_action, admin_service.unlock),
+            ("DELETE", "customers"): partial(self.account_action, admin_service.delete),
+            ("GET", "cache"): self.cache_stats,
+            ("GET", "metrics"): self.metrics,
+        }
+
+    async def blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def current_user(self, headers, user_type):
+        token = headers.get("authorization", "").removeprefix("Bearer ").strip()
+        # Restored sessions load their user and expiry deletes a persisted row, so off the loop
+        user = await self.blocking(auth.user_for_token, token)
+        if user is None:
+            raise HTTPError(401, "Sign in first.")
+        if (user_type == "admin") != isinstance(user, Admin):
+            raise HTTPError(403, f"Only {user_type}s can do this.")
+        return user
+
+    # Handlers take (request dict) and return (status, json-able body)
+
+    async def signin(self, req):
+        body = req["body"]
+        role = body.get("role", "customer")
+        if role not in auth.USER_CLASSES:
+            raise HTTPError(400, "Unknown role.")
+        try:
+            user = await self.blocking(auth.sign_in, body.get("name", ""), body.get("password", ""), role, req["source"])
+        except auth.LoginThrottledError as e:
+            raise HTTPError(429, str(e))
+        except auth.AccountLockedError as e:
+            raise HTTPError(403, str(e))
+        if user is None:
+            raise HTTPError(401, "Invalid credentials.")
+        # Persisted sessions INSERT (and evictions DELETE), so off the loop
+        token = await self.blocking(auth.issue_token, user)
+        return 200, {"token": token, "user_id": user.id}
+
+    async def balance(self, req):
+        user = await self.current_user(req["headers"], "customer")
+        found = await self.blocking(accounts.balances, user.id)
+        if found is None:
+            # The customer was deleted while the session was still live
+            raise HTTPError(404, "No such customer.")
+        credit, wallet = found
+        return 200, {"credit": str(credit), "wallet_balance": str(wallet)}
+
+    async def operation(self, req):
+        user = await self.current_user(req["headers"], "customer")
+        body = req["body"]
+        try:
+            # Amounts travel as decimal strings (or JSON numbers) and are parsed exactly
+            amount = Money.parse(body.get("amount"))
+            succeeded = await self.blocking(accounts.apply, user.id, body.get("operation"), amount)
+        except (TypeError, ValueError) as e:
+            raise HTTPError(400, str(e))
+        log_action(user.id, body.get("operation"), "success" if succeeded else "failed", source="api")
+        if not succeeded:
+            raise HTTPError(409, "Insufficient funds.")
+        return 200, {"status": "success"}
+
+    async def transfer(self, req):
+        user = await self.current_user(req["headers"], "customer")
+        body = req["body"]
+        try:
+            amount = Money.parse(body.get("amount"))
+            sent = await self.blocking(accounts.transfer, user.id, int(body.get("recipient_id")), amount)
+        except accounts.UnknownAccountError as e:
+            raise HTTPError(404, str(e))
+        except (TypeError, ValueError) as e:
+            raise HTTPError(400, str(e))
+        log_action(user.id, "transfer", "success" if sent else "failed", recipient_id=body.get("recipient_id"), source="api")
+        if not sent:
+            raise HTTPError(409, "Insufficient funds.")
+        return 200, {"status": "success"}
+
+    async def history(self, req):
+        user = await self.current_user(req["headers"], "customer")
+        limit, before = page_params(req["query"], HISTORY_PAGE_SIZE, ("before_ts", "before_id"))
+        rows = await self.blocking(accounts.history, user.id, limit, before)
+        return 200, {"transactions": [{"id": r[0], "type": r[1], "amount": str(r[2]), "status": r[3], "timestamp": r[4]} for r in rows]}
+
+    async def add_schedule(self, req):
+        user = await self.current_user(req["headers"], "customer")
+        body = req["body"]
+        try:
+            amount = Money.parse(body.get("amount"))
+            schedule_id = await self.blocking(accounts.schedule, user.id, body.get("operation"), amount,
+                                              body.get("start_at"), body.get("every"))
+        except (TypeError, ValueError) as e:
+            raise HTTPError(400, str(e))
+        log_action(user.id, "schedule", "success", schedule_id=schedule_id, source="api")
+        return 201, {"schedule_id": schedule_id}
+
+    async def list_schedules(self, req):
+        user = await self.current_user(req["headers"], "customer")
+        rows = await self.blocking(accounts.schedules, user.id)
+        return 200, {"schedules": [
+            {"id": r[0], "operation": r[1], "amount": str(r[2]), "every": r[3], "next_run_at": r[4], "runs": r[5],
+             "last_run_at": r[6], "last_status": r[7]} for r in rows]}
+
+    async def cancel_schedule(self, req):
+        user = await self.current_user(req["headers"], "customer")
+        try:
+            schedule_id = int(req["query"].get("id"))
+        except (TypeError, ValueError):
+            raise HTTPError(400, "No schedule id given.")
+        if not await self.blocking(accounts.cancel_schedule, user.id, schedule_id):
+            raise HTTPError(404, "No such active schedule.")
+        return 200, {"status": "success"}
+
+    async def list_customers(self, req):
+        admin = await self.current_user(req["headers"], "admin")
+        limit, after = page_params(req["query"], CUSTOMER_PAGE_SIZE, ("after_name", "after_id"))
+        rows = await self.blocking(admin_service.list_customers, admin, limit, after, req["query"].get("search"))
+        return 200, {"customers": [dict(zip(("id", "name", "national_id", "phone_number", "is_locked"), r)) for r in rows]}
+
+    async def cache_stats(self, req):
+        admin = await self.current_user(req["headers"], "admin")
+        return 200, admin_service.cache_stats(admin)
+
+    async def metrics(self, req):
+        await self.current_user(req["headers"], "admin")
+        return 200, metrics.snapshot()
+
+    async def add_customer(self, req):
+        await self.current_user(req["headers"], "admin")
+        body = req["body"]
+        try:
+            customer = await self.blocking(admin_service.add_customer, body.get("name"), body.get("national_id"),
+                                           body.get("phone_number"), body.get("password", ""))
+        except (admin_service.MissingFieldError, admin_service.WeakPasswordError) as e:
+            raise HTTPError(400, str(e))
+        except sqlite3.IntegrityError:
+            raise HTTPError(409, "National ID already registered.")
+        return 201, {"user_id": customer.id}
+
+    async def account_action(self, action, req):
+        admin = await self.current_user(req["headers"], "admin")
+        if req["user_id"] is None:
+            raise HTTPError(404, "No customer given.")
+        # Only customers: admin accounts and unknown ids are not found
+        if await self.blocking(admin.get_customer, req["user_id"]) is None:
+            raise HTTPError(404, "No such customer.")
+        await self.blocking(action, admin, req["user_id"])
+        return 200, {"status": "success"}
+
+    def route(self, method, path):
+        # /customers/<id>/lock -> ("lock", id); /customers/<id> -> ("customers", id)
+        parts = [p for p in path.split("/") if p]
+        user_id = None
+        if len(parts) >= 2 and parts[0] == "customers" and parts[1].isdigit():
+            user_id = int(parts[1])
+            parts = parts[2:] or ["customers"]
+        if len(parts) != 1:
+            raise HTTPError(404, "Not found.")
+        handler = self.routes.get((method, parts[0]))
+        if handler is None:
+            raise HTTPError(404, "Not found.")
+        return handler, user_id
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        source = peer[0] if peer else "unknown"
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {"error": "Body too large."}, False)
+                    break
+                raw = await reader.readexactly(length) if length else b""
+                status, body = await self.dispatch(method, target, headers, raw, source)
+                await self.respond(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, headers, raw, source):
+        url = urlsplit(target)
+        try:
+            handler, user_id = self.route(method, url.path)
+            try:
+                body = json.loads(raw) if raw else {}
+            except ValueError:
+                raise HTTPError(400, "Body must be JSON.")
+            if not isinstance(body, dict):
+                raise HTTPError(400, "Body must be a JSON object.")
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            return await handler({"headers": headers, "body": body, "query": query, "user_id": user_id, "source": source})
+        except HTTPError as e:
+            return e.status, {"error": e.message}
+        except Exception as e:
+            # Details go to the log, never to the client
+            log_action(None, "api_error", "failed", method=method, path=url.path, error=f"{type(e).__name__}: {e}", source=source)
+            return 500, {"error": "Internal error."}
+
+    async def respond(self, writer, status, body, keep_alive):
+        payload = json.dumps(body).encode()
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode() + payload)
+        await writer.drain()
+
+    async def serve(self, host, port):
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+async def run(host, port, persist_sessions=False, group_commit_ms=None, durability="full", run_scheduler=False):
+    await asyncio.get_running_loop().run_in_executor(None, create_tables)
+    if run_scheduler:
+        scheduler.enable()
+    if group_commit_ms is not None:
+        journal.enable(flush_interval_ms=group_commit_ms, durability=durability)
+    if persist_sessions:
+        restored = session.configure(persist=True).load()
+        print(f"Restored {restored} sessions")
+    session.store.start_timer()
+    server = await BankServer().serve(host, port)
+    print(f"Serving on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nile Valley Bank HTTP/JSON API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--persist-sessions", action="store_true", help="keep sessions in SQLite across restarts")
+    parser.add_argument("--group-commit-ms", type=float,
+                        help="batch ledger writes into one commit every this many ms")
+    parser.add_argument("--durability", choices=tuple(journal.DURABILITY), default="full",
+                        help="sync level for group commits (see models/journal.py)")
+    parser.add_argument("--scheduler", action="store_true",
+                        help="run scheduled operations in this process (see models/scheduler.py)")
+    args = parser.parse_args()
+    metrics.configure_from_env()
+    try:
+        asyncio.run(run(args.host, args.port, args.persist_sessions, args.group_commit_ms, args.durability, args.scheduler))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.disable()
+        journal.disable()
+
+
+if __name__ == "__main__":
+    main()
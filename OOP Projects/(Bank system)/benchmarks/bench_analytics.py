@@ -0,0 +1,79 @@
+# benchmarks/bench_analytics.py
+# Time to load the ledger's columns and run each analytics report, against
+# the same totals computed by iterating Python rows. Planted anomalies (one
+# customer's spike day, another's burst of failed withdrawals) must be flagged.
+# Run from the project folder: python -m benchmarks.bench_analytics --rows 10000000
+import argparse, datetime, time
+import sharding
+from services import analytics
+from benchmarks.common import temp_database, remove_database, seed_customers, seed_transactions
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def python_totals():
+    # The row-at-a-time equivalent of analytics.type_volume
+    totals = {}
+    for db in sharding.pools():
+        with db.connection() as conn:
+            for type, amount, status in conn.execute("SELECT type, amount, status FROM transactions"):
+                count, failed, volume = totals.get(type, (0, 0, 0))
+                ok = status in analytics.SUCCESS
+                totals[type] = (count + 1, failed + (not ok), volume + (amount if ok else 0))
+    return totals
+
+
+def plant(spiker, prober):
+    noon = datetime.datetime.now().replace(hour=12, minute=0, second=0, microsecond=0) - datetime.timedelta(days=1)
+    rows = [(spiker, "credit_deposit", 10**9, "success", noon.isoformat())]
+    rows += [(prober, "wallet_withdraw", 50000, "failed", (noon + datetime.timedelta(minutes=3 * i)).isoformat())
+             for i in range(analytics.BURST_ATTEMPTS * 2)]
+    for user_id, *row in rows:
+        with sharding.transaction(user_id) as conn:
+            conn.execute("INSERT INTO transactions (user_id, type, amount, status, timestamp) VALUES (?, ?, ?, ?, ?)",
+                         (user_id, *row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analytics scan benchmark")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--chunk-size", type=int, default=analytics.CHUNK_SIZE)
+    parser.add_argument("--python", action="store_true", help="also time the row-at-a-time totals")
+    args = parser.parse_args()
+
+    path = temp_database()
+    try:
+        users = [c.id for c in seed_customers(args.customers)]
+        seed_transactions(users, args.rows, chunk_size=200000)
+        plant(users[0], users[1])
+
+        columns, load = timed(lambda: analytics.load(chunk_size=args.chunk_size))
+        print(f"{'step':>24} {'seconds':>9}")
+        print(f"{'load ' + format(len(columns.user_id), ','):>24} {load:>9.2f}")
+        results = {}
+        for name in ("type_volume", "daily_totals", "top_customers", "amount_spikes", "failed_withdraw_bursts"):
+            results[name], seconds = timed(lambda: getattr(analytics, name)(columns))
+            print(f"{name:>24} {seconds:>9.2f}")
+        report, total = timed(analytics.report)
+        print(f"{'report':>24} {total:>9.2f}   ({len(columns.user_id) / total:,.0f} rows/s)")
+        if args.python:
+            totals, seconds = timed(python_totals)
+            print(f"{'python type totals':>24} {seconds:>9.2f}")
+            expected = sorted((t, c, f, v) for t, (c, f, v) in totals.items())
+            found = sorted((t, c, f, v.cents) for t, c, f, _, v in results["type_volume"])
+            print("type totals match" if expected == found else f"type totals differ: {expected} != {found}")
+
+        spikes = {row[0] for row in results["amount_spikes"]}
+        bursts = {row[0] for row in results["failed_withdraw_bursts"]}
+        print(f"spike flagged: {users[0] in spikes}  burst flagged: {users[1] in bursts}")
+    finally:
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
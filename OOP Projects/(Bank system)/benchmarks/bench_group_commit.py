@@ -0,0 +1,39 @@
+# benchmarks/bench_group_commit.py
+# Sustained deposits/sec from many threads: one commit per operation against
+# the group-commit journal at each durability level.
+# Run from the project folder: python -m benchmarks.bench_group_commit --threads 32
+import argparse
+from models import journal
+from models.ledger import ledger
+from benchmarks.common import temp_database, remove_database, seed_customers, run_threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Group commit benchmark")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--ops", type=int, default=200, help="deposits per thread")
+    parser.add_argument("--interval-ms", type=float, default=journal.FLUSH_INTERVAL_MS)
+    parser.add_argument("--max-batch", type=int, default=journal.MAX_BATCH)
+    args = parser.parse_args()
+
+    path = temp_database(pool_size=args.threads)
+    try:
+        customers = seed_customers(args.threads)
+        # Pool connections use SQLite's default synchronous level, FULL
+        modes = [("commit per op", None), ("group, full", "full"), ("group, normal", "normal")]
+        print(f"{'mode':>16} {'deposits/sec':>14} {'mean batch':>11}")
+        for label, durability in modes:
+            if durability:
+                journal.enable(flush_interval_ms=args.interval_ms, max_batch=args.max_batch, durability=durability)
+            try:
+                rate = run_threads(args.threads, args.ops, lambda t, i: customers[t].deposit_to_wallet(100))
+                mean = ledger.journal.stats()["mean_batch"] if ledger.journal else 1
+            finally:
+                journal.disable()
+            print(f"{label:>16} {rate:>14.0f} {mean:>11}")
+    finally:
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
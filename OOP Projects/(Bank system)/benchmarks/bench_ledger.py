@@ -0,0 +1,49 @@
+# benchmarks/bench_ledger.py
+# Ledger ops/sec: the old commit-per-statement flow against one BEGIN IMMEDIATE per operation.
+# Run from the project folder: python -m benchmarks.bench_ledger --ops 2000
+import argparse, datetime, time
+import database
+from benchmarks.common import temp_database, remove_database, seed_customers
+
+
+def legacy_operation(user_id, amount):
+    # Mirrors the pre-ledger Customer.withdraw_from_wallet: SELECT, UPDATE and
+    # transaction INSERT each committed on their own
+    with database.connection() as conn:
+        current = conn.execute("SELECT wallet_balance FROM customers WHERE user_id = ?", (user_id,)).fetchone()[0]
+        if current >= amount:
+            conn.execute("UPDATE customers SET wallet_balance = wallet_balance - ? WHERE user_id = ?", (amount, user_id))
+            status = "success"
+        else:
+            status = "failed"
+        conn.execute("INSERT INTO transactions (user_id, type, amount, status, timestamp) VALUES (?, ?, ?, ?, ?)",
+                     (user_id, "wallet_withdraw", amount, status, datetime.datetime.now().isoformat()))
+
+
+def measure(ops, operation):
+    started = time.perf_counter()
+    for i in range(ops):
+        operation(i)
+    return ops / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-commit ledger benchmark")
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+
+    path = temp_database()
+    try:
+        customer = seed_customers(1, wallet=args.ops * 200)[0]
+        before = measure(args.ops, lambda i: legacy_operation(customer.id, 100))
+        after = measure(args.ops, lambda i: customer.withdraw_from_wallet(100))
+        print(f"{'flow':>10} {'ops/sec':>10}")
+        print(f"{'before':>10} {before:>10.0f}")
+        print(f"{'after':>10} {after:>10.0f}")
+        print(f"speed-up: {after / before:.2f}x")
+    finally:
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# benchmarks/bench_money.py
+# Float (REAL) against integer-cents ledger: ops/sec, SUM aggregate time and
+# the rounding drift each one accumulates over many small deposits.
+# Run from the project folder: python -m benchmarks.bench_money --ops 20000
+import argparse, datetime, os, sqlite3, tempfile, time
+from models.ledger import OPERATIONS
+
+SCHEMA = '''
+    CREATE TABLE customers (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE,
+                            credit {type} DEFAULT 0, wallet_balance {type} DEFAULT 0);
+    CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, type TEXT,
+                               amount {type}, status TEXT, timestamp TEXT);
+    CREATE INDEX idx_transactions_user_time ON transactions (user_id, timestamp);
+'''
+DEPOSIT_CENTS = 10  # $0.10, the classic value float cannot represent
+
+
+def run(column_type, amount, ops, batch):
+    fd, path = tempfile.mkstemp(prefix="bank_money_", suffix=".db")
+    os.close(fd)
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(SCHEMA.format(type=column_type))
+        conn.execute("INSERT INTO customers (user_id) VALUES (1)")
+        timestamp = datetime.datetime.now().isoformat()
+        started = time.perf_counter()
+        for done in range(0, ops, batch):
+            conn.execute("BEGIN IMMEDIATE")
+            for _ in range(min(batch, ops - done)):
+                conn.execute(OPERATIONS["credit_deposit"], {"amount": amount, "user_id": 1})
+                conn.execute("INSERT INTO transactions (user_id, type, amount, status, timestamp) VALUES (1, 'credit_deposit', ?, 'success', ?)",
+                             (amount, timestamp))
+            conn.execute("COMMIT")
+        rate = ops / (time.perf_counter() - started)
+        started = time.perf_counter()
+        for _ in range(20):
+            total = conn.execute("SELECT SUM(amount) FROM transactions WHERE user_id = 1").fetchone()[0]
+        sum_ms = (time.perf_counter() - started) / 20 * 1000
+        balance = conn.execute("SELECT credit FROM customers WHERE user_id = 1").fetchone()[0]
+        return rate, sum_ms, balance, total
+    finally:
+        conn.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Float vs integer-cents ledger benchmark")
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=100, help="deposits per transaction")
+    args = parser.parse_args()
+
+    expected = args.ops * DEPOSIT_CENTS
+    print(f"{'storage':>8} {'ops/sec':>10} {'SUM ms':>8} {'balance drift (cents)':>22}")
+    for label, column_type, amount in (("REAL", "REAL", DEPOSIT_CENTS / 100), ("INTEGER", "INTEGER", DEPOSIT_CENTS)):
+        rate, sum_ms, balance, total = run(column_type, amount, args.ops, args.batch)
+        cents = balance * 100 if column_type == "REAL" else balance
+        print(f"{label:>8} {rate:>10.0f} {sum_ms:>8.2f} {cents - expected:>22.6g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# benchmarks/bench_onboarding.py
+# Customers/sec added one at a time through admin.add_customer against the
+# bulk CSV import, at the configured bcrypt cost.
+# Run from the project folder: python -m benchmarks.bench_onboarding --rows 2000
+import argparse
+import csv
+import os
+import tempfile
+import time
+from services import admin, onboarding
+from benchmarks.common import temp_database, remove_database
+
+PASSWORD = "Onboard1234"
+
+
+def write_csv(path, rows, prefix):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(onboarding.FIELDS)
+        writer.writerows((f"{prefix}{i}", f"{prefix}{i:09d}", "0100000000", PASSWORD) for i in range(rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk onboarding benchmark")
+    parser.add_argument("--rows", type=int, default=2000, help="customers in the bulk import")
+    parser.add_argument("--single", type=int, default=50, help="customers added one at a time")
+    parser.add_argument("--workers", type=int, default=None, help="hashing processes (default: one per core)")
+    parser.add_argument("--chunk-size", type=int, default=onboarding.CHUNK_SIZE)
+    args = parser.parse_args()
+
+    path = temp_database()
+    fd, source = tempfile.mkstemp(prefix="bank_onboard_", suffix=".csv")
+    os.close(fd)
+    try:
+        started = time.perf_counter()
+        for i in range(args.single):
+            admin.add_customer(f"single{i}", f"S{i:09d}", "0100000000", PASSWORD)
+        single = args.single / (time.perf_counter() - started)
+
+        write_csv(source, args.rows, "B")
+        started = time.perf_counter()
+        added, errors = onboarding.import_customers(source, args.workers, args.chunk_size)
+        bulk = added / (time.perf_counter() - started)
+
+        print(f"{'mode':>12} {'customers/sec':>14}")
+        print(f"{'one by one':>12} {single:>14.1f}")
+        print(f"{'bulk import':>12} {bulk:>14.1f}   ({added} added, {len(errors)} rejected, {os.cpu_count()} cores)")
+    finally:
+        os.remove(source)
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+# benchmarks/bench_pool.py
+# Deposits/sec on a file-backed database as worker threads go from 1 to N.
+# Run from the project folder: python -m benchmarks.bench_pool --threads 8
+import argparse
+from benchmarks.common import temp_database, remove_database, seed_customers, run_threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Connection pool scaling benchmark")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=500, help="deposits per thread")
+    args = parser.parse_args()
+
+    path = temp_database(pool_size=args.threads)
+    try:
+        customers = seed_customers(args.threads)
+        print(f"{'threads':>8} {'deposits/sec':>14}")
+        threads = 1
+        while threads <= args.threads:
+            rate = run_threads(threads, args.ops, lambda t, i: customers[t].deposit_to_wallet(100))
+            print(f"{threads:>8} {rate:>14.0f}")
+            threads *= 2
+    finally:
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# benchmarks/bench_scheduler.py
+# Cost of the heap-based scheduler with a large schedules table: reading the
+# heap's window, pushing new entries, and running due operations. The due
+# schedules started some days ago, so each must catch up every missed daily
+# run; two schedulers race over them and every run must happen exactly once.
+# Run from the project folder: python -m benchmarks.bench_scheduler --schedules 1000000
+import argparse, datetime, threading, time
+import sharding
+from models import scheduler
+from benchmarks.common import temp_database, remove_database, seed_customers
+
+AMOUNT = 100
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def seed_schedules(user_ids, count, due, catch_up_days):
+    # count schedules spread over the next year, the first due of them daily
+    # deposits that started catch_up_days ago (just over, so today's run is due too)
+    now = datetime.datetime.now().replace(microsecond=0)
+    started = (now - datetime.timedelta(days=catch_up_days, seconds=60)).isoformat()
+    created = now.isoformat()
+    for low in range(0, count, 100_000):
+        by_shard = {}
+        for i in range(low, min(low + 100_000, count)):
+            user_id = user_ids[i % len(user_ids)]
+            if i < due:
+                row = (user_id, "wallet_deposit", AMOUNT, "day", started, started, created)
+            else:
+                start = (now + datetime.timedelta(seconds=600 + i * 31_536_000 // count)).isoformat()
+                row = (user_id, "wallet_deposit", AMOUNT, "month", start, start, created)
+            by_shard.setdefault(sharding.index(user_id), []).append(row)
+        for k, rows in sorted(by_shard.items()):
+            with sharding.pools()[k].transaction() as conn:
+                conn.executemany("INSERT INTO schedules (user_id, operation, amount, every, start_at, next_run_at, created_at) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def totals():
+    runs = wallets = 0
+    for db in sharding.pools():
+        with db.connection() as conn:
+            runs += conn.execute("SELECT COALESCE(SUM(runs), 0) FROM schedules").fetchone()[0]
+            wallets += conn.execute("SELECT COALESCE(SUM(wallet_balance), 0) FROM customers").fetchone()[0]
+    return runs, wallets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduler benchmark")
+    parser.add_argument("--schedules", type=int, default=1_000_000)
+    parser.add_argument("--due", type=int, default=20_000, help="schedules that are due now")
+    parser.add_argument("--catch-up-days", type=int, default=3, help="daily runs each due schedule has missed")
+    parser.add_argument("--customers", type=int, default=10_000)
+    parser.add_argument("--heap-limit", type=int, default=scheduler.HEAP_LIMIT)
+    parser.add_argument("--batch-size", type=int, default=scheduler.BATCH_SIZE)
+    parser.add_argument("--shards", type=int, default=1)
+    args = parser.parse_args()
+
+    path = temp_database()
+    try:
+        users = [c.id for c in seed_customers(args.customers)]
+        if args.shards > 1:
+            sharding.rebalance(args.shards)
+        _, seconds = timed(lambda: seed_schedules(users, args.schedules, args.due, args.catch_up_days))
+        print(f"seeded {args.schedules:,} schedules in {seconds:.2f}s ({args.due:,} due, {args.shards} shards)")
+
+        options = dict(heap_limit=args.heap_limit, batch_size=args.batch_size, start=False)
+        probe = scheduler.Scheduler(**options)
+        _, seconds = timed(probe.resync)
+        stats = probe.stats()
+        print(f"resync: {seconds:.2f}s  heap {stats['heap']:,} of {args.schedules:,} entries  horizon {stats['horizon']}")
+
+        # Entries inside the horizon, as new schedules and next runs are pushed
+        first = probe.heap[0][0]
+        entries = [(first, -i, users[i % len(users)], 0) for i in range(1, 100_001)]
+        _, seconds = timed(lambda: [probe.push(entry) for entry in entries])
+        print(f"push: {seconds / len(entries) * 1e6:.2f} us per entry at heap size {len(probe.heap):,}")
+
+        # Two schedulers race over the due runs, catching up every missed day
+        schedulers = [scheduler.Scheduler(**options) for _ in range(2)]
+        counts = [0, 0]
+
+        def work(k):
+            counts[k] = schedulers[k].run_pending()
+        threads = [threading.Thread(target=work, args=(k,)) for k in range(2)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+        expected = args.due * (args.catch_up_days + 1)
+        print(f"due runs: {sum(counts):,} in {seconds:.2f}s ({sum(counts) / seconds:,.0f} runs/s), "
+              f"split {counts[0]:,}/{counts[1]:,}, {sum(s.stats()['stale'] for s in schedulers):,} stale")
+
+        again = scheduler.Scheduler(**options).run_pending()
+        runs, wallets = totals()
+        ok = sum(counts) == runs == expected and again == 0 and wallets == expected * AMOUNT
+        print(f"runs {runs:,} (expected {expected:,}), rerun {again}, wallets {wallets:,} cents: "
+              f"{'exactly once' if ok else 'MISMATCH'}")
+    finally:
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# benchmarks/bench_sharding.py
+# Sustained deposits/sec from many threads with customer data in one file
+# against several shard files, each with and without group commit. Shards
+# help where threads queue on the single writer lock, i.e. commit per op.
+# Run from the project folder: python -m benchmarks.bench_sharding --threads 32 --shards 4
+import argparse
+import sharding
+from models import journal
+from benchmarks.common import temp_database, remove_database, seed_customers, run_threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharding benchmark")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--ops", type=int, default=200, help="deposits per thread")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--interval-ms", type=float, default=journal.FLUSH_INTERVAL_MS)
+    args = parser.parse_args()
+
+    path = temp_database(pool_size=args.threads)
+    try:
+        customers = seed_customers(args.threads)
+        print(f"{'files':>6} {'mode':>14} {'deposits/sec':>14}")
+        for count in sorted({1, args.shards}):
+            sharding.rebalance(count)
+            for label, group in (("commit per op", False), ("group commit", True)):
+                if group:
+                    journal.enable(flush_interval_ms=args.interval_ms)
+                try:
+                    rate = run_threads(args.threads, args.ops, lambda t, i: customers[t].deposit_to_wallet(100))
+                finally:
+                    journal.disable()
+                print(f"{count:>6} {label:>14} {rate:>14.0f}")
+    finally:
+        remove_database(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/check_cache_coherence.py
+# Hammers the balance and user caches with concurrent writers and readers and
+# fails if any read returns data older than the reader's own last write, or if
+# the cache disagrees with the database at the end.
+# Run from the project folder: python -m benchmarks.check_cache_coherence --threads 8
+import argparse, random, sys, threading
+import database
+from models import cache
+from models.ledger import EFFECTS
+from models.models import find_user
+from services import accounts
+from benchmarks.common import temp_database, remove_database, seed_customers, run_threads
+
+OPERATIONS = ("credit_deposit", "wallet_deposit", "credit_withdraw", "wallet_withdraw", "wallet_to_credit", "credit_to_wallet")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent cache coherence check")
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=2000, help="operations per thread")
+    args = parser.parse_args()
+
+    path = temp_database(pool_size=args.threads * 2 + 2)
+    errors = []
+    try:
+        customers = [c.id for c in seed_customers(args.customers, credit=10000, wallet=10000)]
+        # Each writer owns a disjoint set of customers, so it knows their exact balances
+        owned = [customers[t::args.threads] for t in range(args.threads)]
+        expected = {u: [10000, 10000] for u in customers}
+        stop = threading.Event()
+
+        def reader():
+            rng = random.Random()
+            while not stop.is_set():
+                user_id = rng.choice(customers)
+                accounts.balances(user_id)
+                find_user(user_id)
+
+        def lock_toggler():
+            # Profile writes racing profile reads
+            rng = random.Random(7)
+            while not stop.is_set():
+                user_id = rng.choice(customers)
+                with database.transaction() as conn:
+                    conn.execute("UPDATE users SET phone_number = ? WHERE id = ?", (str(rng.random()), user_id))
+                    database.after_commit(lambda: cache.invalidate_user(user_id))
+
+        def work(t, i):
+            rng = random.Random(t * 1000003 + i)
+            user_id = rng.choice(owned[t])
+            op = rng.choice(OPERATIONS)
+            amount = rng.randrange(1, 3000)
+            if accounts.apply(user_id, op, amount):
+                credit_sign, wallet_sign, _ = EFFECTS[op]
+                expected[user_id][0] += credit_sign * amount
+                expected[user_id][1] += wallet_sign * amount
+            seen = accounts.balances(user_id)
+            if (seen[0].cents, seen[1].cents) != tuple(expected[user_id]):
+                errors.append(("stale read", user_id, seen, tuple(expected[user_id])))
+
+        background = [threading.Thread(target=reader) for _ in range(args.threads)]
+        background.append(threading.Thread(target=lock_toggler))
+        for thread in background:
+            thread.start()
+        try:
+            rate = run_threads(args.threads, args.ops, work)
+        finally:
+            stop.set()
+            for thread in background:
+                thread.join()
+
+        with database.connection() as conn:
+            stored = {row[0]: tuple(row[1:]) for row in conn.execute("SELECT user_id, credit, wallet_balance FROM customers")}
+            users = {row[0]: row for row in conn.execute("SELECT * FROM users")}
+        for user_id, value in list(cache.balances.entries.items()):
+            if isinstance(value, tuple) and tuple(value) != stored[user_id]:
+                errors.append(("balance cache drift", user_id, value, stored[user_id]))
+        for user_id, value in list(cache.users.entries.items()):
+            if isinstance(value, tuple) and tuple(value) != tuple(users[user_id]):
+                errors.append(("user cache drift", user_id, value, users[user_id]))
+    finally:
+        remove_database(path)
+
+    for error in errors[:20]:
+        print(*error)
+    for name, stats in cache.stats().items():
+        print(f"{name:9s} {stats}")
+    print(f"{rate:,.0f} ops/s  {len(errors)} coherence errors")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
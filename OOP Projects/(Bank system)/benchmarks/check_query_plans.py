@@ -0,0 +1,31 @@
+# benchmarks/check_query_plans.py
+# Seeds a large ledger and fails if any hot query plan falls back to a full scan.
+# Run from the project folder: python -m benchmarks.check_query_plans --transactions 1000000
+import argparse, sys
+from migrations import full_scans, HOT_QUERIES
+from benchmarks.common import temp_database, remove_database, seed_customers, seed_transactions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN QUERY PLAN check for hot queries")
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--transactions", type=int, default=1000000)
+    args = parser.parse_args()
+
+    path = temp_database()
+    try:
+        customers = seed_customers(args.customers)
+        # No ANALYZE: the app never gathers stats, so check the plans it really gets
+        seed_transactions([c.id for c in customers], args.transactions)
+        problems = full_scans()
+    finally:
+        remove_database(path)
+
+    for name, detail in problems:
+        print(f"FULL SCAN  {name}: {detail}")
+    print(f"{len(HOT_QUERIES) - len({p[0] for p in problems})}/{len(HOT_QUERIES)} hot queries use an index")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# benchmarks/check_transfers.py
+# Runs thousands of concurrent random customer-to-customer transfers and fails
+# if the bank's total money supply changes, a balance goes negative, a
+# transfer is missing either of its paired rows, or the snapshots drift from
+# the ledger. With --shards the customers are spread across shard files, so
+# most transfers cross shards and settle through the outbox; --rebalance-to
+# then moves them to another layout and checks everything again.
+# Run from the project folder: python -m benchmarks.check_transfers --threads 16
+import argparse, random, sys
+import sharding
+from models import journal, snapshots
+from models.ledger import ledger
+from services import accounts
+from benchmarks.common import temp_database, remove_database, seed_customers, run_threads
+
+OPENING_WALLET = 10000
+
+
+def money_supply():
+    def total(db):
+        with db.connection() as conn:
+            return conn.execute("SELECT COALESCE(SUM(credit + wallet_balance), 0) FROM customers").fetchone()[0]
+    return sum(sharding.fan_out(total))
+
+
+def check(sent, before, errors):
+    # Appends every broken invariant to errors; returns the money supply
+    after = money_supply()
+    if after != before:
+        errors.append(("money supply changed", before, after))
+
+    def scan(db):
+        with db.connection() as conn:
+            return (conn.execute("SELECT user_id, credit, wallet_balance FROM customers WHERE credit < 0 OR wallet_balance < 0").fetchall(),
+                    conn.execute("SELECT id, sender_id, recipient_id, amount, debit_id, credit_id FROM transfers").fetchall(),
+                    conn.execute("SELECT id, user_id, type, amount FROM transactions "
+                                 "WHERE status = 'success' AND type IN ('transfer_out', 'transfer_in', 'transfer_refund')").fetchall(),
+                    conn.execute("SELECT COUNT(*) FROM transfer_outbox").fetchone()[0])
+    negative, transfers, legs, outbox = [], [], {}, 0
+    for rows, pairs, found, pending in sharding.fan_out(scan):
+        negative += rows
+        transfers += pairs
+        legs.update((row[0], row[1:]) for row in found)
+        outbox += pending
+    errors.extend(("negative balance", *row) for row in negative)
+    if outbox:
+        errors.append(("unsettled transfers", outbox))
+    if len(transfers) != sent:
+        errors.append(("transfers rows", len(transfers), "expected", sent))
+    # Transfers rows sit with the sender; the credit may be in another shard
+    for transfer_id, sender, recipient, amount, debit_id, credit_id in transfers:
+        if (legs.get(debit_id) != (sender, "transfer_out", amount)
+                or legs.get(credit_id) != (recipient, "transfer_in", amount)):
+            errors.append(("unpaired transfer", transfer_id))
+    counts = [sum(leg[1] == kind for leg in legs.values()) for kind in ("transfer_out", "transfer_in")]
+    if counts != [len(transfers)] * 2:
+        errors.append(("transfer rows", counts, "expected", len(transfers)))
+    drift = {name: rows for name, rows in snapshots.verify().items() if rows}
+    if drift:
+        errors.append(("snapshot drift", {name: len(rows) for name, rows in drift.items()}))
+    return after
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent transfer invariant check")
+    parser.add_argument("--customers", type=int, default=50, help="fewer customers means more contention")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=500, help="transfers per thread")
+    parser.add_argument("--group-commit-ms", type=float, help="run through the group-commit journal")
+    parser.add_argument("--shards", type=int, default=1, help="spread customers across this many shard files")
+    parser.add_argument("--rebalance-to", type=int, help="afterwards, move to this many shards and check again")
+    args = parser.parse_args()
+
+    path = temp_database(pool_size=args.threads + 2)
+    errors = []
+    outcomes = {True: 0, False: 0}
+    try:
+        customers = [c.id for c in seed_customers(args.customers)]
+        # Opening balances go through the ledger so the snapshots can explain them
+        ledger.apply_batch((user_id, "wallet_deposit", OPENING_WALLET) for user_id in customers)
+        if args.shards > 1:
+            sharding.rebalance(args.shards)
+        before = money_supply()
+        if args.group_commit_ms is not None:
+            journal.enable(flush_interval_ms=args.group_commit_ms)
+
+        def work(t, i):
+            rng = random.Random(t * 1000003 + i)
+            sender, recipient = rng.sample(customers, 2)
+            # Up to a third of a wallet, so some senders run dry and fail
+            sent = accounts.transfer(sender, recipient, rng.randrange(1, OPENING_WALLET // 3))
+            outcomes[sent] += 1
+
+        try:
+            rate = run_threads(args.threads, args.ops, work)
+        finally:
+            journal.disable()
+
+        after = check(outcomes[True], before, errors)
+        if args.rebalance_to is not None:
+            sharding.rebalance(args.rebalance_to)
+            after = check(outcomes[True], before, errors)
+    finally:
+        remove_database(path)
+
+    for error in errors[:20]:
+        print(*error)
+    print(f"{rate:,.0f} transfers/s  {outcomes[True]} sent  {outcomes[False]} insufficient funds  "
+          f"supply {before} -> {after}  {args.shards} shards  {len(errors)} errors")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# benchmarks/common.py
+import os, sys, tempfile, time, threading, random, datetime
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import database
+import sharding
+from models import cache
+from models.models import Customer
+
+# One hash shared by every seeded user so seeding does not pay for bcrypt per row.
+# It uses the configured cost so sign-in does not trigger a rehash.
+SEED_PASSWORD = "Bench1234"
+SEED_HASH = Customer.hash_password(SEED_PASSWORD)
+
+
+def temp_database(pool_size=16, path=None):
+    # A fresh database at path (replacing any old one), or in a temp file
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="bank_bench_", suffix=".db")
+        os.close(fd)
+    else:
+        remove_database(path)
+    database.configure(path, size=pool_size)
+    database.create_tables()
+    cache.clear()
+    return path
+
+
+def remove_database(path):
+    sharding.close()
+    database.pool.close()
+    for base in [path] + sharding.shard_files(path):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(base + suffix):
+                os.remove(base + suffix)
+
+
+def seed_customers(count, credit=0, wallet=0):
+    # credit and wallet are int cents
+    with database.transaction() as conn:
+        start = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO users (name, national_id, phone_number, password, user_type) VALUES (?, ?, ?, ?, 'customer')",
+            ((f"bench{start + i}", f"NID{start + i:010d}", "0100000000", SEED_HASH) for i in range(1, count + 1))
+        )
+        rows = conn.execute("SELECT id, name, national_id, phone_number, password FROM users WHERE id > ?", (start,)).fetchall()
+        for db, user_ids in sharding.group(row[0] for row in rows):
+            with db.transaction() as shard:
+                shard.executemany(
+                    "INSERT INTO customers (user_id, credit, wallet_balance) VALUES (?, ?, ?)",
+                    ((user_id, credit, wallet) for user_id in user_ids)
+                )
+    return [Customer.from_row(row) for row in rows]
+
+
+def seed_transactions(user_ids, count, chunk_size=50000):
+    # Random history spread over the last ~3 years, inserted in large chunks
+    types = ("credit_deposit", "wallet_deposit", "credit_withdraw", "wallet_withdraw", "wallet_to_credit", "credit_to_wallet")
+    rng = random.Random(42)
+    now = datetime.datetime.now()
+    remaining = count
+    while remaining > 0:
+        n = min(chunk_size, remaining)
+        rows = [
+            (rng.choice(user_ids), rng.choice(types), rng.randrange(100, 50000),
+             "success" if rng.random() < 0.95 else "failed",
+             (now - datetime.timedelta(seconds=rng.randrange(94_000_000))).isoformat())
+            for _ in range(n)
+        ]
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(sharding.index(row[0]), []).append(row)
+        for k, shard_rows in sorted(by_shard.items()):
+            with sharding.pools()[k].transaction() as conn:
+                conn.executemany("INSERT INTO transactions (user_id, type, amount, status, timestamp) VALUES (?, ?, ?, ?, ?)", shard_rows)
+        remaining -= n
+
+
+def run_threads(thread_count, ops_per_thread, work):
+    # work(thread_index, op_index) is called ops_per_thread times on each thread
+    barrier = threading.Barrier(thread_count + 1)
+
+    def worker(index):
+        barrier.wait()
+        for i in range(ops_per_thread):
+            work(index, i)
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(thread_count)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return thread_count * ops_per_thread / elapsed
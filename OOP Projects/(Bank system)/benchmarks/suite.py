@@ -0,0 +1,165 @@
+# benchmarks/suite.py
+# End-to-end benchmark suite. For each database size it seeds customers and
+# transactions, then measures sign-in latency, Customer operation throughput
+# at each thread count, history page latency and admin listing time. Results
+# are written as JSON and can be compared against a saved baseline; the run
+# exits 1 when any metric is worse than the baseline by more than --tolerance.
+# Run from the project folder:
+#   python -m benchmarks.suite --sizes 1000:100000,10000:1000000 --threads 1,4,8 --output results.json
+#   python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+#   python -m benchmarks.suite --baseline benchmarks/baseline.json
+import argparse, datetime, json, platform, random, sqlite3, statistics, sys, time
+import database
+from models.models import Admin
+from services import auth
+from benchmarks.common import temp_database, remove_database, seed_customers, seed_transactions, run_threads, SEED_PASSWORD
+
+# Tail percentiles are reported but too noisy on short runs to fail a build on
+GATED = ("p50_ms", "mean_ms", "ops_per_sec")
+OPERATIONS = ("deposit_to_credit", "deposit_to_wallet", "withdraw_from_credit", "withdraw_from_wallet",
+              "transfer_wallet_to_credit", "transfer_credit_to_wallet")
+
+
+def latency(samples, fn):
+    # Calls fn(i) samples times; milliseconds at p50, p95 and p99
+    timings = []
+    for i in range(samples):
+        started = time.perf_counter()
+        fn(i)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    pick = lambda q: round(timings[min(len(timings) - 1, int(q * len(timings)))], 3)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "mean_ms": round(statistics.fmean(timings), 3)}
+
+
+def bench_size(customer_count, transaction_count, thread_counts, args):
+    path = temp_database(pool_size=max(thread_counts) + 2, path=args.db)
+    results = {}
+    try:
+        started = time.perf_counter()
+        customers = seed_customers(customer_count, credit=10**9, wallet=10**9)
+        seed_transactions([c.id for c in customers], transaction_count)
+        results["seed"] = {"seconds": round(time.perf_counter() - started, 3)}
+        rng = random.Random(42)
+        sample = [rng.choice(customers) for _ in range(args.samples)]
+
+        # Full bcrypt check, then the credential cache path a returning user takes
+        def sign_in(i):
+            if auth.sign_in(sample[i].name, SEED_PASSWORD, "customer", source=f"bench{i}") is None:
+                raise RuntimeError("benchmark sign-in failed")
+        auth.credentials.discard_where(lambda key, value: True)
+        results["sign_in_bcrypt"] = latency(min(args.samples, args.bcrypt_samples), sign_in)
+        results["sign_in_cached"] = latency(min(args.samples, args.bcrypt_samples), sign_in)
+
+        for threads in thread_counts:
+            # Each thread works on its own customers through the Customer methods
+            def work(t, i):
+                customer = customers[(t * args.ops + i) % len(customers)]
+                getattr(customer, OPERATIONS[i % len(OPERATIONS)])(100)
+            rate = run_threads(threads, args.ops, work)
+            results[f"operations_{threads}_threads"] = {"ops_per_sec": round(rate, 1)}
+
+        # Keyset cursors: the (timestamp, id) of each sample's oldest first-page row
+        cursors = []
+        for customer in sample:
+            page = customer.transaction_history()
+            cursors.append((page[-1][4], page[-1][0]) if page else None)
+        results["history_first_page"] = latency(args.samples, lambda i: sample[i].transaction_history())
+        results["history_next_page"] = latency(args.samples, lambda i: sample[i].transaction_history(before=cursors[i]))
+
+        # Window cursors: the (name, id) at the end of each of the first few windows
+        admin = Admin.from_row((0, "bench-admin", "", "", ""))
+        windows = [None]
+        for _ in range(4):
+            rows = admin.list_customers(after=windows[-1])
+            if not rows:
+                break
+            windows.append((rows[-1][1], rows[-1][0]))
+        results["admin_list_window"] = latency(args.samples, lambda i: admin.list_customers(after=windows[i % len(windows)]))
+        results["admin_search"] = latency(args.samples, lambda i: admin.list_customers(search=sample[i].name[:7]))
+        results["admin_list_all"] = latency(min(args.samples, 10), lambda i: admin.view_all_users())
+    finally:
+        if args.db is None:
+            remove_database(path)
+        else:
+            database.pool.close()
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    # (metric, baseline, current, change) for every gated metric that got worse
+    # by more than tolerance; latencies must also have grown by min_delta_ms
+    regressions = []
+    for size, metrics in results["sizes"].items():
+        for name, values in metrics.items():
+            for key, value in values.items():
+                old = baseline.get("sizes", {}).get(size, {}).get(name, {}).get(key)
+                if not old or key not in GATED:
+                    continue
+                # Latencies should not grow; throughput should not shrink
+                if key.endswith("_ms"):
+                    change = (value - old) / old if value - old >= min_delta_ms else 0.0
+                else:
+                    change = (old - value) / old
+                if change > tolerance:
+                    regressions.append((f"{size} {name}.{key}", old, value, change))
+    return regressions
+
+
+def parse_sizes(text):
+    # "1000:100000,10000:1000000" -> [(1000, 100000), (10000, 1000000)]
+    return [tuple(int(n) for n in part.split(":")) for part in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bank ledger benchmark suite")
+    parser.add_argument("--sizes", type=parse_sizes, default=parse_sizes("1000:100000"),
+                        help="customers:transactions pairs, comma separated")
+    parser.add_argument("--threads", default="1,4,8", help="thread counts for the operation throughput test")
+    parser.add_argument("--ops", type=int, default=500, help="operations per thread")
+    parser.add_argument("--samples", type=int, default=200, help="calls per latency measurement")
+    parser.add_argument("--bcrypt-samples", type=int, default=20, help="calls for the sign-in measurements")
+    parser.add_argument("--db", help="seed this database file and keep it, instead of a temp file")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="compare against this results JSON")
+    parser.add_argument("--save-baseline", help="write results JSON here as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed fractional slowdown before failing")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="ignore latency changes smaller than this")
+    args = parser.parse_args()
+    thread_counts = [int(t) for t in args.threads.split(",")]
+
+    results = {
+        "meta": {
+            "started": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "threads": thread_counts,
+            "ops": args.ops,
+            "samples": args.samples,
+        },
+        "sizes": {},
+    }
+    for customer_count, transaction_count in args.sizes:
+        size = f"{customer_count}x{transaction_count}"
+        print(f"== {customer_count} customers, {transaction_count} transactions")
+        metrics = results["sizes"][size] = bench_size(customer_count, transaction_count, thread_counts, args)
+        for name, values in metrics.items():
+            print(f"  {name:26s} " + "  ".join(f"{k}={v}" for k, v in values.items()))
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta_ms)
+        for metric, old, new, change in regressions:
+            print(f"REGRESSION  {metric}: {old} -> {new} ({change:+.0%})")
+        print(f"{len(regressions)} regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
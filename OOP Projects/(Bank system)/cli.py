@@ -0,0 +1,346 @@
+# cli.py
+# Headless entry point: runs the same service layer as the GUI without a display.
+# Passwords come from --password, the BANK_PASSWORD environment variable, or a prompt.
+import argparse
+import getpass
+import json
+import os
+import sqlite3
+import sys
+import threading
+from database import create_tables
+from models import scheduler
+from models.ledger import OPERATIONS
+from models.money import Money
+from services import auth, accounts, admin as admin_service, export
+from utils import metrics
+
+
+def read_password(args):
+    return args.password or os.environ.get("BANK_PASSWORD") or getpass.getpass("Password: ")
+
+
+def sign_in(args, user_type):
+    try:
+        user = auth.sign_in(args.name, read_password(args), user_type, source="cli")
+    except auth.AuthError as e:
+        sys.exit(str(e))
+    if user is None:
+        sys.exit("Invalid credentials.")
+    return user
+
+
+def print_rows(rows, as_json):
+    for row in rows:
+        print(json.dumps(list(row), default=str) if as_json else " | ".join(str(v) for v in row))
+
+
+def cmd_register_admin(args):
+    admin = auth.register_admin(args.name, args.national_id, args.phone, read_password(args))
+    print(f"Admin registered with ID {admin.id}")
+
+
+def cmd_balance(args):
+    customer = sign_in(args, "customer")
+    credit, wallet = accounts.balances(customer.id)
+    print(f"Credit: ${credit} | Wallet: ${wallet}")
+
+
+def cmd_operation(args):
+    customer = sign_in(args, "customer")
+    try:
+        succeeded = accounts.apply(customer.id, args.operation, args.amount)
+    except ValueError as e:
+        sys.exit(str(e))
+    if succeeded:
+        print(f"{args.operation} {args.amount}: success")
+    else:
+        sys.exit(f"{args.operation} {args.amount}: insufficient funds")
+
+
+def cmd_transfer(args):
+    customer = sign_in(args, "customer")
+    try:
+        sent = accounts.transfer(customer.id, args.recipient, args.amount)
+    except ValueError as e:
+        sys.exit(str(e))
+    if sent:
+        print(f"sent {args.amount} to customer {args.recipient}: success")
+    else:
+        sys.exit(f"sent {args.amount} to customer {args.recipient}: insufficient funds")
+
+
+def cmd_schedule(args):
+    customer = sign_in(args, "customer")
+    try:
+        schedule_id = accounts.schedule(customer.id, args.operation, args.amount, args.start, args.every)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"Scheduled as #{schedule_id}")
+
+
+def cmd_schedules(args):
+    customer = sign_in(args, "customer")
+    print_rows(accounts.schedules(customer.id), args.json)
+
+
+def cmd_cancel_schedule(args):
+    customer = sign_in(args, "customer")
+    if not accounts.cancel_schedule(customer.id, args.schedule_id):
+        sys.exit(f"No active schedule #{args.schedule_id}.")
+    print(f"Cancelled #{args.schedule_id}")
+
+
+def cmd_run_scheduler(args):
+    if args.once:
+        print(f"{scheduler.Scheduler(start=False).run_pending()} scheduled operations run")
+        return
+    scheduler.enable()
+    print("Running scheduled operations; Ctrl+C to stop.")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.disable()
+
+
+def cmd_history(args):
+    customer = sign_in(args, "customer")
+    print_rows(accounts.history(customer.id, args.limit), args.json)
+
+
+def cmd_statement(args):
+    customer = sign_in(args, "customer")
+    print(json.dumps(accounts.statement(customer.id, args.start, args.end), default=str, indent=2))
+
+
+def cmd_bank_totals(args):
+    admin = sign_in(args, "admin")
+    print_rows(((t["type"], t["status"], t["count"], t["amount"]) for t in admin_service.bank_totals(admin, args.start, args.end)), args.json)
+
+
+def cmd_analytics(args):
+    admin = sign_in(args, "admin")
+    report = admin_service.analytics_report(admin, args.start, args.end, args.top)
+    if args.json:
+        print(json.dumps(report, default=str, indent=2))
+        return
+    for section in ("types", "daily", "top_customers", "amount_spikes", "failed_withdraw_bursts"):
+        rows = report[section]
+        print(f"{section}: {len(rows)} rows")
+        # Daily totals run to a row per day; the latest ones are the interesting ones
+        for row in rows[-args.days:] if section == "daily" else rows:
+            print("  " + " | ".join(str(v) for v in row))
+    print(f"{report['rows']} transactions scanned in {report['seconds']}s")
+
+
+def cmd_verify_snapshots(args):
+    admin = sign_in(args, "admin")
+    report = admin_service.verify_snapshots(admin, args.fix)
+    for section, drift in report.items():
+        print(f"{section}: {len(drift)} drifting rows")
+        for row in drift[:20]:
+            print(f"  {row}")
+    if any(report.values()) and not args.fix:
+        sys.exit(1)
+
+
+def cmd_archive(args):
+    admin = sign_in(args, "admin")
+    moved = admin_service.archive_transactions(admin, args.before, args.vacuum)
+    for period, rows in moved:
+        print(f"{period}: {rows} transactions archived")
+    if not moved:
+        print("Nothing to archive.")
+
+
+def cmd_archives(args):
+    admin = sign_in(args, "admin")
+    print_rows(admin_service.archives(admin), args.json)
+
+
+def cmd_shards(args):
+    admin = sign_in(args, "admin")
+    if args.count is not None:
+        # The GUI and API keep the old layout's pools open until restarted
+        print("Rebalancing; the GUI and API must not be running.")
+        moved = admin_service.rebalance_shards(admin, args.count)
+        print(f"{moved} customers moved")
+    for k, path in enumerate(admin_service.shards(admin)):
+        print(f"{k}: {path}")
+
+
+def cmd_export(args):
+    if args.customer is None:
+        sign_in(args, "admin")
+        user_id = None
+    else:
+        # Customers may export their own history; admins anyone's
+        user = sign_in(args, "customer" if args.as_customer else "admin")
+        if args.as_customer and user.id != args.customer:
+            sys.exit("Customers can only export their own history.")
+        user_id = args.customer
+    for path, rows in export.export(args.output, args.format, user_id, args.start, args.end, args.shards, args.chunk_size):
+        print(f"{path}: {rows} rows")
+
+
+def cmd_import_customers(args):
+    admin = sign_in(args, "admin")
+    report = args.report or os.path.splitext(args.file)[0] + ".errors.csv"
+    added, errors = admin_service.import_customers(admin, args.file, report, args.workers)
+    print(f"Added {added} customers; {len(errors)} rows rejected" + (f", see {report}" if errors else ""))
+
+
+def cmd_customers(args):
+    admin = sign_in(args, "admin")
+    print_rows(admin_service.list_customers(admin, args.limit, search=args.search), args.json)
+
+
+def cmd_add_customer(args):
+    sign_in(args, "admin")
+    customer_password = os.environ.get("BANK_CUSTOMER_PASSWORD") or getpass.getpass("Customer password: ")
+    try:
+        customer = admin_service.add_customer(args.customer_name, args.national_id, args.phone, customer_password)
+    except (admin_service.MissingFieldError, admin_service.WeakPasswordError) as e:
+        sys.exit(str(e))
+    except sqlite3.IntegrityError:
+        sys.exit("National ID already registered.")
+    print(f"Customer added with ID {customer.id}")
+
+
+def cmd_account_action(args):
+    admin = sign_in(args, "admin")
+    if admin_service.get_customer(admin, args.user_id) is None:
+        sys.exit(f"No customer with ID {args.user_id}.")
+    action = {"lock": admin_service.lock, "unlock": admin_service.unlock, "delete": admin_service.delete}[args.command]
+    action(admin, args.user_id)
+    print(f"{args.command}: user ID {args.user_id}")
+
+
+def cmd_batch(args):
+    sign_in(args, "admin")
+    counts = {}
+    for status in accounts.apply_batch_file(args.file):
+        counts[status] = counts.get(status, 0) + 1
+    print(json.dumps(counts))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Nile Valley Bank System (headless)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def command(name, handler, help, signed_in=True):
+        p = sub.add_parser(name, help=help)
+        if signed_in:
+            p.add_argument("--name", required=True, help="name to sign in with")
+        p.add_argument("--password")
+        p.set_defaults(handler=handler)
+        return p
+
+    p = command("register-admin", cmd_register_admin, "register a new admin", signed_in=False)
+    p.add_argument("name")
+    p.add_argument("national_id")
+    p.add_argument("phone")
+
+    command("balance", cmd_balance, "show a customer's balances")
+
+    p = command("op", cmd_operation, "run a ledger operation for a customer")
+    p.add_argument("operation", choices=sorted(OPERATIONS))
+    p.add_argument("amount", type=Money.parse)
+
+    p = command("transfer", cmd_transfer, "send money from a customer's wallet to another customer's wallet")
+    p.add_argument("recipient", type=int, help="recipient's customer ID")
+    p.add_argument("amount", type=Money.parse)
+
+    p = command("schedule", cmd_schedule, "schedule a one-off or recurring operation for a customer")
+    p.add_argument("operation", choices=sorted(OPERATIONS))
+    p.add_argument("amount", type=Money.parse)
+    p.add_argument("--start", help="first run, YYYY-MM-DD or 'YYYY-MM-DD HH:MM' (default: now)")
+    p.add_argument("--every", choices=scheduler.EVERY, help="repeat; omit for a one-off")
+
+    p = command("schedules", cmd_schedules, "list a customer's scheduled operations")
+    p.add_argument("--json", action="store_true")
+
+    p = command("cancel-schedule", cmd_cancel_schedule, "cancel one of a customer's scheduled operations")
+    p.add_argument("schedule_id", type=int)
+
+    p = command("run-scheduler", cmd_run_scheduler, "run scheduled operations as they fall due", signed_in=False)
+    p.add_argument("--once", action="store_true", help="run what is due now, including missed runs, and exit")
+
+    p = command("history", cmd_history, "show a customer's latest transactions")
+    p.add_argument("--limit", type=int, default=20)
+    p.add_argument("--json", action="store_true")
+
+    p = command("statement", cmd_statement, "print a customer's statement for a date range")
+    p.add_argument("start", help="first day, YYYY-MM-DD")
+    p.add_argument("end", help="last day, YYYY-MM-DD")
+
+    p = command("bank-totals", cmd_bank_totals, "bank-wide totals by type for a date range (admin)")
+    p.add_argument("start", help="first day, YYYY-MM-DD")
+    p.add_argument("end", help="last day, YYYY-MM-DD")
+    p.add_argument("--json", action="store_true")
+
+    p = command("analytics", cmd_analytics, "bank-wide activity report with anomaly flags (admin)")
+    p.add_argument("--start", help="first day, YYYY-MM-DD")
+    p.add_argument("--end", help="last day, YYYY-MM-DD")
+    p.add_argument("--top", type=int, default=10, help="top customers to list")
+    p.add_argument("--days", type=int, default=14, help="latest days of daily totals to print")
+    p.add_argument("--json", action="store_true")
+
+    p = command("verify-snapshots", cmd_verify_snapshots, "rebuild snapshots from the ledger and report drift (admin)")
+    p.add_argument("--fix", action="store_true", help="rewrite the snapshot tables from the ledger")
+
+    p = command("archive", cmd_archive, "move whole months of old transactions into read-only archive files (admin)")
+    p.add_argument("before", help="archive months before this day's month, YYYY-MM-DD")
+    p.add_argument("--vacuum", action="store_true", help="shrink the database file afterwards")
+
+    p = command("archives", cmd_archives, "list transaction archive files (admin)")
+    p.add_argument("--json", action="store_true")
+
+    p = command("shards", cmd_shards, "list the customer-data shard files, or rebalance across COUNT files (admin, offline)")
+    p.add_argument("count", type=int, nargs="?", help="number of shard files; 1 folds them back into the main database")
+
+    p = command("export", cmd_export, "stream transactions to CSV, JSONL or columnar files")
+    p.add_argument("output", help="output file; with --shards, part files are named after it")
+    p.add_argument("--format", choices=tuple(export.FORMATS), help="default: from the file extension, else csv")
+    p.add_argument("--customer", type=int, help="only this customer's transactions")
+    p.add_argument("--as-customer", action="store_true", help="sign in as the customer rather than an admin")
+    p.add_argument("--start", help="first day, YYYY-MM-DD")
+    p.add_argument("--end", help="last day, YYYY-MM-DD")
+    p.add_argument("--shards", type=int, default=1, help="export user-id shards in parallel processes")
+    p.add_argument("--chunk-size", type=int, default=export.CHUNK_SIZE)
+
+    p = command("customers", cmd_customers, "list customers (admin)")
+    p.add_argument("--limit", type=int, default=50)
+    p.add_argument("--search")
+    p.add_argument("--json", action="store_true")
+
+    p = command("import-customers", cmd_import_customers, "add customers in bulk from a CSV (admin)")
+    p.add_argument("file", help="CSV with columns name, national_id, phone_number, password")
+    p.add_argument("--report", help="where to write rejected rows (default: FILE.errors.csv)")
+    p.add_argument("--workers", type=int, help="hashing processes (default: one per core)")
+
+    p = command("add-customer", cmd_add_customer, "add a customer (admin)")
+    p.add_argument("customer_name")
+    p.add_argument("national_id")
+    p.add_argument("phone")
+
+    for name in ("lock", "unlock", "delete"):
+        p = command(name, cmd_account_action, f"{name} a customer account (admin)")
+        p.add_argument("user_id", type=int)
+
+    p = command("batch", cmd_batch, "apply a CSV/JSONL batch of ledger operations (admin)")
+    p.add_argument("file")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    metrics.configure_from_env()
+    create_tables()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
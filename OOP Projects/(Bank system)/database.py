@@ -1,44 +1,197 @@
 # database.py
+import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
 
-conn = sqlite3.connect("banking.db", check_same_thread=False)
-cursor = conn.cursor()
-
-def create_tables():
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            national_id TEXT UNIQUE,
-            phone_number TEXT,
-            password TEXT,
-            is_locked INTEGER DEFAULT 0,
-            user_type TEXT CHECK(user_type IN ('admin', 'customer'))
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS customers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE,
-            credit REAL DEFAULT 0.0,
-            wallet_balance REAL DEFAULT 0.0,
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            type TEXT,
-            amount REAL,
-            status TEXT,
-            timestamp TEXT,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    ''')
-
-    conn.commit()
-
-__all__ = ["conn", "cursor", "create_tables"]
+DB_PATH = os.environ.get("BANK_DB_PATH", "banking.db")
+POOL_SIZE = int(os.environ.get("BANK_POOL_SIZE", "8"))
+BUSY_TIMEOUT = 5.0
+# Class the pool opens connections with; utils.metrics swaps in a timed one
+connection_factory = sqlite3.Connection
+
+
+class PoolExhaustedError(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE, busy_timeout=BUSY_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        # Autocommit mode: transactions are opened explicitly by transaction()
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False,
+                               isolation_level=None, factory=connection_factory)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+        if self.path != ":memory:":
+            conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.size:
+                conn = self._connect()
+                self._all.append(conn)
+                return conn
+        try:
+            return self._idle.get(timeout=self.busy_timeout)
+        except queue.Empty:
+            raise PoolExhaustedError(f"No free connection after {self.busy_timeout}s (pool size {self.size})")
+
+    def _checkin(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        # Re-entrant per thread: nested calls reuse the connection already held
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+        conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self._checkin(conn)
+
+    @contextmanager
+    def transaction(self, mode="IMMEDIATE"):
+        with self.connection() as conn:
+            if conn.in_transaction:
+                # Join the enclosing transaction instead of committing early
+                yield conn
+                return
+            conn.execute(f"BEGIN {mode}")
+            self._local.after = []
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            finally:
+                callbacks, self._local.after = self._local.after, None
+                for fn in callbacks:
+                    fn()
+
+    def after_commit(self, fn):
+        # Runs fn once this thread's outermost transaction has ended (committed
+        # or rolled back), or straight away outside a transaction. Cache
+        # invalidation goes here so no reader can re-cache pre-commit data.
+        pending = getattr(self._local, "after", None)
+        if pending is None:
+            fn()
+        else:
+            pending.append(fn)
+
+    def in_transaction(self):
+        # Whether this thread holds a connection with an open transaction
+        held = getattr(self._local, "conn", None)
+        return held is not None and held.in_transaction
+
+    def close(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+            self._idle = queue.LifoQueue()
+
+
+pool = ConnectionPool(DB_PATH)
+
+
+def configure(path=None, size=None, busy_timeout=None):
+    global pool
+    old = pool
+    pool = ConnectionPool(
+        path or old.path,
+        size=size or old.size,
+        busy_timeout=busy_timeout or old.busy_timeout,
+    )
+    old.close()
+    return pool
+
+
+def connection():
+    return pool.connection()
+
+
+def transaction(mode="IMMEDIATE"):
+    return pool.transaction(mode)
+
+
+def after_commit(fn):
+    return pool.after_commit(fn)
+
+
+def in_transaction():
+    return pool.in_transaction()
+
+
+def create_tables(db=None):
+    # db is a shard's pool when migrating shard files (see sharding.py)
+    with (db or pool).transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT,
+                national_id TEXT UNIQUE,
+                phone_number TEXT,
+                password TEXT,
+                is_locked INTEGER DEFAULT 0,
+                user_type TEXT CHECK(user_type IN ('admin', 'customer'))
+            )
+        ''')
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS customers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER UNIQUE,
+                credit REAL DEFAULT 0.0,
+                wallet_balance REAL DEFAULT 0.0,
+                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        ''')
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                type TEXT,
+                amount REAL,
+                status TEXT,
+                timestamp TEXT,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+        ''')
+
+    from migrations import migrate
+    migrate(db=db)
+    if db is None:
+        import sharding
+        sharding.open_shards()
+
+__all__ = ["ConnectionPool", "PoolExhaustedError", "pool", "configure", "connection", "transaction", "after_commit", "in_transaction", "create_tables"]
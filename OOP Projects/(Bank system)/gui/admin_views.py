@@ -1,9 +1,12 @@
+import bisect
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
-from models.models import Admin, Customer
-from database import cursor
+import os
+from tkinter import ttk, messagebox, simpledialog, filedialog
+from models.models import CUSTOMER_PAGE_SIZE
+from services import admin as admin_service
 from utils.validators import validate_password_strength
 from utils.logger import log_action
+from utils.tasks import run_async
 
 class AdminDashboard:
     def __init__(self, root, user, logout_callback):
@@ -25,19 +28,32 @@ class AdminDashboard:
         ttk.Button(frame, text="Lock Account", command=self.lock_account).grid(row=1, column=2, pady=5)
         ttk.Button(frame, text="Unlock Account", command=self.unlock_account).grid(row=1, column=3, pady=5)
         ttk.Button(frame, text="Delete User", command=self.delete_user).grid(row=2, column=0, pady=5)
+        ttk.Button(frame, text="Import Customers", command=self.import_customers).grid(row=2, column=1, pady=5)
+        ttk.Button(frame, text="Reports", command=self.show_reports).grid(row=2, column=2, pady=5)
         ttk.Button(frame, text="Logout", command=self.logout).grid(row=2, column=3, pady=5)
 
         # Customer List Treeview
-        ttk.Label(frame, text="Registered Customers:", font=("Arial", 12, "underline")).grid(row=3, column=0, columnspan=4, sticky="w", pady=(10,5))
-        self.tree = ttk.Treeview(frame, columns=("ID", "Name", "National ID", "Phone"), show="headings", height=10)
-        for col in ("ID", "Name", "National ID", "Phone"):
+        ttk.Label(frame, text="Registered Customers:", font=("Arial", 12, "underline")).grid(row=3, column=0, columnspan=2, sticky="w", pady=(10,5))
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(frame, textvariable=self.search_var)
+        search_entry.grid(row=3, column=2, sticky="e", pady=(10,5))
+        search_entry.bind("<Return>", lambda e: self.search_users())
+        search_buttons = ttk.Frame(frame)
+        search_buttons.grid(row=3, column=3, sticky="w", pady=(10,5))
+        ttk.Button(search_buttons, text="Search", command=self.search_users).pack(side="left")
+        ttk.Button(search_buttons, text="Clear", command=self.clear_search).pack(side="left")
+
+        columns = ("ID", "Name", "National ID", "Phone", "Status")
+        self.tree = ttk.Treeview(frame, columns=columns, show="headings", height=10)
+        for col in columns:
             self.tree.heading(col, text=col)
             self.tree.column(col, anchor="center", width=120)
         self.tree.grid(row=4, column=0, columnspan=4, sticky="nsew")
 
-        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscroll=scrollbar.set)
-        scrollbar.grid(row=4, column=4, sticky="ns")
+        # Scrolling near the bottom loads the next window of customers
+        self.scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_tree_scroll)
+        self.scrollbar.grid(row=4, column=4, sticky="ns")
 
         self.populate_users()
 
@@ -48,12 +64,91 @@ class AdminDashboard:
         for widget in self.root.winfo_children():
             widget.destroy()
 
-    def populate_users(self):
+    def populate_users(self, search=None):
+        # Only the first window is loaded; the rest arrives as the admin scrolls
         for i in self.tree.get_children():
             self.tree.delete(i)
-        users = self.user.view_all_users()
-        for u in users:
-            self.tree.insert("", "end", values=(u[0], u[1], u[2], u[3]))
+        self.search = search
+        self.loaded_keys = []
+        self.users_exhausted = False
+        self.users_loading = False
+        # Windows requested before a new search started are dropped on arrival
+        self.list_generation = getattr(self, "list_generation", 0) + 1
+        self.load_more_users()
+
+    def load_more_users(self):
+        if self.users_exhausted or self.users_loading:
+            return
+        self.users_loading = True
+        generation, search = self.list_generation, self.search
+        after = self.loaded_keys[-1] if self.loaded_keys else None
+        def show(rows):
+            if generation != self.list_generation:
+                return
+            self.users_loading = False
+            if len(rows) < CUSTOMER_PAGE_SIZE:
+                self.users_exhausted = True
+            for row in rows:
+                if self.tree.exists(row[0]):
+                    continue
+                self.tree.insert("", "end", iid=row[0], values=self.row_values(row))
+                self.loaded_keys.append((row[1], row[0]))
+        def on_error(error):
+            # Let the next scroll retry the window
+            if generation == self.list_generation:
+                self.users_loading = False
+            self.show_error(error)
+        run_async(lambda: admin_service.list_customers(self.user, CUSTOMER_PAGE_SIZE, after, search), show, on_error)
+
+    def row_values(self, row):
+        return (row[0], row[1], row[2], row[3], "Locked" if row[4] else "Active")
+
+    def refresh_user(self, user_id):
+        # Re-reads one customer after a mutation and updates only that row
+        user_id = int(user_id)
+        run_async(lambda: admin_service.get_customer(self.user, user_id), lambda row: self.apply_user_row(user_id, row), self.show_error)
+
+    def apply_user_row(self, user_id, row):
+        if self.tree.exists(user_id):
+            index = self.tree.index(user_id)
+            self.tree.delete(user_id)
+            del self.loaded_keys[index]
+        if row is None:
+            return
+        if self.search and not row[1].startswith(self.search):
+            return
+        key = (row[1], row[0])
+        index = bisect.bisect_left(self.loaded_keys, key)
+        # Past the loaded window it will show up when that window is fetched
+        if index == len(self.loaded_keys) and not self.users_exhausted:
+            return
+        self.loaded_keys.insert(index, key)
+        self.tree.insert("", index, iid=row[0], values=self.row_values(row))
+
+    def on_tree_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if float(last) >= 0.9:
+            self.load_more_users()
+
+    def search_users(self):
+        self.populate_users(self.search_var.get().strip() or None)
+
+    def clear_search(self):
+        self.search_var.set("")
+        self.populate_users()
+
+    def show_error(self, error):
+        messagebox.showerror("Error", f"Operation failed: {error}")
+
+    def run_action(self, action, user_id, success_message, failure_message, action_name):
+        def on_done(_):
+            messagebox.showinfo("Success", success_message)
+            self.refresh_user(user_id)
+            log_action(self.user.id, action_name, "success", target_user_id=user_id)
+        def on_error(e):
+            messagebox.showerror("Error", f"{failure_message}: {e}")
+            log_action(self.user.id, action_name, "failed", target_user_id=user_id, error=str(e))
+        run_async(action, on_done, on_error)
 
     def add_customer(self):
         dlg = AddCustomerDialog(self.root)
@@ -63,13 +158,31 @@ class AdminDashboard:
             if not validate_password_strength(password):
                 messagebox.showerror("Weak Password", "Password is not strong enough.")
                 return
-            new_customer = Customer(name, nid, phone, password)
-            try:
-                new_customer.save_to_db()
+            def on_done(new_customer):
                 messagebox.showinfo("Success", "Customer added")
-                self.populate_users()  # Refresh the user list after adding
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to add customer: {e}")
+                self.refresh_user(new_customer.id)
+                log_action(self.user.id, "add_customer", "success", target_user_id=new_customer.id)
+            # Customer() hashes the password with bcrypt, so it is built on the worker too
+            run_async(lambda: admin_service.add_customer(name, nid, phone, password), on_done, lambda e: messagebox.showerror("Error", f"Failed to add customer: {e}"))
+
+    def import_customers(self):
+        path = filedialog.askopenfilename(filetypes=[("CSV", "*.csv")])
+        if not path:
+            return
+        report = os.path.splitext(path)[0] + ".errors.csv"
+        def on_done(result):
+            added, errors = result
+            log_action(self.user.id, "import_customers", "success", added=added, rejected=len(errors))
+            message = f"Added {added} customers."
+            if errors:
+                message += f"\n{len(errors)} rows were rejected; see {report}."
+            messagebox.showinfo("Import Complete", message)
+            self.populate_users(self.search)
+        run_async(lambda: admin_service.import_customers(self.user, path, report), on_done, self.show_error)
+
+    def show_reports(self):
+        ReportWindow(self.root, self.user)
+        log_action(self.user.id, "view_reports", "success")
 
     def reset_password(self):
         selected_item = self.tree.selection()
@@ -80,12 +193,9 @@ class AdminDashboard:
         new_password = simpledialog.askstring("Reset Password", "Enter new password:")
         if new_password:
             if validate_password_strength(new_password):
-                try:
-                    cursor.execute("UPDATE users SET password=? WHERE id=?", (new_password, user_id))
-                    messagebox.showinfo("Success", "Password reset successfully.")
-                    log_action(f"Admin {self.user.name} reset password for user ID {user_id}.")
-                except Exception as e:
-                    messagebox.showerror("Error", f"Failed to reset password: {e}")
+                self.run_action(lambda: admin_service.reset_password(self.user, user_id, new_password), user_id,
+                                "Password reset successfully.", "Failed to reset password",
+                                "reset_password")
             else:
                 messagebox.showerror("Weak Password", "Password is not strong enough.")
 
@@ -95,13 +205,9 @@ class AdminDashboard:
             messagebox.showwarning("Select User", "Please select a user to lock account.")
             return
         user_id = self.tree.item(selected_item, "values")[0]
-        try:
-            cursor.execute("UPDATE users SET is_locked=1 WHERE id=?", (user_id,))
-            messagebox.showinfo("Success", "Account locked successfully.")
-            log_action(f"Admin {self.user.name} locked account for user ID {user_id}.")
-            self.populate_users()
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to lock account: {e}")
+        self.run_action(lambda: admin_service.lock(self.user, user_id), user_id,
+                        "Account locked successfully.", "Failed to lock account",
+                        "lock_account")
 
     def unlock_account(self):
         selected_item = self.tree.selection()
@@ -109,13 +215,9 @@ class AdminDashboard:
             messagebox.showwarning("Select User", "Please select a user to unlock account.")
             return
         user_id = self.tree.item(selected_item, "values")[0]
-        try:
-            cursor.execute("UPDATE users SET is_locked=0 WHERE id=?", (user_id,))
-            messagebox.showinfo("Success", "Account unlocked successfully.")
-            log_action(f"Admin {self.user.name} unlocked account for user ID {user_id}.")
-            self.populate_users()
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to unlock account: {e}")
+        self.run_action(lambda: admin_service.unlock(self.user, user_id), user_id,
+                        "Account unlocked successfully.", "Failed to unlock account",
+                        "unlock_account")
 
     def delete_user(self):
         selected_item = self.tree.selection()
@@ -125,19 +227,85 @@ class AdminDashboard:
         user_id = self.tree.item(selected_item, "values")[0]
         confirm = messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this user?")
         if confirm:
-            try:
-                cursor.execute("DELETE FROM users WHERE id=?", (user_id,))
-                messagebox.showinfo("Success", "User deleted successfully.")
-                log_action(f"Admin {self.user.name} deleted user ID {user_id}.")
-                self.populate_users()
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to delete user: {e}")
+            self.run_action(lambda: admin_service.delete(self.user, user_id), user_id,
+                            "User deleted successfully.", "Failed to delete user",
+                            "delete_user")
 
     def logout(self):
         confirm = messagebox.askyesno("Confirm Logout", "Are you sure you want to logout?")
         if confirm:
             self.logout_callback()
 
+class ReportWindow:
+    # Bank-wide analytics: one tab per report, filled by a background scan
+    TABS = (
+        ("By Type", "types", ("Type", "Count", "Failed", "Failure Rate", "Amount")),
+        ("Daily Totals", "daily", ("Day", "Count", "Failed", "Amount")),
+        ("Top Customers", "top_customers", ("Customer ID", "Operations", "Amount")),
+        ("Amount Spikes", "amount_spikes", ("Customer ID", "Day", "Amount", "Z-Score")),
+        ("Withdraw Bursts", "failed_withdraw_bursts", ("Customer ID", "From", "Failed Attempts")),
+    )
+
+    def __init__(self, parent, user):
+        self.user = user
+        self.top = tk.Toplevel(parent)
+        self.top.title("Reports")
+
+        ttk.Label(self.top, text="From (YYYY-MM-DD):").grid(row=0, column=0, padx=10, pady=10)
+        self.start_var = tk.StringVar()
+        ttk.Entry(self.top, textvariable=self.start_var, width=12).grid(row=0, column=1, pady=10)
+        ttk.Label(self.top, text="To:").grid(row=0, column=2, padx=10, pady=10)
+        self.end_var = tk.StringVar()
+        ttk.Entry(self.top, textvariable=self.end_var, width=12).grid(row=0, column=3, pady=10)
+        self.run_button = ttk.Button(self.top, text="Run", command=self.run)
+        self.run_button.grid(row=0, column=4, padx=10, pady=10)
+        self.status_var = tk.StringVar()
+        ttk.Label(self.top, textvariable=self.status_var).grid(row=1, column=0, columnspan=5, sticky="w", padx=10)
+
+        notebook = ttk.Notebook(self.top)
+        notebook.grid(row=2, column=0, columnspan=5, sticky="nsew", padx=10, pady=10)
+        self.trees = {}
+        for title, key, columns in self.TABS:
+            tab = ttk.Frame(notebook)
+            tree = ttk.Treeview(tab, columns=columns, show="headings", height=15)
+            for col in columns:
+                tree.heading(col, text=col)
+                tree.column(col, anchor="center", width=120)
+            scrollbar = ttk.Scrollbar(tab, orient="vertical", command=tree.yview)
+            tree.configure(yscrollcommand=scrollbar.set)
+            tree.pack(side="left", fill="both", expand=True)
+            scrollbar.pack(side="right", fill="y")
+            notebook.add(tab, text=title)
+            self.trees[key] = tree
+        self.top.grid_rowconfigure(2, weight=1)
+        self.top.grid_columnconfigure(4, weight=1)
+        self.run()
+
+    def run(self):
+        start, end = self.start_var.get().strip() or None, self.end_var.get().strip() or None
+        self.run_button.state(["disabled"])
+        self.status_var.set("Scanning transactions...")
+        def on_error(e):
+            if not self.top.winfo_exists():
+                return
+            self.run_button.state(["!disabled"])
+            self.status_var.set("")
+            messagebox.showerror("Error", f"Report failed: {e}", parent=self.top)
+        run_async(lambda: admin_service.analytics_report(self.user, start, end), self.show, on_error)
+
+    def show(self, report):
+        if not self.top.winfo_exists():
+            return
+        self.run_button.state(["!disabled"])
+        self.status_var.set(f"{report['rows']:,} transactions scanned in {report['seconds']}s")
+        for key, tree in self.trees.items():
+            tree.delete(*tree.get_children())
+            # Newest days first; the other reports come sorted already
+            rows = reversed(report[key]) if key == "daily" else report[key]
+            for row in rows:
+                tree.insert("", "end", values=[f"{v:.1%}" if isinstance(v, float) and key == "types" else v for v in row])
+
+
 class AddCustomerDialog:
     def __init__(self, parent):
         self.top = tk.Toplevel(parent)
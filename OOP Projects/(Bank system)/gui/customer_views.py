@@ -1,17 +1,20 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
-from models.models import Customer
-from database import cursor
+from tkinter import ttk, messagebox, simpledialog, filedialog
+from models.models import Customer, HISTORY_PAGE_SIZE
+from models.ledger import OPERATIONS
+from models.money import Money
+from models.scheduler import EVERY
+from services import accounts
 from utils.session import SessionManager
 from utils.logger import log_action
-import datetime
+from utils.tasks import run_async
 
 class CustomerDashboard:
     def __init__(self, root, user, logout_callback):
         self.root = root
         self.user = user
         self.logout_callback = logout_callback
-        self.session = SessionManager(self.root, self.logout)
+        self.session = SessionManager(self.root, self.session_expired, user)
         self.build_ui()
 
     def build_ui(self):
@@ -35,12 +38,12 @@ class CustomerDashboard:
             self.tree.column(col, anchor="center", width=120)
         self.tree.grid(row=3, column=0, columnspan=4, sticky="nsew")
 
-        self.populate_transactions()
+        # Scrollbar for treeview; scrolling near the bottom loads the next page
+        self.scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_tree_scroll)
+        self.scrollbar.grid(row=3, column=4, sticky="ns")
 
-        # Scrollbar for treeview
-        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscroll=scrollbar.set)
-        scrollbar.grid(row=3, column=4, sticky="ns")
+        self.populate_transactions()
 
         # Deposit and Withdraw Buttons with Amount input dialogs
         ttk.Button(frame, text="Deposit to Credit", command=self.deposit_credit).grid(row=4, column=0, pady=10)
@@ -49,7 +52,10 @@ class CustomerDashboard:
         ttk.Button(frame, text="Withdraw from Wallet", command=self.withdraw_wallet).grid(row=4, column=3, pady=10)
         ttk.Button(frame, text="Wallet → Credit", command=self.wallet_to_credit).grid(row=5, column=0, columnspan=2, pady=10)
         ttk.Button(frame, text="Credit → Wallet", command=self.credit_to_wallet).grid(row=5, column=2, columnspan=2, pady=10)
-        ttk.Button(frame, text="Logout", command=self.logout).grid(row=6, column=0, columnspan=4, pady=15)
+        ttk.Button(frame, text="Send Money", command=self.send_money).grid(row=6, column=0, pady=15)
+        ttk.Button(frame, text="Export History", command=self.export_history).grid(row=6, column=1, pady=15)
+        ttk.Button(frame, text="Scheduled", command=lambda: ScheduleWindow(self.root, self.user)).grid(row=6, column=2, pady=15)
+        ttk.Button(frame, text="Logout", command=self.logout).grid(row=6, column=3, pady=15)
 
         # Configure grid weights
         frame.grid_rowconfigure(3, weight=1)
@@ -62,24 +68,83 @@ class CustomerDashboard:
             widget.destroy()
 
     def update_balances(self):
-        cursor.execute("SELECT credit, wallet_balance FROM customers WHERE user_id = ?", (self.user.id,))
-        credit, wallet = cursor.fetchone()
-        self.balance_var.set(f"Credit: ${credit:.2f} | Wallet: ${wallet:.2f}")
+        def show(row):
+            credit, wallet = row
+            self.balance_var.set(f"Credit: ${credit} | Wallet: ${wallet}")
+        run_async(lambda: accounts.balances(self.user.id), show, self.show_error)
 
     def populate_transactions(self):
+        # First page only; older rows are fetched by keyset as the user scrolls
         for i in self.tree.get_children():
             self.tree.delete(i)
-        cursor.execute("SELECT type, amount, status, timestamp FROM transactions WHERE user_id = ? ORDER BY timestamp DESC", (self.user.id,))
-        for row in cursor.fetchall():
-            self.tree.insert("", "end", values=row)
+        self.newest_key = None
+        self.oldest_key = None
+        self.history_exhausted = False
+        self.history_loading = False
+        self.load_more_transactions()
+
+    def load_more_transactions(self):
+        if self.history_exhausted or self.history_loading:
+            return
+        self.history_loading = True
+        def show(rows):
+            self.history_loading = False
+            if len(rows) < HISTORY_PAGE_SIZE:
+                self.history_exhausted = True
+            for row in rows:
+                if not self.tree.exists(row[0]):
+                    self.tree.insert("", "end", iid=row[0], values=row[1:])
+            if rows:
+                if self.newest_key is None:
+                    self.newest_key = (rows[0][4], rows[0][0])
+                self.oldest_key = (rows[-1][4], rows[-1][0])
+        def on_error(error):
+            # Let the next scroll or refresh retry the page
+            self.history_loading = False
+            self.show_error(error)
+        oldest = self.oldest_key
+        run_async(lambda: self.user.transaction_history(HISTORY_PAGE_SIZE, oldest), show, on_error)
+
+    def refresh_transactions(self):
+        # After an operation only the new rows are fetched and put on top
+        if self.newest_key is None:
+            if not self.history_loading:
+                self.populate_transactions()
+            return
+        def show(rows):
+            for row in reversed(rows):
+                if not self.tree.exists(row[0]):
+                    self.tree.insert("", 0, iid=row[0], values=row[1:])
+            if rows and (rows[0][4], rows[0][0]) > self.newest_key:
+                self.newest_key = (rows[0][4], rows[0][0])
+        newest = self.newest_key
+        run_async(lambda: self.user.transactions_since(newest), show, self.show_error)
+
+    def on_tree_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if float(last) >= 0.9:
+            self.load_more_transactions()
+
+    def export_history(self):
+        # Streams the full history to a file in the background, however long it is
+        path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV", "*.csv"), ("JSON lines", "*.jsonl")])
+        if not path:
+            return
+        def on_done(rows):
+            log_action(self.user.id, "export_history", "success", rows=rows)
+            messagebox.showinfo("Export Complete", f"Exported {rows} transactions to {path}.")
+        run_async(lambda: accounts.export_history(self.user.id, path), on_done, self.show_error)
+
+    def show_error(self, error):
+        messagebox.showerror("Error", f"Operation failed: {error}")
 
     def get_amount(self, prompt):
         try:
             val = simpledialog.askstring("Amount", prompt)
             if val is None:
                 return None
-            amount = float(val)
-            if amount <= 0:
+            amount = Money.parse(val)
+            if amount.cents <= 0:
                 messagebox.showerror("Invalid Input", "Please enter a positive amount.")
                 return None
             return amount
@@ -87,82 +152,150 @@ class CustomerDashboard:
             messagebox.showerror("Invalid Input", "Please enter a valid number.")
             return None
 
+    def run_operation(self, operation, amount, action, shortfall_message=None):
+        # The model checks funds inside its UPDATE, so a False result means insufficient balance
+        def on_done(succeeded):
+            self.update_balances()
+            self.refresh_transactions()
+            if succeeded:
+                log_action(self.user.id, action, "success")
+            else:
+                messagebox.showerror("Insufficient Funds", shortfall_message)
+                log_action(self.user.id, action, "failed")
+        run_async(lambda: accounts.apply(self.user.id, operation, amount), on_done, self.show_error)
+
     def deposit_credit(self):
         amount = self.get_amount("Enter amount to deposit to credit:")
         if amount is not None:
-            self.user.deposit_to_credit(amount)
-            self.update_balances()
-            self.populate_transactions()
-            log_action(self.user.id, "deposit_to_credit", "success")
+            self.run_operation("credit_deposit", amount, "deposit_to_credit")
 
     def deposit_wallet(self):
         amount = self.get_amount("Enter amount to deposit to wallet:")
         if amount is not None:
-            self.user.deposit_to_wallet(amount)
-            self.update_balances()
-            self.populate_transactions()
-            log_action(self.user.id, "deposit_to_wallet", "success")
+            self.run_operation("wallet_deposit", amount, "deposit_to_wallet")
 
     def withdraw_credit(self):
         amount = self.get_amount("Enter amount to withdraw from credit:")
         if amount is not None:
-            cursor.execute("SELECT credit FROM customers WHERE user_id = ?", (self.user.id,))
-            current = cursor.fetchone()[0]
-            if amount > current:
-                messagebox.showerror("Insufficient Funds", "You do not have enough credit balance.")
-                log_action(self.user.id, "withdraw_from_credit", "failed")
-            else:
-                self.user.withdraw_from_credit(amount)
-                self.update_balances()
-                self.populate_transactions()
-                log_action(self.user.id, "withdraw_from_credit", "success")
+            self.run_operation("credit_withdraw", amount, "withdraw_from_credit",
+                               "You do not have enough credit balance.")
 
     def withdraw_wallet(self):
         amount = self.get_amount("Enter amount to withdraw from wallet:")
         if amount is not None:
-            cursor.execute("SELECT wallet_balance FROM customers WHERE user_id = ?", (self.user.id,))
-            current = cursor.fetchone()[0]
-            if amount > current:
-                messagebox.showerror("Insufficient Funds", "You do not have enough wallet balance.")
-                log_action(self.user.id, "withdraw_from_wallet", "failed")
-            else:
-                self.user.withdraw_from_wallet(amount)
-                self.update_balances()
-                self.populate_transactions()
-                log_action(self.user.id, "withdraw_from_wallet", "success")
+            self.run_operation("wallet_withdraw", amount, "withdraw_from_wallet",
+                               "You do not have enough wallet balance.")
 
     def wallet_to_credit(self):
         amount = self.get_amount("Enter amount to transfer from Wallet to Credit:")
         if amount is not None:
-            cursor.execute("SELECT wallet_balance FROM customers WHERE user_id = ?", (self.user.id,))
-            wallet_balance = cursor.fetchone()[0]
-            if amount > wallet_balance:
-                messagebox.showerror("Insufficient Funds", "You do not have enough wallet balance.")
-                log_action(self.user.id, "wallet_to_credit", "failed")
-            else:
-                # Perform the transfer
-                cursor.execute("UPDATE customers SET wallet_balance = wallet_balance - ?, credit = credit + ? WHERE user_id = ?", (amount, amount, self.user.id))
-                cursor.execute("INSERT INTO transactions (user_id, type, amount, status, timestamp) VALUES (?, 'Transfer to Credit', ?, 'Completed', ?)", (self.user.id, amount, datetime.datetime.now()))
-                self.update_balances()
-                self.populate_transactions()
-                log_action(self.user.id, "wallet_to_credit", "success")
+            self.run_operation("wallet_to_credit", amount, "wallet_to_credit",
+                               "You do not have enough wallet balance.")
 
     def credit_to_wallet(self):
         amount = self.get_amount("Enter amount to transfer from Credit to Wallet:")
         if amount is not None:
-            cursor.execute("SELECT credit FROM customers WHERE user_id = ?", (self.user.id,))
-            credit_balance = cursor.fetchone()[0]
-            if amount > credit_balance:
-                messagebox.showerror("Insufficient Funds", "You do not have enough credit balance.")
-                log_action(self.user.id, "credit_to_wallet", "failed")
+            self.run_operation("credit_to_wallet", amount, "credit_to_wallet",
+                               "You do not have enough credit balance.")
+
+    def send_money(self):
+        recipient_id = simpledialog.askinteger("Send Money", "Recipient's customer ID:")
+        if recipient_id is None:
+            return
+        amount = self.get_amount("Enter amount to send from your wallet:")
+        if amount is None:
+            return
+        def on_done(sent):
+            self.update_balances()
+            self.refresh_transactions()
+            if sent:
+                log_action(self.user.id, "transfer", "success", recipient_id=recipient_id)
+                messagebox.showinfo("Success", f"Sent ${amount} to customer {recipient_id}.")
             else:
-                # Perform the transfer
-                cursor.execute("UPDATE customers SET credit = credit - ?, wallet_balance = wallet_balance + ? WHERE user_id = ?", (amount, amount, self.user.id))
-                cursor.execute("INSERT INTO transactions (user_id, type, amount, status, timestamp) VALUES (?, 'Transfer to Wallet', ?, 'Completed', ?)", (self.user.id, amount, datetime.datetime.now()))
-                self.update_balances()
-                self.populate_transactions()
-                log_action(self.user.id, "credit_to_wallet", "success")
+                messagebox.showerror("Insufficient Funds", "You do not have enough wallet balance.")
+                log_action(self.user.id, "transfer", "failed", recipient_id=recipient_id)
+        run_async(lambda: accounts.transfer(self.user.id, recipient_id, amount), on_done, self.show_error)
 
     def logout(self):
         self.session.stop()
         self.logout_callback()
+
+    def session_expired(self):
+        # Called by the session manager once the idle timeout passes
+        self.logout()
+        messagebox.showinfo("Session Expired", "You were signed out after being idle.")
+
+
+class ScheduleWindow:
+    # The customer's one-off and recurring operations; the scheduler runs them
+    COLUMNS = ("ID", "Operation", "Amount", "Every", "Next Run", "Runs", "Last Status")
+
+    def __init__(self, parent, user):
+        self.user = user
+        self.top = tk.Toplevel(parent)
+        self.top.title("Scheduled Operations")
+
+        ttk.Label(self.top, text="Operation:").grid(row=0, column=0, padx=10, pady=5, sticky="e")
+        self.operation_var = tk.StringVar(value="wallet_to_credit")
+        ttk.Combobox(self.top, textvariable=self.operation_var, values=sorted(OPERATIONS), state="readonly",
+                     width=18).grid(row=0, column=1, pady=5, sticky="w")
+        ttk.Label(self.top, text="Amount:").grid(row=0, column=2, padx=10, pady=5, sticky="e")
+        self.amount_var = tk.StringVar()
+        ttk.Entry(self.top, textvariable=self.amount_var, width=12).grid(row=0, column=3, pady=5, sticky="w")
+        ttk.Label(self.top, text="Start (YYYY-MM-DD, blank = now):").grid(row=1, column=0, padx=10, pady=5, sticky="e")
+        self.start_var = tk.StringVar()
+        ttk.Entry(self.top, textvariable=self.start_var, width=20).grid(row=1, column=1, pady=5, sticky="w")
+        ttk.Label(self.top, text="Repeat:").grid(row=1, column=2, padx=10, pady=5, sticky="e")
+        self.every_var = tk.StringVar(value="once")
+        ttk.Combobox(self.top, textvariable=self.every_var, values=("once",) + EVERY, state="readonly",
+                     width=10).grid(row=1, column=3, pady=5, sticky="w")
+        ttk.Button(self.top, text="Schedule", command=self.add).grid(row=1, column=4, padx=10, pady=5)
+
+        self.tree = ttk.Treeview(self.top, columns=self.COLUMNS, show="headings", height=10)
+        for col in self.COLUMNS:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, anchor="center", width=110)
+        self.tree.grid(row=2, column=0, columnspan=5, sticky="nsew", padx=10, pady=10)
+        ttk.Button(self.top, text="Cancel Selected", command=self.cancel).grid(row=3, column=0, columnspan=5, pady=(0, 10))
+        self.top.grid_rowconfigure(2, weight=1)
+        self.top.grid_columnconfigure(4, weight=1)
+        self.refresh()
+
+    def show_error(self, error):
+        if self.top.winfo_exists():
+            messagebox.showerror("Error", f"Operation failed: {error}", parent=self.top)
+
+    def refresh(self):
+        def show(rows):
+            if not self.top.winfo_exists():
+                return
+            self.tree.delete(*self.tree.get_children())
+            for schedule_id, operation, amount, every, next_run_at, runs, _, last_status in rows:
+                self.tree.insert("", "end", iid=str(schedule_id), values=(
+                    schedule_id, operation, amount, every or "once", next_run_at or "finished", runs, last_status or ""))
+        run_async(lambda: accounts.schedules(self.user.id), show, self.show_error)
+
+    def add(self):
+        try:
+            amount = Money.parse(self.amount_var.get())
+        except ValueError:
+            messagebox.showerror("Invalid Input", "Please enter a valid number.", parent=self.top)
+            return
+        operation, start = self.operation_var.get(), self.start_var.get().strip() or None
+        every = None if self.every_var.get() == "once" else self.every_var.get()
+        def on_done(schedule_id):
+            log_action(self.user.id, "schedule", "success", schedule_id=schedule_id)
+            self.amount_var.set("")
+            self.refresh()
+        run_async(lambda: accounts.schedule(self.user.id, operation, amount, start, every), on_done, self.show_error)
+
+    def cancel(self):
+        selected = self.tree.selection()
+        if not selected:
+            return
+        schedule_id = int(selected[0])
+        def on_done(cancelled):
+            if cancelled:
+                log_action(self.user.id, "cancel_schedule", "success", schedule_id=schedule_id)
+            self.refresh()
+        run_async(lambda: accounts.cancel_schedule(self.user.id, schedule_id), on_done, self.show_error)
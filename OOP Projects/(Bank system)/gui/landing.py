@@ -2,16 +2,15 @@ import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 import os, sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from models.models import Customer, Admin, User
-from database import create_tables, cursor
-
-create_tables()
+from services import auth
+from utils.tasks import start as start_tasks, run_async
 
 class BankingApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Nile Valley Bank System")
         self.current_user = None
+        start_tasks(self.root)
         self.build_role_selection()
 
     def clear_window(self):
@@ -52,13 +51,11 @@ class BankingApp:
             if not all([name, nid, phone, password]):
                 messagebox.showerror("Error", "All fields are required.")
                 return
-            try:
-                admin = Admin(name, nid, phone, password)
-                admin.save_to_db()
+            def on_done(_):
                 messagebox.showinfo("Success", "Admin registered successfully!")
                 self.build_admin_signin()
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to register admin: {e}")
+            # bcrypt hashing happens in Admin.__init__, so registration runs off the UI thread
+            run_async(lambda: auth.register_admin(name, nid, phone, password), on_done, lambda e: messagebox.showerror("Error", f"Failed to register admin: {e}"))
         ttk.Button(frame, text="Sign Up", command=signup_action).grid(row=5, column=0, columnspan=2, pady=10)
         ttk.Button(frame, text="Back", command=self.build_admin_choice).grid(row=6, column=0, columnspan=2)
 
@@ -76,14 +73,13 @@ class BankingApp:
         def signin_action():
             name = name_entry.get()
             password = password_entry.get()
-            cursor.execute("SELECT * FROM users WHERE name=? AND user_type='admin'", (name,))
-            row = cursor.fetchone()
-            if row and Admin.verify_password(password, row[4]):
-                self.current_user = Admin(row[1], row[2], row[3], row[4])
-                self.current_user.id = row[0]
+            def on_done(user):
+                if user is None:
+                    messagebox.showerror("Error", "Invalid credentials.")
+                    return
+                self.current_user = user
                 self.load_admin_dashboard()
-            else:
-                messagebox.showerror("Error", "Invalid credentials.")
+            run_async(lambda: auth.sign_in(name, password, "admin"), on_done, lambda e: messagebox.showerror("Error", f"Sign in failed: {e}"))
         ttk.Button(frame, text="Sign In", command=signin_action).grid(row=3, column=0, columnspan=2, pady=10)
         ttk.Button(frame, text="Back", command=self.build_admin_choice).grid(row=4, column=0, columnspan=2)
 
@@ -101,14 +97,13 @@ class BankingApp:
         def signin_action():
             name = name_entry.get()
             password = password_entry.get()
-            cursor.execute("SELECT * FROM users WHERE name=? AND user_type='customer'", (name,))
-            row = cursor.fetchone()
-            if row and Customer.verify_password(password, row[4]):
-                self.current_user = Customer(row[1], row[2], row[3], row[4])
-                self.current_user.id = row[0]
+            def on_done(user):
+                if user is None:
+                    messagebox.showerror("Error", "Invalid credentials.")
+                    return
+                self.current_user = user
                 self.load_customer_dashboard()
-            else:
-                messagebox.showerror("Error", "Invalid credentials.")
+            run_async(lambda: auth.sign_in(name, password, "customer"), on_done, lambda e: messagebox.showerror("Error", f"Sign in failed: {e}"))
         ttk.Button(frame, text="Sign In", command=signin_action).grid(row=3, column=0, columnspan=2, pady=10)
         ttk.Button(frame, text="Back", command=self.build_role_selection).grid(row=4, column=0, columnspan=2)
 
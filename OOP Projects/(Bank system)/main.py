@@ -1,9 +1,16 @@
 from database import create_tables
-from gui.landing import BankingApp
-import tkinter as tk
+from models import scheduler
+from utils import metrics
 
 if __name__ == "__main__":
+    # Before the GUI is imported, so the connections it opens are timed
+    metrics.configure_from_env()
+    import tkinter as tk
+    from gui.landing import BankingApp
     create_tables()
+    # Runs scheduled operations while the app is open; see models/scheduler.py
+    scheduler.enable()
     root = tk.Tk()
     app = BankingApp(root)
     root.mainloop()
+    scheduler.disable()
@@ -0,0 +1,274 @@
+# migrations.py
+import datetime
+import database
+from database import connection
+from models import snapshots
+
+
+def column_type(conn, table, column):
+    for row in conn.execute(f"PRAGMA table_info({table})"):
+        if row[1] == column:
+            return row[2].upper()
+    return None
+
+
+def money_to_minor_units(conn):
+    # SQLite cannot change a column's type in place, so both tables are rebuilt
+    # with INTEGER cents columns and the REAL values are rounded across once.
+    # Legacy timestamps ("YYYY-MM-DD HH:MM:SS") become ISO "T" ones on the way,
+    # so (timestamp, id) keyset order compares them correctly with new rows.
+    if column_type(conn, "customers", "credit") != "INTEGER":
+        conn.execute('''
+            CREATE TABLE customers_cents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER UNIQUE,
+                credit INTEGER DEFAULT 0,
+                wallet_balance INTEGER DEFAULT 0,
+                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        ''')
+        conn.execute('''
+            INSERT INTO customers_cents (id, user_id, credit, wallet_balance)
+            SELECT id, user_id, CAST(ROUND(credit * 100) AS INTEGER), CAST(ROUND(wallet_balance * 100) AS INTEGER)
+            FROM customers
+        ''')
+        conn.execute("DROP TABLE customers")
+        conn.execute("ALTER TABLE customers_cents RENAME TO customers")
+    if column_type(conn, "transactions", "amount") != "INTEGER":
+        conn.execute('''
+            CREATE TABLE transactions_cents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                type TEXT,
+                amount INTEGER,
+                status TEXT,
+                timestamp TEXT,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+        ''')
+        conn.execute('''
+            INSERT INTO transactions_cents (id, user_id, type, amount, status, timestamp)
+            SELECT id, user_id, type, CAST(ROUND(amount * 100) AS INTEGER), status, replace(timestamp, ' ', 'T')
+            FROM transactions
+        ''')
+        conn.execute("DROP TABLE transactions")
+        conn.execute("ALTER TABLE transactions_cents RENAME TO transactions")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_time ON transactions (user_id, timestamp)")
+
+
+def create_snapshots(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id INTEGER,
+            day TEXT,
+            type TEXT,
+            status TEXT,
+            count INTEGER,
+            amount INTEGER,
+            PRIMARY KEY (user_id, day, type, status)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_balances (
+            user_id INTEGER,
+            day TEXT,
+            credit INTEGER,
+            wallet_balance INTEGER,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bank_daily_totals (
+            day TEXT,
+            type TEXT,
+            status TEXT,
+            count INTEGER,
+            amount INTEGER,
+            PRIMARY KEY (day, type, status)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE VIEW IF NOT EXISTS monthly_totals AS
+        SELECT user_id, substr(day, 1, 7) AS month, type, status, SUM(count) AS count, SUM(amount) AS amount
+        FROM daily_totals GROUP BY user_id, month, type, status
+    ''')
+    # Backfill from the existing ledger
+    user_totals, bank, balances, _ = snapshots.expected_snapshots(conn)
+    snapshots.replace_all(conn, user_totals, bank, balances)
+
+
+# Ordered list of (version, description, steps). A step is either an SQL string
+# or a callable taking the open connection. A migration's steps and its version
+# row commit together, and steps should still be safe to run on a database that
+# already has the change.
+MIGRATIONS = [
+    (1, "index users by (user_type, name) for sign-in and admin listing", [
+        "CREATE INDEX IF NOT EXISTS idx_users_type_name ON users (user_type, name)",
+    ]),
+    (2, "index transactions by (user_id, timestamp) for customer history", [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_time ON transactions (user_id, timestamp)",
+    ]),
+    (3, "store balances and amounts as INTEGER cents", [
+        money_to_minor_units,
+    ]),
+    (4, "daily totals and closing balance snapshots", [
+        create_snapshots,
+    ]),
+    (5, "sign-in attempt tracking for throttling", [
+        '''
+        CREATE TABLE IF NOT EXISTS login_attempts (
+            key TEXT PRIMARY KEY,
+            failures INTEGER NOT NULL,
+            last_failure REAL NOT NULL,
+            blocked_until REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (6, "persisted sessions keyed by token hash", [
+        '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            key TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            user_type TEXT NOT NULL,
+            created REAL NOT NULL,
+            last_seen REAL NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (7, "registry of monthly transaction archive files", [
+        '''
+        CREATE TABLE IF NOT EXISTS archives (
+            period TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            first_ts TEXT NOT NULL,
+            last_ts TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            archived_at TEXT NOT NULL
+        )
+        ''',
+    ]),
+    (8, "customer-to-customer transfers linking their paired transaction rows", [
+        '''
+        CREATE TABLE IF NOT EXISTS transfers (
+            id INTEGER PRIMARY KEY,
+            sender_id INTEGER NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            debit_id INTEGER NOT NULL,
+            credit_id INTEGER NOT NULL,
+            timestamp TEXT NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_transfers_sender ON transfers (sender_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_transfers_recipient ON transfers (recipient_id, timestamp)",
+    ]),
+    (9, "shard list and the outbox/inbox for transfers between shards", [
+        '''
+        CREATE TABLE IF NOT EXISTS shards (
+            shard INTEGER PRIMARY KEY,
+            path TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS transfer_outbox (
+            debit_id INTEGER PRIMARY KEY,
+            sender_id INTEGER NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            timestamp TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS transfer_inbox (
+            debit_id INTEGER PRIMARY KEY,
+            credit_id INTEGER
+        )
+        ''',
+    ]),
+    (10, "one-off and recurring scheduled operations", [
+        # every is NULL for a one-off; next_run_at is NULL once it has run or was cancelled
+        '''
+        CREATE TABLE IF NOT EXISTS schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            operation TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            every TEXT CHECK(every IN ('day', 'week', 'month')),
+            start_at TEXT NOT NULL,
+            next_run_at TEXT,
+            runs INTEGER NOT NULL DEFAULT 0,
+            last_run_at TEXT,
+            last_status TEXT,
+            created_at TEXT NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_schedules_due ON schedules (next_run_at, id) WHERE next_run_at IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS idx_schedules_user ON schedules (user_id)",
+    ]),
+]
+
+# Queries the GUI runs on every sign-in, dashboard load and admin refresh;
+# none of them may fall back to a full table scan
+HOT_QUERIES = [
+    ("customer sign-in", "SELECT * FROM users WHERE name=? AND user_type='customer'", ("x",)),
+    ("admin sign-in", "SELECT * FROM users WHERE name=? AND user_type='admin'", ("x",)),
+    ("customer history", "SELECT id, type, amount, status, timestamp FROM transactions WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?", (1, 100)),
+    ("customer history page", "SELECT id, type, amount, status, timestamp FROM transactions WHERE user_id = ? AND (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT ?", (1, "9999", 0, 100)),
+    ("admin customer list", "SELECT id, name, national_id, phone_number FROM users WHERE user_type = 'customer'", ()),
+    ("admin customer window", "SELECT id, name, national_id, phone_number, is_locked FROM users WHERE user_type = 'customer' AND (name, id) > (?, ?) ORDER BY name, id LIMIT ?", ("", 0, 200)),
+    ("statement opening balance", "SELECT credit, wallet_balance FROM daily_balances WHERE user_id = ? AND day < ? ORDER BY day DESC LIMIT 1", (1, "2025-01-01")),
+    ("statement days", "SELECT day, type, status, count, amount FROM daily_totals WHERE user_id = ? AND day BETWEEN ? AND ? ORDER BY day, type, status", (1, "2025-01-01", "2025-01-31")),
+    ("admin customer search", "SELECT id, name, national_id, phone_number, is_locked FROM users WHERE user_type = 'customer' AND name >= ? AND name < ? ORDER BY name, id LIMIT ?", ("ab", "ab\U0010ffff", 200)),
+    ("scheduler window", "SELECT next_run_at, id, user_id, runs FROM schedules WHERE next_run_at IS NOT NULL ORDER BY next_run_at, id LIMIT ?", (100000,)),
+    ("customer schedules", "SELECT id, operation, amount, every, next_run_at, runs, last_run_at, last_status FROM schedules WHERE user_id = ? ORDER BY id", (1,)),
+]
+
+
+def current_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        )
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(target=None, db=None):
+    # db: the pool to migrate, the main database by default
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with (db or database.pool).transaction() as conn:
+            # Re-read inside the write lock so two processes never apply the same migration
+            if version <= current_version(conn):
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.datetime.now().isoformat())
+            )
+        applied.append(version)
+    return applied
+
+
+def full_scans():
+    # Returns (name, plan detail) for every hot query whose plan scans a table
+    # or sorts in a temp b-tree instead of walking an index
+    problems = []
+    with connection() as conn:
+        for name, sql, params in HOT_QUERIES:
+            for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+                detail = row[-1]
+                if detail.startswith("SCAN") or "TEMP B-TREE" in detail:
+                    problems.append((name, detail))
+    return problems
+
+__all__ = ["MIGRATIONS", "HOT_QUERIES", "current_version", "migrate", "full_scans"]
@@ -0,0 +1,234 @@
+# archive.py
+# Moves whole months of old transactions out of the hot database into one
+# read-only SQLite file per month (archive/transactions-YYYY-MM.db next to
+# the database). The archives table in the hot database lists them, and a
+# file only counts once its row is there: the copy is written and renamed
+# into place first, then registration and the DELETE from transactions commit
+# together, so a crash part way leaves either the hot rows or a registered
+# archive, never both and never neither.
+#
+# When sharded, a month's file takes the rows of every shard and stays in one
+# registry in the main database. Registration then commits first and each
+# shard's DELETE after it; a crash in between leaves rows in both places until
+# the month is archived again, which merges them by id, but never loses any.
+#
+# Archive files are VACUUMed, use the rollback journal (no -wal/-shm), are
+# chmod 0444 and are opened with mode=ro&immutable=1. They are queried through
+# their own read-only connections rather than ATTACH, which SQLite caps at 10
+# databases per connection by default. Connections are per thread; when a file
+# is replaced, retire() bumps its generation and every thread closes its stale
+# connections the next time it opens an archive.
+import datetime
+import os
+import sqlite3
+import threading
+from urllib.parse import quote
+import database
+import sharding
+from database import connection, transaction
+
+ARCHIVE_DIR = os.environ.get("BANK_ARCHIVE_DIR")
+COLUMNS = "id, user_id, type, amount, status, timestamp"
+ARCHIVE_SCHEMA = '''
+    CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        type TEXT,
+        amount INTEGER,
+        status TEXT,
+        timestamp TEXT
+    );
+    CREATE INDEX idx_transactions_user_time ON transactions (user_id, timestamp);
+'''
+
+_local = threading.local()
+_lock = threading.Lock()
+# Generation of each archive file, bumped by retire(); _epoch changes with any
+# of them, so threads only re-check their connections after a retire
+_generations = {}
+_epoch = 0
+
+
+def archive_dir():
+    return ARCHIVE_DIR or os.path.join(os.path.dirname(os.path.abspath(database.pool.path)), "archive")
+
+
+def periods():
+    # (period, path, first timestamp, last timestamp, rows), oldest first. Files
+    # are registered by name, so the database and archive/ can move together.
+    with connection() as conn:
+        rows = conn.execute("SELECT period, path, first_ts, last_ts, row_count FROM archives ORDER BY period").fetchall()
+    folder = archive_dir()
+    return [(period, os.path.join(folder, name), *rest) for period, name, *rest in rows]
+
+
+def open_archive(path):
+    # One read-only connection per archive file and thread. Connections to
+    # files retired since this thread last looked are closed first.
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    epoch = _epoch
+    if getattr(_local, "epoch", 0) != epoch:
+        _local.epoch = epoch
+        for stale in [p for p, (_, generation) in conns.items() if generation != _generations.get(p, 0)]:
+            conns.pop(stale)[0].close()
+    found = conns.get(path)
+    if found is None:
+        found = conns[path] = (sqlite3.connect(f"file:{quote(path)}?mode=ro&immutable=1", uri=True),
+                               _generations.get(path, 0))
+    return found[0]
+
+
+def close_archives():
+    # Closes the calling thread's archive connections
+    for conn, _ in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
+
+
+def retire(path):
+    # Invalidates every thread's connection to path, e.g. before deleting it.
+    # Other threads close theirs on their next open_archive(); a query already
+    # running on one finishes against the open file.
+    global _epoch
+    with _lock:
+        _generations[path] = _generations.get(path, 0) + 1
+        _epoch += 1
+    conns = getattr(_local, "conns", {})
+    if path in conns:
+        conns.pop(path)[0].close()
+
+
+def history(user_id, limit, before=None):
+    # Keyset page (newest first) continued into the archives, newest month first.
+    # before is the (timestamp, id) of the oldest row already shown.
+    rows = []
+    for period, path, first_ts, last_ts, _ in reversed(periods()):
+        if before is not None and first_ts > before[0]:
+            continue
+        conn = open_archive(path)
+        if before is None:
+            found = conn.execute(
+                "SELECT id, type, amount, status, timestamp FROM transactions WHERE user_id = ? "
+                "ORDER BY timestamp DESC, id DESC LIMIT ?", (user_id, limit - len(rows))).fetchall()
+        else:
+            found = conn.execute(
+                "SELECT id, type, amount, status, timestamp FROM transactions WHERE user_id = ? AND (timestamp, id) < (?, ?) "
+                "ORDER BY timestamp DESC, id DESC LIMIT ?", (user_id, before[0], before[1], limit - len(rows))).fetchall()
+        rows.extend(found)
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def since(user_id, after):
+    # Archived rows newer than the (timestamp, id) cursor, newest first
+    rows = []
+    for period, path, first_ts, last_ts, _ in reversed(periods()):
+        if last_ts < after[0]:
+            break
+        rows.extend(open_archive(path).execute(
+            "SELECT id, type, amount, status, timestamp FROM transactions WHERE user_id = ? AND (timestamp, id) > (?, ?) "
+            "ORDER BY timestamp DESC, id DESC", (user_id, after[0], after[1])).fetchall())
+    return rows
+
+
+def sources(conn):
+    # The hot connection followed by every archive, for whole-ledger scans.
+    # Migrations run before the archives table exists see only the hot table.
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archives'").fetchone() is None:
+        return [conn]
+    return [conn] + [open_archive(path) for _, path, _, _, _ in periods()]
+
+
+def month_start(day):
+    return day[:7] + "-01"
+
+
+def next_month(period):
+    year, month = int(period[:4]), int(period[5:7])
+    return f"{year + month // 12:04d}-{month % 12 + 1:02d}"
+
+
+def archive_before(cutoff_day, vacuum=False):
+    # Archives every whole month before the month containing cutoff_day
+    # (YYYY-MM-DD). Returns [(period, rows moved)]. Freed pages are reused by
+    # new rows; vacuum=True also shrinks the hot file, holding the write lock
+    # while it rewrites it.
+    datetime.date.fromisoformat(cutoff_day)
+    bound = month_start(cutoff_day)
+
+    def months_in(db):
+        with db.connection() as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT DISTINCT substr(timestamp, 1, 7) FROM transactions WHERE timestamp < ?", (bound,))]
+    months = sorted({month for found in sharding.fan_out(months_in) for month in found})
+    os.makedirs(archive_dir(), exist_ok=True)
+    moved = [(period, archive_month(period)) for period in months]
+    if vacuum:
+        for db in sharding.pools():
+            with db.connection() as conn:
+                conn.execute("VACUUM")
+    return moved
+
+
+def archive_month(period):
+    start, end = period, next_month(period)
+    existing = dict((p, f) for p, f, _, _, _ in periods()).get(period)
+    # A month archived again gets a new file, so the registered one stays valid until the switch commits
+    name = f"transactions-{period}.db" if existing is None else f"transactions-{period}-{datetime.datetime.now():%Y%m%d%H%M%S}.db"
+    path = os.path.join(archive_dir(), name)
+    temp = path + ".tmp"
+    if os.path.exists(temp):
+        os.remove(temp)
+
+    # Copy into a fresh file: rows already archived for the month (late
+    # arrivals re-archive the whole month) plus every shard's hot rows. Rows
+    # already in the old file are skipped by id, see the note on sharding above.
+    out = sqlite3.connect(temp, isolation_level=None)
+    max_ids = []
+    try:
+        out.executescript(ARCHIVE_SCHEMA)
+        out.execute("BEGIN")
+        if existing:
+            out.executemany(f"INSERT INTO transactions ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                            open_archive(existing).execute(f"SELECT {COLUMNS} FROM transactions"))
+        for db in sharding.pools():
+            with db.connection() as conn:
+                rows = conn.execute(
+                    f"SELECT {COLUMNS} FROM transactions WHERE timestamp >= ? AND timestamp < ?", (start, end)).fetchall()
+            out.executemany(f"INSERT OR IGNORE INTO transactions ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            # Only rows copied here may be deleted; later ones have higher ids in their shard
+            max_ids.append((db, max((row[0] for row in rows), default=0)))
+        out.execute("COMMIT")
+        count, first_ts, last_ts = out.execute(
+            "SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM transactions").fetchone()
+        out.execute("VACUUM")
+        out.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        out.close()
+    with open(temp, "rb+") as f:
+        os.fsync(f.fileno())
+
+    os.replace(temp, path)
+    os.chmod(path, 0o444)
+
+    def delete(db, max_id):
+        with db.transaction() as conn:
+            return conn.execute(
+                "DELETE FROM transactions WHERE timestamp >= ? AND timestamp < ? AND id <= ?", (start, end, max_id)).rowcount
+
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO archives (period, path, first_ts, last_ts, row_count, archived_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (period, name, first_ts, last_ts, count, datetime.datetime.now().isoformat()))
+        if not sharding.enabled():
+            # The main database's DELETE joins the registration
+            moved = delete(*max_ids[0])
+    if sharding.enabled():
+        moved = sum(delete(db, max_id) for db, max_id in max_ids)
+    if existing:
+        retire(existing)
+        os.remove(existing)
+    return moved
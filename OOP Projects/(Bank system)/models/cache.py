@@ -0,0 +1,103 @@
+# cache.py
+# Read-through LRU caches for customer balances and users rows. Writers call
+# invalidate() after their transaction commits (database.after_commit). A
+# reader that misses leaves a placeholder while it queries; an invalidation
+# in the meantime removes it, so the reader's possibly stale row is returned
+# but not cached.
+import os
+import threading
+from collections import OrderedDict
+
+CACHE_SIZE = int(os.environ.get("BANK_CACHE_SIZE", "10000"))
+
+
+class LRUCache:
+    def __init__(self, name, max_entries=CACHE_SIZE):
+        self.name = name
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, load):
+        # Returns the cached value for key, or load() on a miss. None is never cached.
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None and not isinstance(value, _Loading):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+            if not self.max_entries:
+                marker = None
+            elif value is None:
+                marker = self.entries[key] = _Loading()
+            else:
+                # Another thread is already loading; share its placeholder
+                marker = value
+        value = load()
+        if marker is not None:
+            with self.lock:
+                if self.entries.get(key) is marker:
+                    if value is None:
+                        del self.entries[key]
+                    else:
+                        self.entries[key] = value
+                        self.entries.move_to_end(key)
+                        while len(self.entries) > self.max_entries:
+                            self.entries.popitem(last=False)
+                            self.evictions += 1
+        return value
+
+    def invalidate(self, *keys):
+        with self.lock:
+            for key in keys:
+                if self.entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class _Loading:
+    __slots__ = ()
+
+
+balances = LRUCache("balances")   # user_id -> (credit, wallet_balance) cents
+users = LRUCache("users")         # user_id -> users row
+user_ids = LRUCache("user_ids")   # (user_type, name) -> user_id
+
+
+def invalidate_balances(*user_ids):
+    balances.invalidate(*user_ids)
+
+
+def invalidate_user(user_id):
+    users.invalidate(user_id)
+    balances.invalidate(user_id)
+
+
+def clear():
+    for cache in (balances, users, user_ids):
+        cache.clear()
+
+
+def stats():
+    return {cache.name: cache.stats() for cache in (balances, users, user_ids)}
@@ -0,0 +1,189 @@
+# journal.py
+# Optional group commit for ledger writes. Callers queue a write and get a
+# Future; one flusher thread applies everything queued within flush_interval
+# (or up to max_batch writes) in a single BEGIN IMMEDIATE ... COMMIT on its
+# own connection, so many concurrent writers share one fsync. Each write runs
+# under its own SAVEPOINT, so one failing write only fails its own future.
+#
+# Durability is explicit: futures resolve only after COMMIT returns, and
+#   "full"   - synchronous=FULL: the WAL is fsynced on every batch commit;
+#              a resolved write survives power loss
+#   "normal" - synchronous=NORMAL: the WAL is fsynced at checkpoints only;
+#              a resolved write survives a process crash, but the last
+#              batches can be lost on power loss or an OS crash
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+import database
+import sharding
+from models import cache
+
+FLUSH_INTERVAL_MS = 2.0
+MAX_BATCH = 500
+QUEUE_SIZE = 10000
+DURABILITY = {"full": "FULL", "normal": "NORMAL"}
+
+_STOP = object()
+
+
+class JournalClosedError(RuntimeError):
+    pass
+
+
+class GroupCommitJournal:
+    def __init__(self, flush_interval_ms=FLUSH_INTERVAL_MS, max_batch=MAX_BATCH,
+                 durability="full", queue_size=QUEUE_SIZE, path=None):
+        if durability not in DURABILITY:
+            raise ValueError(f"durability must be one of {tuple(DURABILITY)}")
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.durability = durability
+        self.path = path or database.pool.path
+        # Bounded, so a writer blocks instead of queueing without limit when the disk falls behind
+        self.pending = queue.Queue(maxsize=queue_size)
+        self.closed = False
+        # Makes submit's closed check and put atomic with close(), so nothing
+        # is queued behind _STOP. A put blocked on a full queue still gets
+        # room, since the flusher never takes it.
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.writes = 0
+        self.largest_batch = 0
+        self.conn = self.connect()
+        self.thread = threading.Thread(target=self.run, name="bank-journal", daemon=True)
+        self.thread.start()
+
+    def connect(self):
+        busy_timeout = database.pool.busy_timeout
+        conn = sqlite3.connect(self.path, timeout=busy_timeout, check_same_thread=False,
+                               isolation_level=None, factory=database.connection_factory)
+        conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {DURABILITY[self.durability]}")
+        return conn
+
+    def submit(self, user_ids, write):
+        # write(conn) runs inside the batch transaction; the future gets its
+        # return value (or exception) once the batch is committed. The cached
+        # balances of user_ids (a tuple) are invalidated before the future resolves.
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise JournalClosedError("The journal is closed.")
+            self.pending.put((user_ids, write, future))
+        return future
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.pending.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.flush(batch)
+            if stopping:
+                return
+
+    def flush(self, batch):
+        results = []
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for _, write, future in batch:
+                self.conn.execute("SAVEPOINT write")
+                try:
+                    results.append((True, write(self.conn)))
+                    self.conn.execute("RELEASE write")
+                except Exception as e:
+                    self.conn.execute("ROLLBACK TO write")
+                    self.conn.execute("RELEASE write")
+                    results.append((False, e))
+            self.conn.commit()
+        except Exception as e:
+            # The batch never committed: nothing in it is durable
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        cache.invalidate_balances(*{user_id for user_ids, _, _ in batch for user_id in user_ids})
+        self.batches += 1
+        self.writes += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for (_, _, future), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def close(self):
+        # Flushes everything already queued, then stops the flusher
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.pending.put(_STOP)
+        self.thread.join()
+        self.conn.close()
+
+    def stats(self):
+        return {
+            "durability": self.durability,
+            "batches": self.batches,
+            "writes": self.writes,
+            "mean_batch": round(self.writes / self.batches, 2) if self.batches else 0,
+            "largest_batch": self.largest_batch,
+            "queued": self.pending.qsize(),
+        }
+
+
+class ShardedJournal:
+    # One journal per shard file; a write goes to the shard of its first user
+    def __init__(self, **options):
+        self.journals = [GroupCommitJournal(path=db.path, **options) for db in sharding.pools()]
+
+    def submit(self, user_ids, write):
+        return self.journals[sharding.index(user_ids[0])].submit(user_ids, write)
+
+    def close(self):
+        for journal in self.journals:
+            journal.close()
+
+    def stats(self):
+        shards = [journal.stats() for journal in self.journals]
+        batches, writes = sum(s["batches"] for s in shards), sum(s["writes"] for s in shards)
+        return {
+            "durability": shards[0]["durability"],
+            "batches": batches,
+            "writes": writes,
+            "mean_batch": round(writes / batches, 2) if batches else 0,
+            "largest_batch": max(s["largest_batch"] for s in shards),
+            "queued": sum(s["queued"] for s in shards),
+            "shards": shards,
+        }
+
+
+def enable(**options):
+    # Routes ledger writes through a new journal (one per shard when sharded); returns it
+    from models.ledger import ledger
+    disable()
+    ledger.journal = ShardedJournal(**options) if sharding.enabled() else GroupCommitJournal(**options)
+    return ledger.journal
+
+
+def disable():
+    from models.ledger import ledger
+    journal, ledger.journal = ledger.journal, None
+    if journal is not None:
+        journal.close()
@@ -0,0 +1,335 @@
+# ledger.py
+import datetime
+from concurrent.futures import Future
+from itertools import islice
+import sharding
+from models.money import Money, MAX_CENTS
+from models import cache, snapshots
+
+# Each operation is a single UPDATE. Debits carry their balance check in the
+# WHERE clause, so a zero rowcount means insufficient funds and there is no
+# SELECT-then-UPDATE window for another writer to slip into. Credits likewise
+# stop at MAX_CENTS, so a balance can never overflow SQLite's int64 into REAL;
+# _write tells the two apart when the rowcount is zero.
+OPERATIONS = {
+    "credit_deposit": f"UPDATE customers SET credit = credit + :amount WHERE user_id = :user_id AND credit <= {MAX_CENTS} - :amount",
+    "wallet_deposit": f"UPDATE customers SET wallet_balance = wallet_balance + :amount WHERE user_id = :user_id AND wallet_balance <= {MAX_CENTS} - :amount",
+    "credit_withdraw": "UPDATE customers SET credit = credit - :amount WHERE user_id = :user_id AND credit >= :amount",
+    "wallet_withdraw": "UPDATE customers SET wallet_balance = wallet_balance - :amount WHERE user_id = :user_id AND wallet_balance >= :amount",
+    "wallet_to_credit": f"UPDATE customers SET wallet_balance = wallet_balance - :amount, credit = credit + :amount WHERE user_id = :user_id AND wallet_balance >= :amount AND credit <= {MAX_CENTS} - :amount",
+    "credit_to_wallet": f"UPDATE customers SET credit = credit - :amount, wallet_balance = wallet_balance + :amount WHERE user_id = :user_id AND credit >= :amount AND wallet_balance <= {MAX_CENTS} - :amount",
+}
+# Returns a cross-shard transfer's debit; uncapped so a refund is never refused
+# (a balance can then pass MAX_CENTS by at most one amount, still far from int64)
+REFUND = "UPDATE customers SET wallet_balance = wallet_balance + :amount WHERE user_id = :user_id"
+
+# (credit sign, wallet sign, column that must cover the amount) per operation,
+# used by apply_batch to check a whole chunk in memory
+EFFECTS = {
+    "credit_deposit": (1, 0, None),
+    "wallet_deposit": (0, 1, None),
+    "credit_withdraw": (-1, 0, 0),
+    "wallet_withdraw": (0, -1, 1),
+    "wallet_to_credit": (1, -1, 1),
+    "credit_to_wallet": (-1, 1, 0),
+}
+
+# Rows written in pairs by transfer(), plus the refund of a transfer between
+# shards whose recipient was deleted mid-way. Not operations of their own:
+# apply() and apply_batch() reject them, but snapshots replay them like the rest.
+TRANSFER_EFFECTS = {
+    "transfer_out": (0, -1, 1),
+    "transfer_in": (0, 1, None),
+    "transfer_refund": (0, 1, None),
+}
+RETURNING = " RETURNING credit, wallet_balance"
+
+BATCH_CHUNK_SIZE = 1000
+
+
+class UnknownAccountError(ValueError):
+    pass
+
+
+class BalanceLimitError(ValueError):
+    pass
+
+
+def _over_limit(balance, amount):
+    return balance > MAX_CENTS - amount
+
+
+def _limit_error(user_id):
+    return BalanceLimitError(f"Customer {user_id}'s balance would exceed {Money(MAX_CENTS)}.")
+
+
+class Ledger:
+    # GroupCommitJournal while group commit is on (see models.journal.enable)
+    journal = None
+
+    def apply(self, user_id, operation, amount):
+        # One BEGIN IMMEDIATE ... COMMIT per operation: balance change and
+        # transaction row land together, with a single commit (one fsync).
+        # With group commit on, the write joins the journal's next batch instead.
+        # amount is Money or int cents.
+        amount = Money.coerce(amount).cents
+        db = sharding.pool_for(user_id)
+        if self.journal is not None and not db.in_transaction():
+            return self.submit(user_id, operation, amount).result()
+        with db.transaction() as conn:
+            balances = self._write(conn, user_id, operation, amount)
+            if balances:
+                db.after_commit(lambda: cache.invalidate_balances(user_id))
+        return balances is not None
+
+    def submit(self, user_id, operation, amount):
+        # Future resolving to apply()'s result once the write is durable
+        amount = Money.coerce(amount).cents
+        if self.journal is None:
+            future = Future()
+            future.set_result(self.apply(user_id, operation, amount))
+            return future
+        return self.journal.submit((user_id,), lambda conn: self._write(conn, user_id, operation, amount) is not None)
+
+    def _write(self, conn, user_id, operation, amount):
+        sql = OPERATIONS[operation] + RETURNING
+        balances = conn.execute(sql, {"amount": amount, "user_id": user_id}).fetchone()
+        if balances is None:
+            # Refused for funds, or by the MAX_CENTS cap on the credited column
+            credit_sign, wallet_sign, _ = EFFECTS[operation]
+            row = conn.execute("SELECT credit, wallet_balance FROM customers WHERE user_id = ?", (user_id,)).fetchone()
+            if row and any(sign > 0 and _over_limit(value, amount) for sign, value in zip((credit_sign, wallet_sign), row)):
+                raise _limit_error(user_id)
+        status = "success" if balances else "failed"
+        self.record(conn, user_id, operation, amount, status, balances)
+        return balances
+
+    def transfer(self, sender_id, recipient_id, amount):
+        # Moves amount (Money or int cents) from the sender's wallet to the
+        # recipient's in one transaction: both balance updates, a transfer_out
+        # and a transfer_in row and the transfers row commit or roll back
+        # together. Returns False on insufficient funds (recording a failed
+        # transfer_out); raises UnknownAccountError if either customer is missing.
+        # Customers in different shard files go through _transfer_between.
+        amount = Money.coerce(amount).cents
+        db, recipient_db = sharding.pool_for(sender_id), sharding.pool_for(recipient_id)
+        if db is not recipient_db:
+            return self._transfer_between(db, recipient_db, sender_id, recipient_id, amount)
+        if self.journal is not None and not db.in_transaction():
+            return self.journal.submit((sender_id, recipient_id),
+                                       lambda conn: self._transfer(conn, sender_id, recipient_id, amount)).result()
+        with db.transaction() as conn:
+            moved = self._transfer(conn, sender_id, recipient_id, amount)
+            if moved:
+                db.after_commit(lambda: cache.invalidate_balances(sender_id, recipient_id))
+        return moved
+
+    def _transfer(self, conn, sender_id, recipient_id, amount):
+        # Writers hold SQLite's database write lock from BEGIN IMMEDIATE, so
+        # two transfers never hold one row each while waiting for the other's:
+        # there is no lock order to get wrong and nothing to deadlock. The
+        # debit's balance check is in its UPDATE, so it cannot act on a stale read.
+        found = dict(conn.execute(
+            "SELECT user_id, wallet_balance FROM customers WHERE user_id IN (?, ?)", (sender_id, recipient_id)))
+        for user_id in (sender_id, recipient_id):
+            if user_id not in found:
+                raise UnknownAccountError(f"No customer with ID {user_id}.")
+        if _over_limit(found[recipient_id], amount):
+            raise _limit_error(recipient_id)
+        timestamp = datetime.datetime.now().isoformat()
+        sender = conn.execute(OPERATIONS["wallet_withdraw"] + RETURNING, {"amount": amount, "user_id": sender_id}).fetchone()
+        if sender is None:
+            self.record(conn, sender_id, "transfer_out", amount, "failed", timestamp=timestamp)
+            return False
+        recipient = conn.execute(OPERATIONS["wallet_deposit"] + RETURNING, {"amount": amount, "user_id": recipient_id}).fetchone()
+        debit_id = self.record(conn, sender_id, "transfer_out", amount, "success", sender, timestamp)
+        credit_id = self.record(conn, recipient_id, "transfer_in", amount, "success", recipient, timestamp)
+        conn.execute(
+            "INSERT INTO transfers (sender_id, recipient_id, amount, debit_id, credit_id, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+            (sender_id, recipient_id, amount, debit_id, credit_id, timestamp))
+        return True
+
+    def _transfer_between(self, sender_db, recipient_db, sender_id, recipient_id, amount):
+        # The two wallets are in different shard files, which cannot commit
+        # together. The debit commits with a transfer_outbox row; _settle then
+        # credits the recipient, committing a transfer_inbox row keyed by the
+        # debit with it so a replay never credits twice, and swaps the outbox
+        # row for the transfers row. Money can be in flight between the two
+        # commits but is never lost: settle_transfers() replays the outbox.
+        with recipient_db.connection() as conn:
+            row = conn.execute("SELECT wallet_balance FROM customers WHERE user_id = ?", (recipient_id,)).fetchone()
+        if row is None:
+            raise UnknownAccountError(f"No customer with ID {recipient_id}.")
+        if _over_limit(row[0], amount):
+            raise _limit_error(recipient_id)
+        with sender_db.transaction() as conn:
+            if conn.execute("SELECT 1 FROM customers WHERE user_id = ?", (sender_id,)).fetchone() is None:
+                raise UnknownAccountError(f"No customer with ID {sender_id}.")
+            timestamp = datetime.datetime.now().isoformat()
+            balances = conn.execute(OPERATIONS["wallet_withdraw"] + RETURNING, {"amount": amount, "user_id": sender_id}).fetchone()
+            if balances is None:
+                self.record(conn, sender_id, "transfer_out", amount, "failed", timestamp=timestamp)
+                return False
+            debit_id = self.record(conn, sender_id, "transfer_out", amount, "success", balances, timestamp)
+            conn.execute(
+                "INSERT INTO transfer_outbox (debit_id, sender_id, recipient_id, amount, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (debit_id, sender_id, recipient_id, amount, timestamp))
+            sender_db.after_commit(lambda: cache.invalidate_balances(sender_id))
+        self._settle(sender_db, recipient_db, debit_id, sender_id, recipient_id, amount, timestamp)
+        return True
+
+    def _settle(self, sender_db, recipient_db, debit_id, sender_id, recipient_id, amount, timestamp):
+        with recipient_db.transaction() as conn:
+            row = conn.execute("SELECT credit_id FROM transfer_inbox WHERE debit_id = ?", (debit_id,)).fetchone()
+            if row is None:
+                balances = conn.execute(OPERATIONS["wallet_deposit"] + RETURNING,
+                                        {"amount": amount, "user_id": recipient_id}).fetchone()
+                # None when the recipient was deleted after the debit, or reached
+                # MAX_CENTS since the check above: the sender is refunded instead
+                credit_id = balances and self.record(conn, recipient_id, "transfer_in", amount, "success", balances)
+                conn.execute("INSERT INTO transfer_inbox (debit_id, credit_id) VALUES (?, ?)", (debit_id, credit_id))
+                recipient_db.after_commit(lambda: cache.invalidate_balances(recipient_id))
+            else:
+                credit_id = row[0]
+        with sender_db.transaction() as conn:
+            if conn.execute("DELETE FROM transfer_outbox WHERE debit_id = ?", (debit_id,)).rowcount == 0:
+                # Another settle_transfers() got here first
+                return
+            if credit_id is None:
+                balances = conn.execute(REFUND + RETURNING,
+                                        {"amount": amount, "user_id": sender_id}).fetchone()
+                self.record(conn, sender_id, "transfer_refund", amount, "success" if balances else "failed", balances)
+                sender_db.after_commit(lambda: cache.invalidate_balances(sender_id))
+            else:
+                conn.execute(
+                    "INSERT INTO transfers (sender_id, recipient_id, amount, debit_id, credit_id, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                    (sender_id, recipient_id, amount, debit_id, credit_id, timestamp))
+
+    def settle_transfers(self):
+        # Finishes transfers between shards that a crash left debited but not
+        # yet settled; returns how many there were
+        settled = 0
+        for db in sharding.pools():
+            with db.connection() as conn:
+                pending = conn.execute(
+                    "SELECT debit_id, sender_id, recipient_id, amount, timestamp FROM transfer_outbox").fetchall()
+            for debit_id, sender_id, recipient_id, amount, timestamp in pending:
+                self._settle(db, sharding.pool_for(recipient_id), debit_id, sender_id, recipient_id, amount, timestamp)
+            settled += len(pending)
+        return settled
+
+    def log(self, user_id, type, amount, status):
+        # A transaction row with no balance change
+        db = sharding.pool_for(user_id)
+        if self.journal is not None and not db.in_transaction():
+            self.journal.submit((user_id,), lambda conn: self.record(conn, user_id, type, amount, status)).result()
+            return
+        with db.transaction() as conn:
+            self.record(conn, user_id, type, amount, status)
+
+    def apply_batch(self, rows, chunk_size=BATCH_CHUNK_SIZE):
+        # rows: iterable of (user_id, operation, amount in Money or int cents); consumed lazily, one
+        # chunk per transaction. Returns one status per input row: "success",
+        # "insufficient_funds", "balance_limit" (would pass MAX_CENTS),
+        # "unknown_account" or "invalid".
+        results = []
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return results
+            results.extend(self._apply_chunk(chunk))
+
+    def _apply_chunk(self, chunk):
+        # Each shard's rows go in that shard's own transaction. A customer's
+        # rows all live in one shard, so they still apply in input order.
+        dbs = sharding.pools()
+        if len(dbs) == 1:
+            return self.apply_rows(dbs[0], chunk)
+        positions = {}
+        for i, row in enumerate(chunk):
+            # Unparseable rows (user_id None) come back "invalid" from any shard
+            positions.setdefault(0 if row[0] is None else sharding.shard_index(row[0], len(dbs)), []).append(i)
+        statuses = [None] * len(chunk)
+        for k, indexes in positions.items():
+            for i, status in zip(indexes, self.apply_rows(dbs[k], [chunk[i] for i in indexes])):
+                statuses[i] = status
+        return statuses
+
+    def apply_rows(self, db, chunk):
+        # Applies chunk's (user_id, operation, amount) rows, all of db's
+        # customers, in one transaction (or in the caller's, if one is open on
+        # db) and returns their statuses
+        timestamp = datetime.datetime.now().isoformat()
+        user_ids = {row[0] for row in chunk}
+        statuses, log_rows = [], []
+        with db.transaction() as conn:
+            balances = {}
+            for ids in _slices(list(user_ids), 500):
+                marks = ",".join("?" * len(ids))
+                for user_id, credit, wallet in conn.execute(
+                        f"SELECT user_id, credit, wallet_balance FROM customers WHERE user_id IN ({marks})", ids):
+                    balances[user_id] = [credit, wallet]
+            # Single pass in input order so earlier rows fund later ones
+            touched = set()
+            for user_id, operation, amount in chunk:
+                effect = EFFECTS.get(operation)
+                amount = _cents(amount)
+                if effect is None or amount is None or amount <= 0:
+                    statuses.append("invalid")
+                    continue
+                balance = balances.get(user_id)
+                if balance is None:
+                    statuses.append("unknown_account")
+                    continue
+                credit_sign, wallet_sign, guard = effect
+                if guard is not None and balance[guard] < amount:
+                    statuses.append("insufficient_funds")
+                    log_rows.append((user_id, operation, amount, "failed", timestamp))
+                    continue
+                if (credit_sign > 0 and _over_limit(balance[0], amount)) or (wallet_sign > 0 and _over_limit(balance[1], amount)):
+                    statuses.append("balance_limit")
+                    log_rows.append((user_id, operation, amount, "failed", timestamp))
+                    continue
+                balance[0] += credit_sign * amount
+                balance[1] += wallet_sign * amount
+                touched.add(user_id)
+                statuses.append("success")
+                log_rows.append((user_id, operation, amount, "success", timestamp))
+            conn.executemany(
+                "UPDATE customers SET credit = ?, wallet_balance = ? WHERE user_id = ?",
+                ((balances[u][0], balances[u][1], u) for u in touched)
+            )
+            conn.executemany(
+                "INSERT INTO transactions (user_id, type, amount, status, timestamp) VALUES (?, ?, ?, ?, ?)",
+                log_rows
+            )
+            snapshots.record_many(conn, log_rows, {u: balances[u] for u in touched})
+            db.after_commit(lambda: cache.invalidate_balances(*touched))
+        return statuses
+
+    def record(self, conn, user_id, type, amount, status, balances=None, timestamp=None):
+        # balances: (credit, wallet_balance) after the operation, for the daily
+        # snapshot. Returns the new transactions row id.
+        timestamp = timestamp or datetime.datetime.now().isoformat()
+        row_id = conn.execute('''
+            INSERT INTO transactions (user_id, type, amount, status, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, type, amount, status, timestamp)).lastrowid
+        snapshots.record(conn, user_id, timestamp, type, amount, status, balances)
+        return row_id
+
+
+def _cents(amount):
+    try:
+        return Money.coerce(amount).cents
+    except (TypeError, ValueError):
+        return None
+
+
+def _slices(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+ledger = Ledger()
@@ -1,7 +1,57 @@
 # models.py
+import os
 import bcrypt
-from database import cursor, conn
-import datetime
+import sharding
+from database import connection, transaction, after_commit
+from models import archive, cache
+from models.ledger import ledger
+from models.money import Money
+
+HISTORY_PAGE_SIZE = 100
+CUSTOMER_PAGE_SIZE = 200
+# bcrypt work factor for new hashes; existing hashes are upgraded at their next sign-in
+BCRYPT_ROUNDS = int(os.environ.get("BANK_BCRYPT_ROUNDS", "12"))
+
+
+def with_money(row):
+    # transactions row (id, type, amount, status, timestamp) with amount as Money
+    return (row[0], row[1], Money(row[2]), row[3], row[4])
+
+
+def find_user(user_id, user_type=None):
+    # users row by id through the cache, or None
+    def load():
+        with connection() as conn:
+            return conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+    row = cache.users.get(user_id, load)
+    return row if row is not None and (user_type is None or row[6] == user_type) else None
+
+
+def find_user_by_name(name, user_type):
+    # Names map to ids through their own cache; the row itself comes from find_user
+    def load():
+        with connection() as conn:
+            row = conn.execute("SELECT id FROM users WHERE name = ? AND user_type = ?", (name, user_type)).fetchone()
+        return row[0] if row else None
+    user_id = cache.user_ids.get((user_type, name), load)
+    if user_id is None:
+        return None
+    row = find_user(user_id, user_type)
+    if row is None or row[1] != name:
+        # Deleted since the id was cached
+        cache.user_ids.invalidate((user_type, name))
+        user_id = load()
+        row = find_user(user_id, user_type) if user_id is not None else None
+    return row
+
+
+def customer_balances(user_id):
+    # (credit, wallet_balance) in cents through the cache, or None
+    def load():
+        with sharding.connection(user_id) as conn:
+            return conn.execute("SELECT credit, wallet_balance FROM customers WHERE user_id = ?", (user_id,)).fetchone()
+    return cache.balances.get(user_id, load)
+
 
 class User:
     def __init__(self, name, national_id, phone_number, password):
@@ -13,90 +63,97 @@ class User:
 
     @staticmethod
     def hash_password(password):
-        return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+
+    @staticmethod
+    def needs_rehash(hashed):
+        # bcrypt hashes look like $2b$12$...; the number is the cost they were made with
+        try:
+            return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+        except (IndexError, ValueError):
+            return True
 
     @staticmethod
     def verify_password(password, hashed):
         return bcrypt.checkpw(password.encode(), hashed.encode())
 
+    @classmethod
+    def from_row(cls, row):
+        # Build from a users row without re-hashing the stored password
+        user = cls.__new__(cls)
+        user.id, user.name, user.national_id, user.phone_number, user.password = row[:5]
+        return user
+
     def save_to_db(self, user_type):
-        cursor.execute(
-            '''INSERT INTO users (name, national_id, phone_number, password, user_type) 
-               VALUES (?, ?, ?, ?, ?)''',
-            (self.name, self.national_id, self.phone_number, self.password, user_type)
-        )
-        conn.commit()
-        self.id = cursor.lastrowid
+        with connection() as conn:
+            cur = conn.execute(
+                '''INSERT INTO users (name, national_id, phone_number, password, user_type) 
+                   VALUES (?, ?, ?, ?, ?)''',
+                (self.name, self.national_id, self.phone_number, self.password, user_type)
+            )
+            self.id = cur.lastrowid
 
 class Customer(User):
     def __init__(self, name, national_id, phone_number, password):
         super().__init__(name, national_id, phone_number, password)
 
     def save_to_db(self):
-        super().save_to_db("customer")
-        cursor.execute(
-            "INSERT INTO customers (user_id, credit, wallet_balance) VALUES (?, ?, ?)",
-            (self.id, 0.0, 0.0)
-        )
-        conn.commit()
+        # Unsharded, the customers row joins this transaction. Sharded, it
+        # commits to the customer's shard just before the users row does; if
+        # the users row then fails, its id is reused and the orphan replaced.
+        with transaction():
+            super().save_to_db("customer")
+            with sharding.transaction(self.id) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO customers (user_id, credit, wallet_balance) VALUES (?, ?, ?)",
+                    (self.id, 0, 0)
+                )
 
     def deposit_to_credit(self, amount):
-        cursor.execute("UPDATE customers SET credit = credit + ? WHERE user_id = ?", (amount, self.id))
-        self.log_transaction("credit_deposit", amount, "success")
-        conn.commit()
+        return ledger.apply(self.id, "credit_deposit", amount)
 
     def deposit_to_wallet(self, amount):
-        cursor.execute("UPDATE customers SET wallet_balance = wallet_balance + ? WHERE user_id = ?", (amount, self.id))
-        self.log_transaction("wallet_deposit", amount, "success")
-        conn.commit()
+        return ledger.apply(self.id, "wallet_deposit", amount)
 
     def withdraw_from_credit(self, amount):
-        cursor.execute("SELECT credit FROM customers WHERE user_id = ?", (self.id,))
-        current = cursor.fetchone()[0]
-        if current >= amount:
-            cursor.execute("UPDATE customers SET credit = credit - ? WHERE user_id = ?", (amount, self.id))
-            self.log_transaction("credit_withdraw", amount, "success")
-            conn.commit()
-        else:
-            self.log_transaction("credit_withdraw", amount, "failed")
+        return ledger.apply(self.id, "credit_withdraw", amount)
 
     def withdraw_from_wallet(self, amount):
-        cursor.execute("SELECT wallet_balance FROM customers WHERE user_id = ?", (self.id,))
-        current = cursor.fetchone()[0]
-        if current >= amount:
-            cursor.execute("UPDATE customers SET wallet_balance = wallet_balance - ? WHERE user_id = ?", (amount, self.id))
-            self.log_transaction("wallet_withdraw", amount, "success")
-            conn.commit()
-        else:
-            self.log_transaction("wallet_withdraw", amount, "failed")
+        return ledger.apply(self.id, "wallet_withdraw", amount)
 
     def transfer_wallet_to_credit(self, amount):
-        cursor.execute("SELECT wallet_balance FROM customers WHERE user_id = ?", (self.id,))
-        current = cursor.fetchone()[0]
-        if current >= amount:
-            cursor.execute("UPDATE customers SET wallet_balance = wallet_balance - ?, credit = credit + ? WHERE user_id = ?", (amount, amount, self.id))
-            self.log_transaction("wallet_to_credit", amount, "success")
-            conn.commit()
-        else:
-            self.log_transaction("wallet_to_credit", amount, "failed")
+        return ledger.apply(self.id, "wallet_to_credit", amount)
 
     def transfer_credit_to_wallet(self, amount):
-        cursor.execute("SELECT credit FROM customers WHERE user_id = ?", (self.id,))
-        current = cursor.fetchone()[0]
-        if current >= amount:
-            cursor.execute("UPDATE customers SET credit = credit - ?, wallet_balance = wallet_balance + ? WHERE user_id = ?", (amount, amount, self.id))
-            self.log_transaction("credit_to_wallet", amount, "success")
-            conn.commit()
-        else:
-            self.log_transaction("credit_to_wallet", amount, "failed")
+        return ledger.apply(self.id, "credit_to_wallet", amount)
 
     def log_transaction(self, type, amount, status):
-        timestamp = datetime.datetime.now().isoformat()
-        cursor.execute('''
-            INSERT INTO transactions (user_id, type, amount, status, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (self.id, type, amount, status, timestamp))
-        conn.commit()
+        ledger.log(self.id, type, Money.coerce(amount).cents, status)
+
+    def transaction_history(self, limit=HISTORY_PAGE_SIZE, before=None):
+        # Keyset page, newest first. before is the (timestamp, id) of the oldest
+        # row already shown, so each page is an index seek rather than an OFFSET.
+        with sharding.connection(self.id) as conn:
+            if before is None:
+                rows = conn.execute(
+                    "SELECT id, type, amount, status, timestamp FROM transactions WHERE user_id = ? "
+                    "ORDER BY timestamp DESC, id DESC LIMIT ?", (self.id, limit)).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT id, type, amount, status, timestamp FROM transactions WHERE user_id = ? AND (timestamp, id) < (?, ?) "
+                    "ORDER BY timestamp DESC, id DESC LIMIT ?", (self.id, before[0], before[1], limit)).fetchall()
+        if len(rows) < limit:
+            # Older rows may have been moved to the monthly archives
+            rows += archive.history(self.id, limit - len(rows), (rows[-1][4], rows[-1][0]) if rows else before)
+        return [with_money(row) for row in rows]
+
+    def transactions_since(self, after):
+        # Rows newer than the (timestamp, id) of the newest row already shown, newest first
+        with sharding.connection(self.id) as conn:
+            rows = conn.execute(
+                "SELECT id, type, amount, status, timestamp FROM transactions WHERE user_id = ? AND (timestamp, id) > (?, ?) "
+                "ORDER BY timestamp DESC, id DESC", (self.id, after[0], after[1])).fetchall()
+        return [with_money(row) for row in rows + archive.since(self.id, after)]
 
 class Admin(User):
     def __init__(self, name, national_id, phone_number, password):
@@ -107,22 +164,49 @@ class Admin(User):
 
     def reset_user_password(self, user_id, new_password):
         hashed = self.hash_password(new_password)
-        cursor.execute("UPDATE users SET password = ? WHERE id = ?", (hashed, user_id))
-        conn.commit()
+        with connection() as conn:
+            conn.execute("UPDATE users SET password = ? WHERE id = ?", (hashed, user_id))
+            after_commit(lambda: cache.invalidate_user(user_id))
 
     def lock_user_account(self, user_id):
-        cursor.execute("UPDATE users SET is_locked = 1 WHERE id = ?", (user_id,))
-        conn.commit()
+        with connection() as conn:
+            conn.execute("UPDATE users SET is_locked = 1 WHERE id = ?", (user_id,))
+            after_commit(lambda: cache.invalidate_user(user_id))
 
     def unlock_user_account(self, user_id):
-        cursor.execute("UPDATE users SET is_locked = 0 WHERE id = ?", (user_id,))
-        conn.commit()
+        with connection() as conn:
+            conn.execute("UPDATE users SET is_locked = 0 WHERE id = ?", (user_id,))
+            after_commit(lambda: cache.invalidate_user(user_id))
 
     def delete_user(self, user_id):
-        cursor.execute("DELETE FROM customers WHERE user_id = ?", (user_id,))
-        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        conn.commit()
+        with transaction() as conn:
+            with sharding.transaction(user_id) as shard:
+                shard.execute("DELETE FROM customers WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+            after_commit(lambda: cache.invalidate_user(user_id))
 
     def view_all_users(self):
-        cursor.execute("SELECT id, name, national_id, phone_number FROM users WHERE user_type = 'customer'")
-        return cursor.fetchall()
+        with connection() as conn:
+            return conn.execute("SELECT id, name, national_id, phone_number FROM users WHERE user_type = 'customer'").fetchall()
+
+    def list_customers(self, limit=CUSTOMER_PAGE_SIZE, after=None, search=None):
+        # One window of customers ordered by (name, id) off idx_users_type_name.
+        # after is the (name, id) of the last row already shown; search is a name prefix.
+        sql = "SELECT id, name, national_id, phone_number, is_locked FROM users WHERE user_type = 'customer'"
+        params = []
+        if search:
+            sql += " AND name >= ? AND name < ?"
+            params += [search, search + "\U0010ffff"]
+        if after is not None:
+            sql += " AND (name, id) > (?, ?)"
+            params += list(after)
+        sql += " ORDER BY name, id LIMIT ?"
+        params.append(limit)
+        with connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def get_customer(self, user_id):
+        with connection() as conn:
+            return conn.execute(
+                "SELECT id, name, national_id, phone_number, is_locked FROM users WHERE id = ? AND user_type = 'customer'",
+                (user_id,)).fetchone()
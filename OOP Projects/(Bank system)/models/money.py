@@ -0,0 +1,94 @@
+# money.py
+import sqlite3
+from decimal import Decimal, InvalidOperation
+from functools import total_ordering
+
+# Largest amount, and largest balance a deposit may reach: $10 trillion. Far
+# enough below SQLite's int64 limit that no sum of two can overflow into REAL.
+MAX_CENTS = 10 ** 15
+
+
+@total_ordering
+class Money:
+    # Whole cents in an int: arithmetic and comparisons are exact, and the
+    # value goes into the INTEGER balance/amount columns unchanged
+    __slots__ = ("cents",)
+
+    def __init__(self, cents=0):
+        if not isinstance(cents, int) or isinstance(cents, bool):
+            raise TypeError(f"Money takes whole cents as int, got {type(cents).__name__}")
+        self.cents = cents
+
+    @classmethod
+    def parse(cls, text):
+        # "12.5" -> 1250 cents, without ever going through float
+        try:
+            value = Decimal(str(text).strip())
+        except InvalidOperation:
+            raise ValueError(f"Not an amount: {text!r}")
+        if not value.is_finite():
+            raise ValueError(f"Not an amount: {text!r}")
+        cents = value * 100
+        if cents != cents.to_integral_value():
+            raise ValueError("Amounts cannot have fractions of a cent.")
+        if abs(cents) > MAX_CENTS:
+            raise ValueError(f"Amounts cannot exceed {cls(MAX_CENTS)}.")
+        return cls(int(cents))
+
+    @classmethod
+    def coerce(cls, value):
+        # Accepts Money or int cents; floats are refused so drift cannot creep back in
+        if isinstance(value, Money):
+            return value
+        money = cls(value)
+        if abs(money.cents) > MAX_CENTS:
+            raise ValueError(f"Amounts cannot exceed {cls(MAX_CENTS)}.")
+        return money
+
+    def __add__(self, other):
+        return Money(self.cents + Money.coerce(other).cents)
+
+    def __sub__(self, other):
+        return Money(self.cents - Money.coerce(other).cents)
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __mul__(self, factor):
+        if not isinstance(factor, int):
+            return NotImplemented
+        return Money(self.cents * factor)
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        if isinstance(other, Money):
+            return self.cents == other.cents
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, Money):
+            return self.cents < other.cents
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.cents)
+
+    def __bool__(self):
+        return self.cents != 0
+
+    def __str__(self):
+        sign = "-" if self.cents < 0 else ""
+        whole, part = divmod(abs(self.cents), 100)
+        return f"{sign}{whole}.{part:02d}"
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+    def __repr__(self):
+        return f"Money('{self}')"
+
+
+# Money can be passed straight to sqlite3 as a query parameter
+sqlite3.register_adapter(Money, lambda m: m.cents)
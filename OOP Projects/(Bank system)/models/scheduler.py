@@ -0,0 +1,312 @@
+# scheduler.py
+# One-off and recurring ledger operations (a monthly wallet_to_credit, a
+# standing deposit) kept in the schedules table and run by one background
+# thread. The thread holds a min-heap of (next_run_at, id, user_id, runs)
+# entries and sleeps until the earliest is due instead of polling the table.
+#
+# Memory is bounded: the heap is loaded with at most heap_limit of the soonest
+# runs off idx_schedules_due, and the key of the last one read is the horizon.
+# Runs after the horizon wait in the table until the heap drains and the next
+# window is read. New schedules, and the next run of one that just ran, go
+# straight onto the heap when they fall inside the horizon, so scheduling costs
+# O(log n). The heap is also rebuilt every resync_seconds, which picks up
+# schedules added by other processes, and when it grows past twice heap_limit.
+#
+# Due entries come off the heap batch_size at a time and each shard's share
+# runs in one transaction: the schedules rows are re-read under the write
+# lock, the operations applied with ledger.apply_rows and the rows advanced to
+# their next run before COMMIT. An entry whose runs count no longer matches its
+# row (cancelled, or run by another scheduler) is stale and dropped, so each
+# run happens exactly once however many schedulers are running and wherever a
+# crash lands.
+#
+# Catch-up: the next run is the (runs + 1)th occurrence counted from start_at,
+# not from the clock, so after downtime every missed occurrence is still due
+# and they run oldest first, one per batch, until the schedule is current.
+import calendar
+import datetime
+import heapq
+import threading
+import time
+from itertools import islice
+import sharding
+from models.ledger import ledger, UnknownAccountError
+from models.money import Money
+from utils.logger import log_action
+
+EVERY = ("day", "week", "month")
+HEAP_LIMIT = 100_000
+BATCH_SIZE = 1000
+RESYNC_SECONDS = 300
+RETRY_SECONDS = 5
+# apply_rows statuses that end a schedule instead of waiting for its next run
+FINAL_STATUSES = ("unknown_account", "invalid")
+
+
+def now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def normalize(start_at):
+    # ISO text for a datetime or "YYYY-MM-DD[ HH:MM[:SS]]"; None means now
+    if start_at is None:
+        return now()
+    if not isinstance(start_at, datetime.datetime):
+        start_at = datetime.datetime.fromisoformat(str(start_at).strip())
+    return start_at.replace(microsecond=0, tzinfo=None).isoformat()
+
+
+def occurrence(start_at, every, n):
+    # The nth run after start_at (n=0 is start_at itself). Months keep the
+    # start's day, clamped to short months: Jan 31, Feb 28, Mar 31, ...
+    start = datetime.datetime.fromisoformat(start_at)
+    if every == "day":
+        return (start + datetime.timedelta(days=n)).isoformat()
+    if every == "week":
+        return (start + datetime.timedelta(weeks=n)).isoformat()
+    month = start.month - 1 + n
+    year, month = start.year + month // 12, month % 12 + 1
+    return start.replace(year=year, month=month, day=min(start.day, calendar.monthrange(year, month)[1])).isoformat()
+
+
+def add(user_id, operation, amount, start_at=None, every=None):
+    # Schedules operation (one of models.ledger.OPERATIONS) for amount (Money
+    # or int cents) at start_at, then every day, week or month if every is
+    # given. Returns the schedule id.
+    if every not in EVERY + (None,):
+        raise ValueError(f"every must be one of {EVERY}")
+    amount = Money.coerce(amount).cents
+    start_at = normalize(start_at)
+    db = sharding.pool_for(user_id)
+    with db.transaction() as conn:
+        if conn.execute("SELECT 1 FROM customers WHERE user_id = ?", (user_id,)).fetchone() is None:
+            raise UnknownAccountError(f"No customer with ID {user_id}.")
+        schedule_id = conn.execute(
+            "INSERT INTO schedules (user_id, operation, amount, every, start_at, next_run_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", (user_id, operation, amount, every, start_at, start_at, now())).lastrowid
+    _notify((start_at, schedule_id, user_id, 0))
+    return schedule_id
+
+
+def cancel(user_id, schedule_id):
+    # Stops a customer's schedule; False if it is not theirs or already finished.
+    # Its heap entry is left to go stale.
+    with sharding.transaction(user_id) as conn:
+        return conn.execute("UPDATE schedules SET next_run_at = NULL WHERE id = ? AND user_id = ? AND next_run_at IS NOT NULL",
+                            (schedule_id, user_id)).rowcount == 1
+
+
+def for_user(user_id):
+    # (id, operation, amount, every, next run or None, runs, last run, last status), oldest first
+    with sharding.connection(user_id) as conn:
+        rows = conn.execute(
+            "SELECT id, operation, amount, every, next_run_at, runs, last_run_at, last_status FROM schedules "
+            "WHERE user_id = ? ORDER BY id", (user_id,)).fetchall()
+    return [(row[0], row[1], Money(row[2]), *row[3:]) for row in rows]
+
+
+class Scheduler:
+    def __init__(self, heap_limit=HEAP_LIMIT, batch_size=BATCH_SIZE, resync_seconds=RESYNC_SECONDS, start=True):
+        self.heap_limit = heap_limit
+        self.batch_size = batch_size
+        self.resync_seconds = resync_seconds
+        self.heap = []
+        # (next_run_at, id) of the last row read into the heap; None once every row was read
+        self.horizon = None
+        self.cond = threading.Condition()
+        # Entries pushed while a resync is reading, merged in once it is done
+        self.pushed = None
+        self.stopping = False
+        self.runs = 0
+        self.batches = 0
+        self.stale = 0
+        self.thread = None
+        if start:
+            self.thread = threading.Thread(target=self.run, name="bank-scheduler", daemon=True)
+            self.thread.start()
+
+    def push(self, entry):
+        with self.cond:
+            if self.pushed is not None:
+                self.pushed.append(entry)
+            elif self.horizon is None or entry[:2] <= self.horizon:
+                heapq.heappush(self.heap, entry)
+                self.cond.notify()
+
+    def load(self):
+        # The heap_limit soonest runs across every shard, in heap order, and the horizon
+        def soonest(db):
+            with db.connection() as conn:
+                return conn.execute(
+                    "SELECT next_run_at, id, user_id, runs FROM schedules WHERE next_run_at IS NOT NULL "
+                    "ORDER BY next_run_at, id LIMIT ?", (self.heap_limit,)).fetchall()
+        rows = list(islice(heapq.merge(*sharding.fan_out(soonest)), self.heap_limit))
+        return rows, rows[-1][:2] if len(rows) == self.heap_limit else None
+
+    def resync(self):
+        rows = None
+        with self.cond:
+            self.pushed = []
+        try:
+            rows, horizon = self.load()
+        finally:
+            with self.cond:
+                pushed, self.pushed = self.pushed, None
+                if rows is not None:
+                    # A sorted list is already a valid heap
+                    self.heap, self.horizon = rows, horizon
+                for entry in pushed:
+                    self.push(entry)
+
+    def take_due(self):
+        # Pops up to batch_size entries that are due now
+        due, current = [], now()
+        with self.cond:
+            while self.heap and self.heap[0][0] <= current and len(due) < self.batch_size:
+                due.append(heapq.heappop(self.heap))
+        return due
+
+    def execute(self, due):
+        # Runs the due entries, one transaction per shard. Entries of a shard
+        # whose transaction failed go back on the heap and the error is raised.
+        dbs = sharding.pools()
+        by_shard = {}
+        for entry in due:
+            by_shard.setdefault(sharding.index(entry[2]), []).append(entry)
+        error = None
+        for k, entries in sorted(by_shard.items()):
+            try:
+                self.execute_shard(dbs[k], entries)
+            except Exception as e:
+                error = e
+                for entry in entries:
+                    self.push(entry)
+        self.batches += 1
+        if error is not None:
+            raise error
+
+    def execute_shard(self, db, entries):
+        expected = {entry[1]: entry[3] for entry in entries}
+        with db.transaction() as conn:
+            rows = []
+            ids = list(expected)
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                rows += conn.execute(
+                    "SELECT next_run_at, id, user_id, operation, amount, every, start_at, runs FROM schedules "
+                    f"WHERE id IN ({', '.join('?' * len(part))})", part).fetchall()
+            # Oldest run first, so one customer's runs apply in order
+            live = sorted(row for row in rows if row[0] is not None and row[7] == expected[row[1]])
+            if not live:
+                self.stale += len(entries)
+                return
+            statuses = ledger.apply_rows(db, [(user_id, operation, amount) for _, _, user_id, operation, amount, _, _, _ in live])
+            current, updates, following = now(), [], []
+            for (_, schedule_id, user_id, operation, amount, every, start_at, runs), status in zip(live, statuses):
+                next_run_at = None
+                if every is not None and status not in FINAL_STATUSES:
+                    next_run_at = occurrence(start_at, every, runs + 1)
+                    following.append((next_run_at, schedule_id, user_id, runs + 1))
+                updates.append((next_run_at, current, status, schedule_id))
+            conn.executemany("UPDATE schedules SET runs = runs + 1, next_run_at = ?, last_run_at = ?, last_status = ? WHERE id = ?",
+                             updates)
+        # Committed; after_commit would also run on a rollback
+        self.stale += len(entries) - len(live)
+        self.runs += len(live)
+        for entry in following:
+            self.push(entry)
+        for (_, schedule_id, user_id, operation, _, _, _, _), status in zip(live, statuses):
+            log_action(user_id, operation, status, schedule_id=schedule_id, source="scheduler")
+
+    def run_pending(self):
+        # Runs everything due now, catching up missed occurrences, and returns
+        # the number of runs. For use without the background thread.
+        self.resync()
+        started = self.runs
+        while True:
+            due = self.take_due()
+            if not due:
+                if self.heap or self.horizon is None:
+                    return self.runs - started
+                self.resync()
+                continue
+            self.execute(due)
+
+    def run(self):
+        next_sync = 0
+        while True:
+            with self.cond:
+                if self.stopping:
+                    return
+            try:
+                if (time.monotonic() >= next_sync or (not self.heap and self.horizon is not None)
+                        or len(self.heap) > 2 * self.heap_limit):
+                    self.resync()
+                    next_sync = time.monotonic() + self.resync_seconds
+                due = self.take_due()
+                if due:
+                    self.execute(due)
+                    continue
+            except Exception as e:
+                log_action(None, "scheduler", "failed", error=str(e))
+                self.sleep(RETRY_SECONDS)
+                continue
+            wait = next_sync - time.monotonic()
+            with self.cond:
+                if self.heap:
+                    until = datetime.datetime.fromisoformat(self.heap[0][0]) - datetime.datetime.now()
+                    wait = min(wait, until.total_seconds())
+            self.sleep(wait)
+
+    def sleep(self, seconds):
+        # Until seconds pass, an entry is pushed or stop() is called
+        with self.cond:
+            if not self.stopping and seconds > 0:
+                self.cond.wait(seconds)
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "heap": len(self.heap),
+                "next_run_at": self.heap[0][0] if self.heap else None,
+                "horizon": self.horizon[0] if self.horizon else None,
+                "runs": self.runs,
+                "batches": self.batches,
+                "stale": self.stale,
+            }
+
+
+_scheduler = None
+
+
+def _notify(entry):
+    scheduler = _scheduler
+    if scheduler is not None:
+        scheduler.push(entry)
+
+
+def enable(**options):
+    # Starts the background scheduler (replacing any running one); returns it
+    global _scheduler
+    disable()
+    _scheduler = Scheduler(**options)
+    return _scheduler
+
+
+def disable():
+    global _scheduler
+    scheduler, _scheduler = _scheduler, None
+    if scheduler is not None:
+        scheduler.stop()
+
+
+def stats():
+    scheduler = _scheduler
+    return scheduler.stats() if scheduler is not None else None
@@ -0,0 +1,172 @@
+# snapshots.py
+# Per-customer daily totals and closing balances, plus bank-wide daily totals,
+# kept up to date inside the same transaction that writes each ledger row.
+# Statements and admin totals read these instead of scanning transactions.
+# When sharded each shard keeps the snapshots of its own customers, and its
+# bank_daily_totals cover only them; bank_totals() adds the shards up.
+import heapq
+from collections import defaultdict
+import sharding
+from models.money import Money
+
+# Rows written by the dashboard before transfers went through the ledger
+LEGACY_TYPES = {"Transfer to Credit": "wallet_to_credit", "Transfer to Wallet": "credit_to_wallet"}
+
+UPSERT_USER_TOTALS = '''
+    INSERT INTO daily_totals (user_id, day, type, status, count, amount) VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, day, type, status) DO UPDATE SET count = count + excluded.count, amount = amount + excluded.amount
+'''
+UPSERT_BANK_TOTALS = '''
+    INSERT INTO bank_daily_totals (day, type, status, count, amount) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (day, type, status) DO UPDATE SET count = count + excluded.count, amount = amount + excluded.amount
+'''
+UPSERT_BALANCE = '''
+    INSERT INTO daily_balances (user_id, day, credit, wallet_balance) VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id, day) DO UPDATE SET credit = excluded.credit, wallet_balance = excluded.wallet_balance
+'''
+
+
+def record(conn, user_id, timestamp, type, amount, status, balances=None):
+    # balances is the (credit, wallet_balance) left after the operation, if it moved money
+    day = timestamp[:10]
+    conn.execute(UPSERT_USER_TOTALS, (user_id, day, type, status, 1, amount))
+    conn.execute(UPSERT_BANK_TOTALS, (day, type, status, 1, amount))
+    if balances is not None:
+        conn.execute(UPSERT_BALANCE, (user_id, day, balances[0], balances[1]))
+
+
+def record_many(conn, rows, balances):
+    # rows: (user_id, type, amount, status, timestamp) as written to transactions;
+    # balances: {user_id: (credit, wallet_balance)} at the end of the batch
+    user_totals, bank_totals = defaultdict(lambda: [0, 0]), defaultdict(lambda: [0, 0])
+    for user_id, type, amount, status, timestamp in rows:
+        day = timestamp[:10]
+        for totals, key in ((user_totals, (user_id, day, type, status)), (bank_totals, (day, type, status))):
+            totals[key][0] += 1
+            totals[key][1] += amount
+    conn.executemany(UPSERT_USER_TOTALS, (key + tuple(v) for key, v in user_totals.items()))
+    conn.executemany(UPSERT_BANK_TOTALS, (key + tuple(v) for key, v in bank_totals.items()))
+    if rows:
+        day = rows[0][4][:10]
+        conn.executemany(UPSERT_BALANCE, ((u, day, b[0], b[1]) for u, b in balances.items()))
+
+
+def statement(user_id, start_day, end_day):
+    # Reads at most one row per day and type, however many transactions the period holds
+    with sharding.connection(user_id) as conn:
+        opening = conn.execute(
+            "SELECT credit, wallet_balance FROM daily_balances WHERE user_id = ? AND day < ? ORDER BY day DESC LIMIT 1",
+            (user_id, start_day)).fetchone() or (0, 0)
+        closing = conn.execute(
+            "SELECT credit, wallet_balance FROM daily_balances WHERE user_id = ? AND day <= ? ORDER BY day DESC LIMIT 1",
+            (user_id, end_day)).fetchone() or (0, 0)
+        days = conn.execute(
+            "SELECT day, type, status, count, amount FROM daily_totals WHERE user_id = ? AND day BETWEEN ? AND ? ORDER BY day, type, status",
+            (user_id, start_day, end_day)).fetchall()
+    return {
+        "user_id": user_id,
+        "from": start_day,
+        "to": end_day,
+        "opening": {"credit": Money(opening[0]), "wallet_balance": Money(opening[1])},
+        "closing": {"credit": Money(closing[0]), "wallet_balance": Money(closing[1])},
+        "days": [{"day": d, "type": t, "status": s, "count": c, "amount": Money(a)} for d, t, s, c, a in days],
+    }
+
+
+def bank_totals(start_day, end_day):
+    def read(db):
+        with db.connection() as conn:
+            return conn.execute(
+                "SELECT type, status, SUM(count), SUM(amount) FROM bank_daily_totals WHERE day BETWEEN ? AND ? GROUP BY type, status",
+                (start_day, end_day)).fetchall()
+    totals = {}
+    for rows in sharding.fan_out(read):
+        _add_totals(totals, 2, rows)
+    return [{"type": t, "status": s, "count": c, "amount": Money(a)} for (t, s), (c, a) in sorted(totals.items())]
+
+
+def expected_snapshots(conn, keep=None):
+    # Rebuilds every snapshot from the raw ledger: totals by GROUP BY, closing
+    # balances by replaying successful operations per customer in order. Reads
+    # the hot table and every monthly archive. keep(user_id), if given, limits
+    # the result to those customers, e.g. one shard's.
+    from models.ledger import EFFECTS, TRANSFER_EFFECTS
+    from models import archive
+    effects = {**EFFECTS, **TRANSFER_EFFECTS}
+    sources = archive.sources(conn)
+    user_totals = {}
+    for source in sources:
+        _add_totals(user_totals, 4, source.execute(
+            "SELECT user_id, substr(timestamp, 1, 10), type, status, COUNT(*), SUM(amount) FROM transactions GROUP BY 1, 2, 3, 4"))
+    if keep is not None:
+        user_totals = {key: value for key, value in user_totals.items() if keep(key[0])}
+    bank = {}
+    _add_totals(bank, 3, (key[1:] + value for key, value in user_totals.items()))
+    balances, finals = {}, {}
+    current_user, credit, wallet = None, 0, 0
+    replay = heapq.merge(*(source.execute(
+        "SELECT user_id, timestamp, id, type, amount FROM transactions WHERE status IN ('success', 'Completed') ORDER BY user_id, timestamp, id")
+        for source in sources))
+    for user_id, timestamp, _, type, amount in replay:
+        if keep is not None and not keep(user_id):
+            continue
+        if user_id != current_user:
+            current_user, credit, wallet = user_id, 0, 0
+        effect = effects.get(LEGACY_TYPES.get(type, type))
+        if effect is None:
+            continue
+        credit += effect[0] * amount
+        wallet += effect[1] * amount
+        balances[(user_id, timestamp[:10])] = (credit, wallet)
+        finals[user_id] = (credit, wallet)
+    return user_totals, bank, balances, finals
+
+
+def _add_totals(totals, key_size, rows):
+    for row in rows:
+        key = row[:key_size]
+        count, amount = totals.get(key, (0, 0))
+        totals[key] = (count + row[key_size], amount + row[key_size + 1])
+
+
+def verify(fix=False):
+    # Reports drift between the snapshot tables and the ledger; fix=True
+    # rewrites them. Shards are checked in parallel, each against its own customers.
+    dbs = sharding.pools()
+    reports = sharding.fan_out(lambda db: _verify(db, dbs.index(db), len(dbs), fix))
+    return {name: [row for report in reports for row in report[name]] for name in reports[0]}
+
+
+def _verify(db, shard, count, fix):
+    keep = None if count == 1 else (lambda user_id: user_id is not None and sharding.shard_index(user_id, count) == shard)
+    with db.transaction() as conn:
+        user_totals, bank, balances, finals = expected_snapshots(conn, keep)
+        stored_user = {row[:4]: row[4:] for row in conn.execute("SELECT user_id, day, type, status, count, amount FROM daily_totals")}
+        stored_bank = {row[:3]: row[3:] for row in conn.execute("SELECT day, type, status, count, amount FROM bank_daily_totals")}
+        stored_balances = {row[:2]: row[2:] for row in conn.execute("SELECT user_id, day, credit, wallet_balance FROM daily_balances")}
+        accounts = {row[0]: row[1:] for row in conn.execute("SELECT user_id, credit, wallet_balance FROM customers")}
+        report = {
+            "daily_totals": _diff(stored_user, user_totals),
+            "bank_daily_totals": _diff(stored_bank, bank),
+            "daily_balances": _diff(stored_balances, balances),
+            # Balances the ledger cannot explain, e.g. rows written by older code with unknown types
+            "accounts": [(u, accounts[u], finals.get(u, (0, 0))) for u in accounts if tuple(accounts[u]) != finals.get(u, (0, 0))],
+        }
+        if fix:
+            replace_all(conn, user_totals, bank, balances)
+    return report
+
+
+def replace_all(conn, user_totals, bank, balances):
+    conn.execute("DELETE FROM daily_totals")
+    conn.execute("DELETE FROM bank_daily_totals")
+    conn.execute("DELETE FROM daily_balances")
+    conn.executemany(UPSERT_USER_TOTALS, (k + tuple(v) for k, v in user_totals.items()))
+    conn.executemany(UPSERT_BANK_TOTALS, (k + tuple(v) for k, v in bank.items()))
+    conn.executemany(UPSERT_BALANCE, (k + tuple(v) for k, v in balances.items()))
+
+
+def _diff(stored, expected):
+    # (key, stored value, expected value) for every key that disagrees
+    return [(k, stored.get(k), expected.get(k)) for k in stored.keys() | expected.keys()
+            if tuple(stored.get(k) or ()) != tuple(expected.get(k) or ())]
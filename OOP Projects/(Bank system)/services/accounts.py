@@ -0,0 +1,78 @@
+# services/accounts.py
+from models.models import Customer, HISTORY_PAGE_SIZE, find_user, customer_balances
+from models.ledger import ledger, OPERATIONS, UnknownAccountError
+from models.money import Money
+from models import scheduler, snapshots
+from utils.batch_files import read_batch_file
+
+
+def get_customer(user_id):
+    row = find_user(user_id, "customer")
+    return Customer.from_row(row) if row else None
+
+
+def balances(user_id):
+    # (credit, wallet_balance) as Money, or None if the customer does not exist
+    row = customer_balances(user_id)
+    return (Money(row[0]), Money(row[1])) if row else None
+
+
+def apply(user_id, operation, amount):
+    # operation is one of models.ledger.OPERATIONS and amount is Money;
+    # returns False on insufficient funds
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown operation {operation!r}")
+    amount = Money.coerce(amount)
+    if amount.cents <= 0:
+        raise ValueError("Amount must be positive.")
+    return ledger.apply(user_id, operation, amount)
+
+
+def transfer(user_id, recipient_id, amount):
+    # Sends amount (Money) from user_id's wallet to another customer's wallet;
+    # returns False on insufficient funds, raises UnknownAccountError for an unknown recipient
+    amount = Money.coerce(amount)
+    if amount.cents <= 0:
+        raise ValueError("Amount must be positive.")
+    if recipient_id == user_id:
+        raise ValueError("Cannot transfer to your own account.")
+    return ledger.transfer(user_id, recipient_id, amount)
+
+
+def schedule(user_id, operation, amount, start_at=None, every=None):
+    # Runs operation for amount (Money) at start_at (ISO date or date and time,
+    # default now), then every "day", "week" or "month" if every is given.
+    # Returns the schedule id.
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown operation {operation!r}")
+    amount = Money.coerce(amount)
+    if amount.cents <= 0:
+        raise ValueError("Amount must be positive.")
+    return scheduler.add(user_id, operation, amount, start_at, every)
+
+
+def schedules(user_id):
+    return scheduler.for_user(user_id)
+
+
+def cancel_schedule(user_id, schedule_id):
+    return scheduler.cancel(user_id, schedule_id)
+
+
+def history(user_id, limit=HISTORY_PAGE_SIZE, before=None):
+    customer = get_customer(user_id)
+    return customer.transaction_history(limit, before) if customer else []
+
+
+def statement(user_id, start_day, end_day):
+    # Days are ISO dates (YYYY-MM-DD), inclusive
+    return snapshots.statement(user_id, start_day, end_day)
+
+
+def export_history(user_id, path, format=None, start_day=None, end_day=None):
+    from services import export
+    return export.export(path, format, user_id=user_id, start_day=start_day, end_day=end_day)[0][1]
+
+
+def apply_batch_file(path):
+    return ledger.apply_batch(read_batch_file(path))
@@ -0,0 +1,103 @@
+# services/admin.py
+import sharding
+from models.models import Customer, CUSTOMER_PAGE_SIZE
+from models import archive, cache, snapshots
+from services import analytics, auth, onboarding
+from utils.validators import validate_password_strength
+
+
+class WeakPasswordError(ValueError):
+    pass
+
+
+class MissingFieldError(ValueError):
+    pass
+
+
+def add_customer(name, national_id, phone_number, password):
+    fields = {"name": name, "national_id": national_id, "phone_number": phone_number}
+    missing = [field for field, value in fields.items() if not isinstance(value, str) or not value.strip()]
+    if missing:
+        raise MissingFieldError(f"Missing {', '.join(missing)}.")
+    if not isinstance(password, str) or not validate_password_strength(password):
+        raise WeakPasswordError("Password is not strong enough.")
+    customer = Customer(name, national_id, phone_number, password)
+    customer.save_to_db()
+    return customer
+
+
+def import_customers(admin, path, report_path=None, workers=None):
+    # Returns (customers added, rejected rows); rejected rows are also written
+    # to report_path as CSV when given
+    added, errors = onboarding.import_customers(path, workers)
+    if report_path:
+        onboarding.write_report(errors, report_path)
+    return added, errors
+
+
+def reset_password(admin, user_id, new_password):
+    if not validate_password_strength(new_password):
+        raise WeakPasswordError("Password is not strong enough.")
+    admin.reset_user_password(user_id, new_password)
+    auth.forget(user_id)
+
+
+def lock(admin, user_id):
+    admin.lock_user_account(user_id)
+    auth.forget(user_id)
+
+
+def unlock(admin, user_id):
+    admin.unlock_user_account(user_id)
+    auth.reset_attempts(user_id)
+
+
+def delete(admin, user_id):
+    admin.delete_user(user_id)
+    auth.forget(user_id)
+
+
+def list_customers(admin, limit=CUSTOMER_PAGE_SIZE, after=None, search=None):
+    return admin.list_customers(limit, after, search)
+
+
+def get_customer(admin, user_id):
+    return admin.get_customer(user_id)
+
+
+def bank_totals(admin, start_day, end_day):
+    return snapshots.bank_totals(start_day, end_day)
+
+
+def analytics_report(admin, start_day=None, end_day=None, top=analytics.TOP_CUSTOMERS):
+    # Volume, failure rates, daily totals, top customers and anomaly flags
+    return analytics.report(start_day, end_day, top)
+
+
+def verify_snapshots(admin, fix=False):
+    return snapshots.verify(fix)
+
+
+def archive_transactions(admin, before_day, vacuum=False):
+    # Moves whole months before before_day's month into read-only archive files
+    return archive.archive_before(before_day, vacuum)
+
+
+def archives(admin):
+    return archive.periods()
+
+
+def shards(admin):
+    # Paths of the files holding customer data, in shard order
+    return [db.path for db in sharding.pools()]
+
+
+def rebalance_shards(admin, count):
+    # Offline: moves customer data to count files (1 folds it back into the main database)
+    moved = sharding.rebalance(count)
+    cache.clear()
+    return moved
+
+
+def cache_stats(admin):
+    return cache.stats()
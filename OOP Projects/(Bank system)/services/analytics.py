@@ -0,0 +1,217 @@
+# services/analytics.py
+# Bank-wide activity reports for admins, computed with NumPy over the whole
+# ledger rather than by looping over Python rows. Every shard's transactions
+# and every archived month are read in id ranges of CHUNK_SIZE rows, with type
+# and status coded to small ints and timestamps to epoch seconds in SQL, so a
+# chunk turns into arrays in one np.fromiter call. Each chunk is its own short
+# read, as in services/export.py. Fewer columns per row means fewer Python
+# objects to build, so user, type and success share one packed integer. The
+# loaded columns take about 23 bytes per row; the reports are bincounts, sorts
+# and searchsorted over them.
+import contextlib
+import datetime
+import itertools
+import sqlite3
+import time
+from collections import namedtuple
+import numpy as np
+import sharding
+from models import archive
+from models.ledger import EFFECTS, TRANSFER_EFFECTS
+from models.money import Money
+from models.snapshots import LEGACY_TYPES
+
+CHUNK_SIZE = 500_000
+TYPES = tuple(EFFECTS) + tuple(TRANSFER_EFFECTS) + ("other",)
+SUCCESS = ("success", "Completed")
+TOP_CUSTOMERS = 10
+# A customer's day is flagged when its successful volume is Z_THRESHOLD
+# standard deviations above the customer's other days, given at least
+# MIN_ACTIVE_DAYS of them
+Z_THRESHOLD = 4.0
+MIN_ACTIVE_DAYS = 5
+# A burst is BURST_ATTEMPTS or more failed *_withdraw operations by one
+# customer within any BURST_WINDOW seconds
+BURST_WINDOW = 3600
+BURST_ATTEMPTS = 5
+ANOMALY_LIMIT = 100
+
+_CODES = {**{name: code for code, name in enumerate(TYPES)},
+          **{old: TYPES.index(new) for old, new in LEGACY_TYPES.items()}}
+# unixepoch() is the faster of the two; SQLite added it in 3.38
+EPOCH = "unixepoch(timestamp)" if sqlite3.sqlite_version_info >= (3, 38) else "CAST(strftime('%s', timestamp) AS INTEGER)"
+# (user_id << 8 | type code << 1 | success, amount, epoch seconds)
+SELECT = (
+    "SELECT (COALESCE(user_id, 0) << 8) | ((CASE type "
+    + " ".join(f"WHEN '{name}' THEN {code}" for name, code in _CODES.items())
+    + f" ELSE {len(TYPES) - 1} END) << 1) | (status IN ({', '.join(repr(s) for s in SUCCESS)})), "
+    f"COALESCE(amount, 0), COALESCE({EPOCH}, 0) FROM transactions WHERE id >= ? AND id < ?"
+)
+
+Columns = namedtuple("Columns", "user_id type success amount timestamp")
+
+
+def read_source(conn_for, where, params, chunk_size=CHUNK_SIZE):
+    # [Columns] for one source, one per non-empty id range of chunk_size.
+    # conn_for() returns a context manager giving the connection for one chunk.
+    with conn_for() as conn:
+        low, high = conn.execute("SELECT MIN(id), MAX(id) FROM transactions").fetchone()
+    chunks = []
+    while low is not None and low <= high:
+        with conn_for() as conn:
+            rows = conn.execute(SELECT + where, [low, low + chunk_size] + params).fetchall()
+            if not rows:
+                # Jump the gaps in the id sequence, e.g. between shards' id ranges
+                low = conn.execute("SELECT MIN(id) FROM transactions WHERE id >= ?", (low + chunk_size,)).fetchone()[0]
+                continue
+        block = np.fromiter(itertools.chain.from_iterable(rows), np.int64, len(rows) * 3).reshape(-1, 3)
+        packed = block[:, 0]
+        chunks.append(Columns((packed >> 8).astype(np.int32), ((packed >> 1) & 0x7F).astype(np.int16),
+                              (packed & 1).astype(bool), block[:, 1].copy(), block[:, 2].copy()))
+        low += chunk_size
+    return chunks
+
+
+def load(start_day=None, end_day=None, chunk_size=CHUNK_SIZE):
+    # Columns of every transaction, hot or archived, between the days
+    # (YYYY-MM-DD, inclusive). Shards are read in parallel.
+    where, params = "", []
+    if start_day:
+        where += " AND timestamp >= ?"
+        params.append(start_day)
+    if end_day:
+        where += " AND timestamp < ?"
+        params.append(end_day + "~")
+    chunks = [chunk for found in sharding.fan_out(lambda db: read_source(db.connection, where, params, chunk_size))
+              for chunk in found]
+    for period, path, first_ts, last_ts, _ in archive.periods():
+        if (start_day and last_ts < start_day) or (end_day and first_ts > end_day + "~"):
+            continue
+        conn = archive.open_archive(path)
+        chunks.extend(read_source(lambda: contextlib.nullcontext(conn), where, params, chunk_size))
+    if not chunks:
+        chunks = [Columns(np.empty(0, np.int32), np.empty(0, np.int16), np.empty(0, bool),
+                          np.empty(0, np.int64), np.empty(0, np.int64))]
+    return Columns(*(np.concatenate(parts) for parts in zip(*chunks)))
+
+
+def _sum(keys, weights, minlength=0):
+    # Exact integer sums: float64 holds every partial sum exactly below 2^53 cents
+    return np.rint(np.bincount(keys, weights=weights, minlength=minlength)).astype(np.int64)
+
+
+def _day(days):
+    return (datetime.date(1970, 1, 1) + datetime.timedelta(days=int(days))).isoformat()
+
+
+def _minute(seconds):
+    # Timestamps are stored as naive local time and strftime('%s') read them as
+    # UTC, so converting back as UTC gives the original wall-clock time
+    return datetime.datetime.fromtimestamp(int(seconds), datetime.timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+def type_volume(columns):
+    # [(type, count, failed, failure rate, successful amount)] for each type seen
+    ok = columns.success
+    count = np.bincount(columns.type, minlength=len(TYPES))
+    failed = np.bincount(columns.type[~ok], minlength=len(TYPES))
+    amount = _sum(columns.type[ok], columns.amount[ok], len(TYPES))
+    return [(TYPES[k], int(count[k]), int(failed[k]), round(float(failed[k] / count[k]), 4), Money(int(amount[k])))
+            for k in np.flatnonzero(count)]
+
+
+def daily_totals(columns):
+    # [(day, count, failed, successful amount)] for each day with activity
+    if not len(columns.timestamp):
+        return []
+    day = columns.timestamp // 86400
+    first = int(day.min())
+    day = day - first
+    ok = columns.success
+    count = np.bincount(day)
+    failed = np.bincount(day[~ok], minlength=len(count))
+    amount = _sum(day[ok], columns.amount[ok], len(count))
+    return [(_day(first + d), int(count[d]), int(failed[d]), Money(int(amount[d]))) for d in np.flatnonzero(count)]
+
+
+def top_customers(columns, top=TOP_CUSTOMERS):
+    # [(user_id, successful operations, successful amount)], largest amount first
+    ok = columns.success
+    amount = _sum(columns.user_id[ok], columns.amount[ok])
+    count = np.bincount(columns.user_id[ok], minlength=len(amount))
+    active = np.flatnonzero(amount)
+    if top < len(active):
+        active = active[np.argpartition(-amount[active], top - 1)[:top]]
+    active = active[np.argsort(-amount[active], kind="stable")]
+    return [(int(u), int(count[u]), Money(int(amount[u]))) for u in active]
+
+
+def amount_spikes(columns, threshold=Z_THRESHOLD, min_days=MIN_ACTIVE_DAYS, limit=ANOMALY_LIMIT):
+    # [(user_id, day, successful amount, z-score)] for customer days far above
+    # the customer's other active days, highest z-score first. Each day is
+    # scored against the mean and deviation of the customer's other days, so
+    # one huge day cannot hide itself by inflating the deviation.
+    ok = columns.success
+    if not ok.any():
+        return []
+    user = columns.user_id[ok].astype(np.int64)
+    day = columns.timestamp[ok] // 86400
+    first = int(day.min())
+    span = int(day.max()) - first + 1
+    keys, inverse = np.unique(user * span + (day - first), return_inverse=True)
+    volume = np.bincount(inverse, weights=columns.amount[ok])
+    owners, owner = np.unique(keys // span, return_inverse=True)
+    others = np.bincount(owner)[owner] - 1
+    total = np.bincount(owner, weights=volume)[owner] - volume
+    squares = np.bincount(owner, weights=volume * volume)[owner] - volume * volume
+    scored = others >= max(min_days, 1)
+    mean = np.divide(total, others, out=np.zeros_like(volume), where=scored)
+    std = np.sqrt(np.maximum(np.divide(squares, others, out=np.zeros_like(volume), where=scored) - mean * mean, 0))
+    scored &= std > 0
+    z = np.divide(volume - mean, std, out=np.zeros_like(volume), where=scored)
+    flagged = np.flatnonzero(scored & (z >= threshold))
+    flagged = flagged[np.argsort(-z[flagged], kind="stable")][:limit]
+    return [(int(owners[owner[i]]), _day(first + keys[i] % span), Money(int(round(volume[i]))), round(float(z[i]), 2))
+            for i in flagged]
+
+
+def failed_withdraw_bursts(columns, window=BURST_WINDOW, attempts=BURST_ATTEMPTS, limit=ANOMALY_LIMIT):
+    # [(user_id, burst start, failed attempts)] with each customer's worst
+    # sliding window of failed *_withdraw operations, most attempts first
+    withdraws = [code for code, name in enumerate(TYPES) if name.endswith("_withdraw")]
+    mask = ~columns.success & np.isin(columns.type, withdraws)
+    if not mask.any():
+        return []
+    user = columns.user_id[mask].astype(np.int64)
+    seconds = columns.timestamp[mask]
+    first = int(seconds.min())
+    # Customers sit more than a window apart on one sorted axis, so a window
+    # starting at any attempt counts only that customer's attempts
+    span = int(seconds.max()) - first + window + 1
+    keys = np.sort(user * span + (seconds - first))
+    counts = np.searchsorted(keys, keys + window, side="left") - np.arange(len(keys))
+    flagged = np.flatnonzero(counts >= attempts)
+    if not len(flagged):
+        return []
+    # The largest window per customer: sort by customer, then most attempts
+    order = flagged[np.lexsort((-counts[flagged], keys[flagged] // span))]
+    _, worst = np.unique(keys[order] // span, return_index=True)
+    worst = order[worst]
+    worst = worst[np.argsort(-counts[worst], kind="stable")][:limit]
+    return [(int(keys[i] // span), _minute(first + keys[i] % span), int(counts[i])) for i in worst]
+
+
+def report(start_day=None, end_day=None, top=TOP_CUSTOMERS, chunk_size=CHUNK_SIZE):
+    # Every report over one scan of the ledger, plus the rows scanned and the
+    # seconds the scan and reports took
+    started = time.perf_counter()
+    columns = load(start_day, end_day, chunk_size)
+    return {
+        "types": type_volume(columns),
+        "daily": daily_totals(columns),
+        "top_customers": top_customers(columns, top),
+        "amount_spikes": amount_spikes(columns),
+        "failed_withdraw_bursts": failed_withdraw_bursts(columns),
+        "rows": len(columns.user_id),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
@@ -0,0 +1,187 @@
+# services/auth.py
+# Sign-in with throttling and a bcrypt bypass for recently verified credentials.
+# Failed attempts are tracked per account, and per source for remote (API)
+# clients, in login_attempts; past FREE_ATTEMPTS each failure doubles the wait,
+# and LOCK_AFTER consecutive account failures set users.is_locked until an
+# admin unlocks it. A lock is only reported once the password checks out.
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from functools import lru_cache
+from database import connection, transaction, after_commit
+from models import cache
+from models.models import Admin, Customer, find_user_by_name
+from utils import session
+
+USER_CLASSES = {"admin": Admin, "customer": Customer}
+FREE_ATTEMPTS = 3
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 300.0
+FAILURE_WINDOW = 900.0
+LOCK_AFTER = 10
+CREDENTIAL_TTL = 300.0
+# Sources shared by everyone on this machine (GUI, CLI); throttling them as one
+# would let a few typos on one account block sign-in for every local user
+LOCAL_SOURCES = ("local", "cli")
+
+
+class AuthError(Exception):
+    pass
+
+
+class AccountLockedError(AuthError):
+    pass
+
+
+class LoginThrottledError(AuthError):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many failed sign-ins. Try again in {retry_after:.0f} seconds.")
+        self.retry_after = retry_after
+
+
+class TTLCache:
+    # Small thread-safe dict whose entries expire after ttl seconds. Past
+    # max_entries, expired entries are swept and then the oldest are dropped.
+    def __init__(self, ttl, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self.entries[key]
+                return None
+            return entry[0]
+
+    def put(self, key, value):
+        with self.lock:
+            now = time.monotonic()
+            self.entries.pop(key, None)
+            self.entries[key] = (value, now + self.ttl)
+            if len(self.entries) > self.max_entries:
+                for k in [k for k, (v, expires) in self.entries.items() if expires < now]:
+                    del self.entries[k]
+                while len(self.entries) > self.max_entries:
+                    del self.entries[next(iter(self.entries))]
+
+    def discard_where(self, predicate):
+        with self.lock:
+            for key in [k for k, (v, _) in self.entries.items() if predicate(k, v)]:
+                del self.entries[key]
+
+
+# Keyed HMACs of passwords that passed bcrypt recently; the key never leaves the process
+_credential_key = secrets.token_bytes(32)
+credentials = TTLCache(CREDENTIAL_TTL)
+
+
+def _fingerprint(user_id, password):
+    return hmac.new(_credential_key, f"{user_id}:{password}".encode(), hashlib.sha256).digest()
+
+
+@lru_cache(maxsize=None)
+def _dummy_hash():
+    # Checked against for unknown names so they cost a bcrypt like real ones;
+    # made on first use, at the current cost, instead of at import
+    return Customer.hash_password(secrets.token_urlsafe(16))
+
+
+def _check_throttle(conn, keys, now):
+    marks = ",".join("?" * len(keys))
+    row = conn.execute(f"SELECT MAX(blocked_until) FROM login_attempts WHERE key IN ({marks})", keys).fetchone()
+    if row[0] is not None and row[0] > now:
+        raise LoginThrottledError(row[0] - now)
+
+
+def _record_failure(conn, key, now):
+    row = conn.execute("SELECT failures, last_failure FROM login_attempts WHERE key = ?", (key,)).fetchone()
+    failures = 1 if row is None or now - row[1] > FAILURE_WINDOW else row[0] + 1
+    delay = 0.0
+    if failures > FREE_ATTEMPTS:
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (failures - FREE_ATTEMPTS - 1))
+    conn.execute(
+        "INSERT OR REPLACE INTO login_attempts (key, failures, last_failure, blocked_until) VALUES (?, ?, ?, ?)",
+        (key, failures, now, now + delay))
+    return failures
+
+
+def sign_in(name, password, user_type, source="local"):
+    # Returns the signed-in Admin/Customer, or None for bad credentials. Raises
+    # LoginThrottledError while backing off and AccountLockedError for locked accounts.
+    cls = USER_CLASSES[user_type]
+    account_key = f"account:{user_type}:{name}"
+    source_key = None if source in LOCAL_SOURCES else f"source:{source}"
+    with connection() as conn:
+        _check_throttle(conn, tuple(key for key in (account_key, source_key) if key), time.time())
+    row = find_user_by_name(name, user_type)
+
+    # bcrypt runs with no pool connection held
+    if row is None:
+        cls.verify_password(password, _dummy_hash())
+        verified = False
+    else:
+        fingerprint = _fingerprint(row[0], password)
+        verified = (hmac.compare_digest(credentials.get(row[0]) or b"", fingerprint)
+                    or cls.verify_password(password, row[4]))
+
+    now = time.time()
+    if not verified:
+        with transaction() as conn:
+            failures = _record_failure(conn, account_key, now)
+            if source_key:
+                _record_failure(conn, source_key, now)
+            if row and failures >= LOCK_AFTER:
+                conn.execute("UPDATE users SET is_locked = 1 WHERE id = ?", (row[0],))
+                after_commit(lambda: cache.invalidate_user(row[0]))
+        return None
+    # Checked after the password, so a locked account is only revealed to its owner
+    if row[5]:
+        raise AccountLockedError("This account is locked. Please contact the bank.")
+
+    user = cls.from_row(row)
+    rehashed = cls.hash_password(password) if cls.needs_rehash(row[4]) else None
+    with transaction() as conn:
+        conn.execute("DELETE FROM login_attempts WHERE key = ?", (account_key,))
+        if rehashed:
+            conn.execute("UPDATE users SET password = ? WHERE id = ?", (rehashed, user.id))
+            after_commit(lambda: cache.invalidate_user(user.id))
+            user.password = rehashed
+    credentials.put(user.id, fingerprint)
+    return user
+
+
+def forget(user_id):
+    # Drops cached credentials and ends sessions after a password reset, lock or delete
+    user_id = int(user_id)
+    credentials.discard_where(lambda key, value: key == user_id)
+    session.store.end_user(user_id)
+
+
+def reset_attempts(user_id):
+    # Clears the account's failure count, e.g. when an admin unlocks it
+    with connection() as conn:
+        conn.execute(
+            "DELETE FROM login_attempts WHERE key = (SELECT 'account:' || user_type || ':' || name FROM users WHERE id = ?)",
+            (user_id,))
+
+
+def issue_token(user):
+    return session.store.create(user, "admin" if isinstance(user, Admin) else "customer")
+
+
+def user_for_token(token):
+    current = session.store.get(token)
+    return current.user if current is not None else None
+
+
+def register_admin(name, national_id, phone_number, password):
+    admin = Admin(name, national_id, phone_number, password)
+    admin.save_to_db()
+    return admin
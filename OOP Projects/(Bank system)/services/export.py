@@ -0,0 +1,244 @@
+# services/export.py
+# Streaming ledger export to CSV, JSONL or a compact columnar binary file.
+# Rows are read in keyset chunks ordered by (user_id, timestamp, id) off
+# idx_transactions_user_time: each chunk is its own short read, so no read
+# transaction stays open for the length of the export, and memory holds one
+# chunk regardless of the export's size. Archived months are read from their
+# files before the hot table, so each customer's rows stay in time order;
+# when customer data is sharded the hot tables are read one shard after another,
+# and since a customer's rows live in one shard that order still holds.
+# With shards > 1 the user-id range is split evenly and each shard is written
+# by its own process to its own part file.
+import array
+import csv
+import json
+import multiprocessing
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import database
+import sharding
+from models import archive
+from models.money import Money
+
+CHUNK_SIZE = 5000
+COLUMNS = ("id", "user_id", "type", "amount", "status", "timestamp")
+FORMATS = {"csv": ".csv", "jsonl": ".jsonl", "columnar": ".bcol"}
+
+SELECT = "SELECT id, user_id, type, amount, status, timestamp FROM transactions"
+ORDER = " ORDER BY user_id, timestamp, id LIMIT ?"
+
+
+def read_chunks(conn_for, first_user, last_user, start_day=None, end_day=None, chunk_size=CHUNK_SIZE):
+    # Yields lists of rows for users first_user..last_user from one source.
+    # conn_for() returns a context manager giving the connection for one chunk.
+    where, params = " WHERE user_id BETWEEN ? AND ?", [first_user, last_user]
+    if start_day:
+        where += " AND timestamp >= ?"
+        params.append(start_day)
+    if end_day:
+        # end_day is inclusive; "YYYY-MM-DD~" sorts after every timestamp on that day
+        where += " AND timestamp < ?"
+        params.append(end_day + "~")
+    cursor = None
+    while True:
+        with conn_for() as conn:
+            if cursor is None:
+                rows = conn.execute(SELECT + where + ORDER, params + [chunk_size]).fetchall()
+            else:
+                rows = conn.execute(SELECT + where + " AND (user_id, timestamp, id) > (?, ?, ?)" + ORDER,
+                                    params + list(cursor) + [chunk_size]).fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        cursor = (rows[-1][1], rows[-1][5], rows[-1][0])
+
+
+class _Held:
+    # Context manager handing out an already open archive connection
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc):
+        return False
+
+
+def iter_chunks(first_user, last_user, start_day=None, end_day=None, chunk_size=CHUNK_SIZE):
+    # Archives in period order, then the hot table of each shard
+    for period, path, first_ts, last_ts, _ in archive.periods():
+        if (start_day and last_ts < start_day) or (end_day and first_ts > end_day + "~"):
+            continue
+        held = _Held(archive.open_archive(path))
+        yield from read_chunks(lambda: held, first_user, last_user, start_day, end_day, chunk_size)
+    for db in sharding.pools():
+        yield from read_chunks(db.connection, first_user, last_user, start_day, end_day, chunk_size)
+
+
+class CSVWriter:
+    def __init__(self, f):
+        self.writer = csv.writer(f)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows((i, u, t, str(Money(a)), s, ts) for i, u, t, a, s, ts in rows)
+
+
+class JSONLWriter:
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, rows):
+        self.f.write("".join(
+            json.dumps({"id": i, "user_id": u, "type": t, "amount": str(Money(a)), "status": s, "timestamp": ts}) + "\n"
+            for i, u, t, a, s, ts in rows))
+
+
+class ColumnarWriter:
+    # File: MAGIC, then one block per chunk: "<II" (row count, payload size) and
+    # a zlib payload holding each column as a "<I" length-prefixed section:
+    #   id, user_id   int64 deltas from the previous row (small, compress well)
+    #   amount        int64 cents
+    #   type, status  dictionary: "<H" count, "<H"-length-prefixed UTF-8 entries, uint16 indices
+    #   timestamp     UTF-8 strings joined by "\n"
+    MAGIC = b"BANKCOL1"
+
+    def __init__(self, f):
+        self.f = f
+        f.write(self.MAGIC)
+
+    def write(self, rows):
+        ids, users, types, amounts, statuses, stamps = zip(*rows)
+        payload = b"".join(_section(part) for part in (
+            _deltas(ids), _deltas(users), _dictionary(types), array.array("q", amounts).tobytes(),
+            _dictionary(statuses), "\n".join(stamps).encode()))
+        packed = zlib.compress(payload, 6)
+        self.f.write(struct.pack("<II", len(rows), len(packed)) + packed)
+
+
+def _section(data):
+    return struct.pack("<I", len(data)) + data
+
+
+def _deltas(values):
+    out, previous = array.array("q"), 0
+    for value in values:
+        out.append(value - previous)
+        previous = value
+    return out.tobytes()
+
+
+def _dictionary(values):
+    entries, indices = {}, array.array("H")
+    for value in values:
+        indices.append(entries.setdefault(value, len(entries)))
+    head = struct.pack("<H", len(entries)) + b"".join(
+        struct.pack("<H", len(e)) + e for e in (str(v).encode() for v in entries))
+    return head + indices.tobytes()
+
+
+def read_columnar(path):
+    # Yields rows (id, user_id, type, amount cents, status, timestamp) back from a columnar file
+    with open(path, "rb") as f:
+        if f.read(len(ColumnarWriter.MAGIC)) != ColumnarWriter.MAGIC:
+            raise ValueError(f"{path} is not a columnar export")
+        while True:
+            head = f.read(8)
+            if not head:
+                return
+            count, size = struct.unpack("<II", head)
+            payload, offset, sections = zlib.decompress(f.read(size)), 0, []
+            for _ in range(6):
+                length, = struct.unpack_from("<I", payload, offset)
+                sections.append(payload[offset + 4:offset + 4 + length])
+                offset += 4 + length
+            ids, users = _undelta(sections[0]), _undelta(sections[1])
+            types, statuses = _undictionary(sections[2]), _undictionary(sections[4])
+            amounts = array.array("q", sections[3])
+            stamps = sections[5].decode().split("\n")
+            yield from zip(ids, users, types, amounts, statuses, stamps)
+
+
+def _undelta(data):
+    values, total = [], 0
+    for delta in array.array("q", data):
+        total += delta
+        values.append(total)
+    return values
+
+
+def _undictionary(data):
+    count, = struct.unpack_from("<H", data, 0)
+    offset, entries = 2, []
+    for _ in range(count):
+        length, = struct.unpack_from("<H", data, offset)
+        entries.append(data[offset + 2:offset + 2 + length].decode())
+        offset += 2 + length
+    return [entries[i] for i in array.array("H", data[offset:])]
+
+
+def export_shard(path, format, first_user, last_user, start_day=None, end_day=None, chunk_size=CHUNK_SIZE):
+    # Writes one file; returns (path, rows written)
+    binary = format == "columnar"
+    written = 0
+    with open(path, "wb" if binary else "w", **({} if binary else {"newline": "", "encoding": "utf-8"})) as f:
+        writer = {"csv": CSVWriter, "jsonl": JSONLWriter, "columnar": ColumnarWriter}[format](f)
+        for rows in iter_chunks(first_user, last_user, start_day, end_day, chunk_size):
+            writer.write(rows)
+            written += len(rows)
+    return path, written
+
+
+def user_id_range():
+    # Lowest and highest user_id with any transaction, hot or archived
+    def hot_bounds(db):
+        with db.connection() as conn:
+            return conn.execute("SELECT MIN(user_id), MAX(user_id) FROM transactions").fetchone()
+    bounds = sharding.fan_out(hot_bounds)
+    for _, path, _, _, _ in archive.periods():
+        bounds.append(archive.open_archive(path).execute("SELECT MIN(user_id), MAX(user_id) FROM transactions").fetchone())
+    bounds = [b for b in bounds if b[0] is not None]
+    if not bounds:
+        return None
+    return min(b[0] for b in bounds), max(b[1] for b in bounds)
+
+
+def _init_worker(db_path, archive_dir):
+    database.configure(db_path)
+    archive.ARCHIVE_DIR = archive_dir
+
+
+def format_for(path):
+    # The format named by the file extension, CSV when it names none
+    ext = os.path.splitext(path)[1].lower()
+    return next((name for name, e in FORMATS.items() if e == ext), "csv")
+
+
+def export(path, format=None, user_id=None, start_day=None, end_day=None, shards=1, chunk_size=CHUNK_SIZE):
+    # Exports the ledger (or one customer's part of it) and returns [(path, rows)].
+    # Days are YYYY-MM-DD and inclusive. With shards > 1 the files are
+    # <path stem>.part-NNN<ext>, one per user-id shard, each sorted the same way.
+    format = format or format_for(path)
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {tuple(FORMATS)}")
+    if user_id is not None:
+        bounds, shards = (user_id, user_id), 1
+    else:
+        bounds = user_id_range() or (0, 0)
+    if shards <= 1:
+        return [export_shard(path, format, bounds[0], bounds[1], start_day, end_day, chunk_size)]
+
+    first, last = bounds
+    step = (last - first) // shards + 1
+    stem, ext = os.path.splitext(path)
+    jobs = [(f"{stem}.part-{i:03d}{ext or FORMATS[format]}", format, first + i * step, min(last, first + (i + 1) * step - 1),
+             start_day, end_day, chunk_size) for i in range(shards) if first + i * step <= last]
+    # spawn, not fork: the parent has pool connections and logger threads
+    with ProcessPoolExecutor(len(jobs), mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(database.pool.path, archive.archive_dir())) as pool:
+        return list(pool.map(export_shard, *zip(*jobs)))
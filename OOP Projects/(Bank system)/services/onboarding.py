@@ -0,0 +1,126 @@
+# services/onboarding.py
+# Bulk customer import from a CSV with the columns name, national_id,
+# phone_number and password. The file is streamed in chunks: each chunk is
+# validated (required fields, password strength, national_id not seen earlier
+# in the file or already registered), its passwords are hashed across a
+# process pool, and its users and customers rows are inserted in one
+# transaction. bcrypt holds a core for the whole hash, so processes rather
+# than threads; the next chunk is hashed while the previous one is inserted.
+# Rejected rows are reported by line number and never stop the import.
+import csv
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import sharding
+from database import connection, transaction
+from models.models import User
+from utils.validators import validate_password_strength
+
+CHUNK_SIZE = 1000
+FIELDS = ("name", "national_id", "phone_number", "password")
+REPORT_FIELDS = ("line", "national_id", "error")
+# Bound on ? parameters per IN (...) list
+LOOKUP_SIZE = 500
+
+
+def hash_password(password):
+    # Runs in the worker processes
+    return User.hash_password(password)
+
+
+def read_rows(path):
+    # Yields (line number, row dict)
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        missing = [field for field in FIELDS if field not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"{path} is missing columns: {', '.join(missing)}")
+        for row in reader:
+            yield reader.line_num, row
+
+
+def registered(conn, national_ids):
+    # The subset of national_ids already in users
+    national_ids, found = list(national_ids), set()
+    for i in range(0, len(national_ids), LOOKUP_SIZE):
+        part = national_ids[i:i + LOOKUP_SIZE]
+        found.update(row[0] for row in conn.execute(
+            f"SELECT national_id FROM users WHERE national_id IN ({', '.join('?' * len(part))})", part))
+    return found
+
+
+def validate(chunk, seen, errors):
+    # Returns the rows of chunk that may be inserted, as (line, name,
+    # national_id, phone_number, password); the rest go to errors
+    valid = []
+    for line, row in chunk:
+        name, national_id, phone = ((row.get(field) or "").strip() for field in FIELDS[:3])
+        password = row.get("password") or ""
+        missing = [field for field, value in zip(FIELDS, (name, national_id, phone, password)) if not value]
+        if missing:
+            errors.append((line, national_id, f"missing {', '.join(missing)}"))
+        elif national_id in seen:
+            errors.append((line, national_id, f"duplicate national_id (first on line {seen[national_id]})"))
+        elif not validate_password_strength(password):
+            seen[national_id] = line
+            errors.append((line, national_id, "weak password"))
+        else:
+            seen[national_id] = line
+            valid.append((line, name, national_id, phone, password))
+    with connection() as conn:
+        taken = registered(conn, (row[2] for row in valid))
+    errors.extend((line, national_id, "national_id already registered")
+                  for line, _, national_id, _, _ in valid if national_id in taken)
+    return [row for row in valid if row[2] not in taken]
+
+
+def insert(rows, hashes, errors):
+    # One transaction per chunk. national_ids are checked again under the
+    # write lock, in case a customer was added since the chunk was validated.
+    # Sharded customers rows commit in each shard's transaction, nested inside
+    # the users one as Customer.save_to_db does.
+    with transaction() as conn:
+        taken = registered(conn, (row[2] for row in rows))
+        errors.extend((line, national_id, "national_id already registered")
+                      for line, _, national_id, _, _ in rows if national_id in taken)
+        start = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO users (name, national_id, phone_number, password, user_type) VALUES (?, ?, ?, ?, 'customer')",
+            ((name, national_id, phone, hashed) for (_, name, national_id, phone, _), hashed in zip(rows, hashes)
+             if national_id not in taken))
+        ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE id > ?", (start,))]
+        for db, user_ids in sharding.group(ids):
+            with db.transaction() as shard:
+                shard.executemany("INSERT OR REPLACE INTO customers (user_id, credit, wallet_balance) VALUES (?, 0, 0)",
+                                  ((user_id,) for user_id in user_ids))
+    return len(ids)
+
+
+def import_customers(path, workers=None, chunk_size=CHUNK_SIZE):
+    # Returns (customers added, [(line, national_id, error)] sorted by line)
+    workers = workers or os.cpu_count() or 1
+    rows_in = read_rows(path)
+    errors, seen, added, pending = [], {}, 0, None
+    # spawn, not fork: the parent has pool connections and logger threads
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        while True:
+            chunk = list(islice(rows_in, chunk_size))
+            if chunk:
+                rows = validate(chunk, seen, errors)
+                hashes = pool.map(hash_password, [row[4] for row in rows],
+                                  chunksize=max(1, len(rows) // (workers * 4)))
+            if pending:
+                added += insert(*pending, errors)
+            if not chunk:
+                break
+            pending = (rows, hashes)
+    errors.sort()
+    return added, errors
+
+
+def write_report(errors, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_FIELDS)
+        writer.writerows(errors)
@@ -0,0 +1,292 @@
+# sharding.py
+# Optional hash partitioning of customer data by user_id across several SQLite
+# files, so writes for different customers stop queueing behind one writer
+# lock. The main database keeps users, sessions, sign-in attempts, the archive
+# registry and the shard list; each shard file holds, for its customers, the
+# customers, transactions, daily_totals, daily_balances, bank_daily_totals,
+# transfers and schedules rows. With no shards configured everything routes to
+# the main database, so the unsharded code path is unchanged.
+#
+# Shard files are listed in the main database's shards table and live next to
+# it as <name>.shard-NN.db. Every file carries the full schema and is migrated
+# with the main database; tables a file does not own stay empty.
+#
+# rebalance(n) moves customers between layouts (n=1 folds everything back into
+# the main database). It is an offline tool: stop the GUI and API first.
+import glob
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import database
+from database import ConnectionPool
+
+# Each shard file allocates transaction and schedule ids from its own
+# 2^40-wide range, so ids stay unique across files and rows keep their ids
+# when they move
+ID_SPAN = 1 << 40
+SEQUENCED = ("transactions", "schedules")
+REBALANCE_BATCH = 500
+# (table, user column, columns to copy; None copies all of them). Surrogate ids
+# nothing refers to are left for the destination to assign.
+MOVED = (
+    ("customers", "user_id", ("user_id", "credit", "wallet_balance")),
+    ("transactions", "user_id", None),
+    ("daily_totals", "user_id", None),
+    ("daily_balances", "user_id", None),
+    ("transfers", "sender_id", ("sender_id", "recipient_id", "amount", "debit_id", "credit_id", "timestamp")),
+    ("schedules", "user_id", None),
+)
+
+_layout = None
+_lock = threading.Lock()
+
+
+def shard_index(user_id, count):
+    # Multiplicative hash, so consecutive ids spread evenly. A user's shard
+    # under 2N is its shard under N or that plus N: doubling moves half the rows.
+    return (((int(user_id) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 32) % count
+
+
+def shard_path(main_path, k):
+    stem, ext = os.path.splitext(main_path)
+    return f"{stem}.shard-{k:02d}{ext or '.db'}"
+
+
+def shard_files(main_path):
+    # Every shard file next to the database at main_path, in use or left over
+    stem, ext = os.path.splitext(os.path.abspath(main_path))
+    return sorted(glob.glob(glob.escape(stem) + ".shard-*" + glob.escape(ext or ".db")))
+
+
+def pools():
+    # Pools holding customer data in shard order; just the main pool when unsharded
+    main = database.pool
+    layout = _layout
+    if layout is None or layout[0] is not main:
+        layout = _load(main)
+    return layout[1]
+
+
+def _load(main):
+    global _layout
+    with _lock:
+        if _layout is not None and _layout[0] is main:
+            return _layout
+        with main.connection() as conn:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'shards'").fetchone() is None:
+                names = []
+            else:
+                names = [row[0] for row in conn.execute("SELECT path FROM shards ORDER BY shard")]
+        folder = os.path.dirname(os.path.abspath(main.path))
+        shards = [ConnectionPool(os.path.join(folder, name), main.size, main.busy_timeout) for name in names]
+        if _layout is not None:
+            for db in _layout[1]:
+                if db is not _layout[0]:
+                    db.close()
+        _layout = (main, shards or [main])
+        return _layout
+
+
+def close():
+    # Closes the shard pools; the next call re-reads the shard list
+    global _layout
+    with _lock:
+        layout, _layout = _layout, None
+    if layout is not None:
+        for db in layout[1]:
+            if db is not layout[0]:
+                db.close()
+
+
+def reload():
+    # Re-reads the shard list, e.g. after rebalance()
+    close()
+    return pools()
+
+
+def enabled():
+    return pools()[0] is not database.pool
+
+
+def index(user_id):
+    dbs = pools()
+    return 0 if len(dbs) == 1 else shard_index(user_id, len(dbs))
+
+
+def pool_for(user_id):
+    dbs = pools()
+    return dbs[0] if len(dbs) == 1 else dbs[shard_index(user_id, len(dbs))]
+
+
+def connection(user_id):
+    return pool_for(user_id).connection()
+
+
+def transaction(user_id, mode="IMMEDIATE"):
+    return pool_for(user_id).transaction(mode)
+
+
+def group(user_ids):
+    # [(pool, [user ids])] for the shards holding user_ids, in shard order
+    dbs = pools()
+    groups = {}
+    for user_id in user_ids:
+        groups.setdefault(0 if len(dbs) == 1 else shard_index(user_id, len(dbs)), []).append(user_id)
+    return [(dbs[k], groups[k]) for k in sorted(groups)]
+
+
+def fan_out(fn):
+    # [fn(pool) for each shard], run on one thread per shard
+    dbs = pools()
+    if len(dbs) == 1:
+        return [fn(dbs[0])]
+    with ThreadPoolExecutor(len(dbs), thread_name_prefix="bank-shard") as executor:
+        return list(executor.map(fn, dbs))
+
+
+def open_shards():
+    # Creates and migrates every shard file, then finishes any cross-shard
+    # transfer a crash interrupted. Called by database.create_tables().
+    if not enabled():
+        return
+    for db in pools():
+        database.create_tables(db)
+    from models.ledger import ledger
+    ledger.settle_transfers()
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=database.pool.busy_timeout, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout = {int(database.pool.busy_timeout * 1000)}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    return conn
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+
+
+def rebalance(count, batch_size=REBALANCE_BATCH):
+    # Moves every customer to its shard under a layout of count files and
+    # returns the number of customers moved. Restartable: if interrupted, run
+    # it again with the same count. Customers are copied while the old layout
+    # is still the live one, the new layout is then committed, and only after
+    # that are the copies left behind deleted.
+    if count < 1:
+        raise ValueError("count must be at least 1")
+    from models.ledger import ledger
+    ledger.settle_transfers()
+    main = database.pool
+    main_path = os.path.abspath(main.path)
+    old = [os.path.abspath(db.path) for db in pools()]
+    new = [main_path] if count == 1 else [shard_path(main_path, k) for k in range(count)]
+    moved = 0
+    if old != new:
+        for path in new:
+            if path != main_path:
+                db = ConnectionPool(path, 1, main.busy_timeout)
+                database.create_tables(db)
+                db.close()
+        _reseed(old, new)
+        for source in old:
+            moved += _copy_out(source, new, batch_size)
+        with main.transaction() as conn:
+            conn.execute("DELETE FROM shards")
+            if count > 1:
+                conn.executemany("INSERT INTO shards (shard, path) VALUES (?, ?)",
+                                 ((k, os.path.basename(path)) for k, path in enumerate(new)))
+    reload()
+    for path in dict.fromkeys(new + [main_path]):
+        _clean(path, new)
+    for path in shard_files(main_path):
+        if path not in new:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    return moved
+
+
+def _reseed(old, new):
+    # Fresh, disjoint id ranges above every id issued so far, per table
+    highest = dict.fromkeys(SEQUENCED, 0)
+    for path in dict.fromkeys(old + new):
+        conn = _connect(path)
+        try:
+            for table in SEQUENCED:
+                highest[table] = max(highest[table], conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0],
+                                     *(row[0] for row in conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))))
+        finally:
+            conn.close()
+    for k, path in enumerate(new):
+        conn = _connect(path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for table in SEQUENCED:
+                conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)",
+                             (table, (highest[table] // ID_SPAN + 1 + k) * ID_SPAN))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+
+def _copy_out(source, new, batch_size):
+    # Copies the customers in source that belong elsewhere under new. Each
+    # batch replaces whatever a previous, interrupted run copied for them.
+    conn = _connect(source)
+    try:
+        users = [row[0] for row in conn.execute(" UNION ".join(
+            f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL" for table, column, _ in MOVED))]
+    finally:
+        conn.close()
+    destinations = {}
+    for user_id in users:
+        path = new[shard_index(user_id, len(new))]
+        if path != source:
+            destinations.setdefault(path, []).append(user_id)
+    for path, ids in destinations.items():
+        conn = _connect(path)
+        try:
+            conn.execute("ATTACH DATABASE ? AS src", (source,))
+            conn.execute("CREATE TEMP TABLE moving (user_id INTEGER PRIMARY KEY)")
+            for i in range(0, len(ids), batch_size):
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("DELETE FROM moving")
+                conn.executemany("INSERT INTO moving (user_id) VALUES (?)", ((u,) for u in ids[i:i + batch_size]))
+                for table, column, columns in MOVED:
+                    names = ", ".join(columns or _columns(conn, table))
+                    conn.execute(f"DELETE FROM main.{table} WHERE {column} IN (SELECT user_id FROM moving)")
+                    conn.execute(f"INSERT INTO main.{table} ({names}) SELECT {names} FROM src.{table} "
+                                 f"WHERE {column} IN (SELECT user_id FROM moving)")
+                conn.execute("COMMIT")
+        finally:
+            conn.close()
+    return sum(len(ids) for ids in destinations.values())
+
+
+def _clean(path, new):
+    # Deletes rows of customers that belong to another file under new, then
+    # rebuilds the file's bank-wide totals from what it keeps
+    keep = new.index(path) if path in new else None
+    conn = _connect(path)
+    try:
+        conn.create_function("shard_of", 1, lambda user_id: shard_index(user_id, len(new)), deterministic=True)
+        conn.execute("BEGIN IMMEDIATE")
+        for table, column, _ in MOVED:
+            if keep is None:
+                conn.execute(f"DELETE FROM {table} WHERE {column} IS NOT NULL")
+            elif len(new) > 1:
+                conn.execute(f"DELETE FROM {table} WHERE {column} IS NOT NULL AND shard_of({column}) != ?", (keep,))
+        conn.execute("DELETE FROM bank_daily_totals")
+        conn.execute('''
+            INSERT INTO bank_daily_totals (day, type, status, count, amount)
+            SELECT day, type, status, SUM(count), SUM(amount) FROM daily_totals GROUP BY day, type, status
+        ''')
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+__all__ = ["pools", "enabled", "index", "pool_for", "connection", "transaction", "group", "fan_out",
+           "open_shards", "rebalance", "reload", "close", "shard_index", "shard_path", "shard_files"]
@@ -0,0 +1,47 @@
+# utils/batch_files.py
+# Streaming readers for ledger batch files. Both yield (user_id, operation, amount)
+# one row at a time so Ledger.apply_batch never holds the whole file in memory.
+# Rows that cannot be parsed are yielded as (None, None, None) and come back
+# as "invalid", keeping results aligned with the input rows.
+import csv
+import json
+from models.money import Money
+
+INVALID_ROW = (None, None, None)
+
+
+def _parse(user_id, operation, amount):
+    try:
+        return int(user_id), operation, Money.parse(amount)
+    except (TypeError, ValueError):
+        return INVALID_ROW
+
+
+def read_csv(path):
+    # Expects a header row with user_id, operation, amount columns
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            yield _parse(row.get("user_id"), row.get("operation"), row.get("amount"))
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield INVALID_ROW
+                continue
+            if not isinstance(row, dict):
+                # Valid JSON but not an object, e.g. [1, 2] or 5
+                yield INVALID_ROW
+                continue
+            yield _parse(row.get("user_id"), row.get("operation"), row.get("amount"))
+
+
+def read_batch_file(path):
+    if path.endswith(".jsonl"):
+        return read_jsonl(path)
+    return read_csv(path)
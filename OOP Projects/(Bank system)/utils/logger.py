@@ -1,7 +1,167 @@
 # utils/logger.py
+# Structured JSON-lines logging. log_action only puts a tuple on a bounded
+# queue; a background thread formats timestamps, encodes JSON, writes records
+# in batches and rotates the file, so callers never wait on file I/O.
+import atexit
 import datetime
+import json
+import os
+import queue
+import threading
+import time
 
-def log_action(user_id, action, status):
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open("logs.txt", "a") as log_file:
-        log_file.write(f"[{timestamp}] User ID: {user_id} | Action: {action} | Status: {status}\n")
+LOG_PATH = os.environ.get("BANK_LOG_PATH", "logs.jsonl")
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5
+MAX_BYTES = 10 * 1024 * 1024
+BACKUPS = 5
+DROP_POLICIES = ("drop_new", "drop_oldest", "block")
+
+
+class StructuredLogger:
+    def __init__(self, path=LOG_PATH, queue_size=QUEUE_SIZE, drop_policy="drop_new",
+                 batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_bytes=MAX_BYTES, rotate_interval=None, backups=BACKUPS):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {DROP_POLICIES}")
+        self.path = path
+        self.drop_policy = drop_policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backups = backups
+        self.records = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.thread = None
+        self.stopping = threading.Event()
+        self.start_lock = threading.Lock()
+        self.file = None
+        self.opened_at = 0.0
+
+    def log(self, record):
+        # record is a dict; the wall-clock time is captured here, formatted later
+        if self.thread is None:
+            self.start()
+        item = (time.time(), record)
+        if self.drop_policy == "block":
+            self.records.put(item)
+            return
+        try:
+            self.records.put_nowait(item)
+        except queue.Full:
+            if self.drop_policy == "drop_oldest":
+                try:
+                    self.records.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    self.records.put_nowait(item)
+                except queue.Full:
+                    pass
+            # Counter is only advisory, a lost increment under contention is fine
+            self.dropped += 1
+
+    def start(self):
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="bank-logger", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while not (self.stopping.is_set() and self.records.empty()):
+            batch = []
+            try:
+                batch.append(self.records.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.records.get_nowait())
+            except queue.Empty:
+                pass
+            lost = len(batch)
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lost += dropped
+                batch.append((time.time(), {"event": "log_records_dropped", "count": dropped}))
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception:
+                    # Disk full, a failed rotation, ...: the batch is lost, but the
+                    # thread keeps draining so "block" callers never wait on a dead queue.
+                    # The file is reopened on the next write.
+                    self.dropped += lost
+                    self.discard_file()
+        # The file is closed here rather than in close(), which may give up
+        # waiting while this thread is still writing
+        self.discard_file()
+
+    def write(self, batch):
+        lines = []
+        for created, record in batch:
+            stamp = datetime.datetime.fromtimestamp(created).isoformat(timespec="milliseconds")
+            lines.append(json.dumps({"ts": stamp, **record}, default=str))
+        data = "\n".join(lines) + "\n"
+        if self.file is None:
+            self.open()
+        elif self.should_rotate(len(data)):
+            self.rotate()
+        self.file.write(data)
+        self.file.flush()
+
+    def discard_file(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+
+    def open(self):
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.opened_at = time.time()
+
+    def should_rotate(self, incoming):
+        if self.file.tell() == 0:
+            return False
+        if self.max_bytes and self.file.tell() + incoming > self.max_bytes:
+            return True
+        return bool(self.rotate_interval) and time.time() - self.opened_at >= self.rotate_interval
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.open()
+
+    def close(self, timeout=5.0):
+        # Drains whatever is queued; the thread closes the file once done
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+logger = StructuredLogger()
+
+
+def shutdown():
+    logger.close()
+
+
+atexit.register(shutdown)
+
+
+def configure(**options):
+    global logger
+    logger.close()
+    logger = StructuredLogger(**options)
+    return logger
+
+
+def log_action(user_id, action, status, **details):
+    logger.log({"user_id": user_id, "action": action, "status": status, **details})
@@ -0,0 +1,310 @@
+# utils/metrics.py
+# Counters, histograms and timers for model methods and SQL statements. When
+# metrics are disabled nothing is wrapped: the model classes keep their plain
+# functions and the pool opens plain sqlite3 connections, so the hot paths pay
+# nothing. enable() swaps in timing wrappers and a timed connection class and
+# reopens the pools, so connections opened before it (e.g. by create_tables())
+# are replaced; call it at startup, before requests start. Calls slower than the
+# thresholds are written to the structured log as slow_query / slow_call.
+# Set BANK_METRICS=1 to enable from the environment, and BANK_METRICS_DUMP to
+# write a snapshot at exit.
+import atexit
+import functools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+SLOW_SQL_MS = float(os.environ.get("BANK_SLOW_SQL_MS", "100"))
+SLOW_CALL_MS = float(os.environ.get("BANK_SLOW_CALL_MS", "500"))
+# Bucket upper bounds in seconds, each 2^(1/4) (~19%) above the last, 1 us to ~270 s
+BUCKETS = [1e-6 * 2 ** (i / 4) for i in range(113)]
+
+
+class Counter:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+
+class Histogram:
+    # Fixed log-scale buckets: constant memory, percentiles within one bucket (~19%)
+    __slots__ = ("counts", "count", "total", "max", "lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(BUCKETS, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, q):
+        with self.lock:
+            rank, seen = q * self.count, 0
+            for i, n in enumerate(self.counts):
+                seen += n
+                if n and seen >= rank:
+                    return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return 0.0
+
+    def summary(self):
+        # Seconds converted to milliseconds for reading
+        mean = self.total / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "mean_ms": round(mean * 1000, 3),
+            "p50_ms": round(self.percentile(0.50) * 1000, 3),
+            "p95_ms": round(self.percentile(0.95) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class Registry:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name):
+        counter = self.counters.get(name)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.setdefault(name, Counter())
+        return counter
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def timer(self, name):
+        return Timer(self.histogram(name))
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        with self.lock:
+            counters, histograms = dict(self.counters), dict(self.histograms)
+        return {
+            "taken": time.time(),
+            "counters": {name: c.value for name, c in sorted(counters.items())},
+            "timers": {name: h.summary() for name, h in sorted(histograms.items()) if h.count},
+        }
+
+
+class Timer:
+    # with registry.timer("name"): ... records the block's wall time
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+registry = Registry()
+enabled = False
+slow_sql_ms = SLOW_SQL_MS
+slow_call_ms = SLOW_CALL_MS
+_originals = []
+
+
+def report_slow(event, name, elapsed):
+    from utils.logger import log_action
+    log_action(None, event, "slow", name=name, ms=round(elapsed * 1000, 3))
+
+
+def timed(name, fn):
+    histogram = registry.histogram(name)
+    errors = registry.counter(name + ".errors")
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            histogram.observe(elapsed)
+            if elapsed * 1000 >= slow_call_ms:
+                report_slow("slow_call", name, elapsed)
+    return wrapper
+
+
+def instrument(owner, prefix):
+    # Wraps every public function of a class or module, keeping static/class methods as such
+    for attr, value in list(vars(owner).items()):
+        if attr.startswith("_"):
+            continue
+        if isinstance(value, (staticmethod, classmethod)):
+            wrapped = type(value)(timed(f"{prefix}.{attr}", value.__func__))
+        elif callable(value) and getattr(value, "__module__", None) == getattr(owner, "__module__", owner.__name__) \
+                and not isinstance(value, type):
+            wrapped = timed(f"{prefix}.{attr}", value)
+        else:
+            continue
+        _originals.append((owner, attr, value))
+        setattr(owner, attr, wrapped)
+
+
+_PLACEHOLDER_LISTS = re.compile(r"\?(\s*,\s*\?)+")
+_SPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_name(sql):
+    # One timer per statement shape: whitespace squeezed, IN (?, ?, ...) lists folded
+    sql = _PLACEHOLDER_LISTS.sub("?...", _SPACE.sub(" ", sql).strip())
+    return "sql " + (sql if len(sql) <= 160 else sql[:157] + "...")
+
+
+def observe_sql(sql, elapsed):
+    name = statement_name(sql)
+    registry.histogram(name).observe(elapsed)
+    if elapsed * 1000 >= slow_sql_ms:
+        report_slow("slow_query", name, elapsed)
+
+
+class TimedConnection(sqlite3.Connection):
+    # Times execute/executemany/executescript on the connection and its cursors.
+    # For SELECTs this is the time to the first row (where SQLite sorts and
+    # groups); rows fetched afterwards are not included.
+    def cursor(self, factory=None):
+        return super().cursor(factory or TimedCursor)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observe_sql(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            observe_sql(sql, time.perf_counter() - started)
+
+    def executescript(self, script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            observe_sql("script", time.perf_counter() - started)
+
+
+def enable(slow_sql=None, slow_call=None):
+    # Instruments the model layer and makes the pool open timed connections
+    global enabled, slow_sql_ms, slow_call_ms
+    if slow_sql is not None:
+        slow_sql_ms = slow_sql
+    if slow_call is not None:
+        slow_call_ms = slow_call
+    if enabled:
+        return
+    import database
+    from models import ledger, models, snapshots
+    for cls in (models.User, models.Customer, models.Admin, ledger.Ledger):
+        instrument(cls, cls.__name__)
+    instrument(snapshots, "snapshots")
+    database.connection_factory = TimedConnection
+    _reconnect()
+    enabled = True
+
+
+def disable():
+    global enabled
+    import database
+    if not enabled:
+        return
+    while _originals:
+        owner, attr, value = _originals.pop()
+        setattr(owner, attr, value)
+    database.connection_factory = sqlite3.Connection
+    _reconnect()
+    enabled = False
+
+
+def _reconnect():
+    # Fresh pools, so every connection is opened with the current factory
+    import database
+    import sharding
+    sharding.close()
+    database.configure()
+
+
+def snapshot():
+    return registry.snapshot()
+
+
+def render(format="text"):
+    data = snapshot()
+    if format == "json":
+        return json.dumps(data, indent=2)
+    lines = [f"{'timer':70s} {'count':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+    for name, s in data["timers"].items():
+        lines.append(f"{name[:70]:70s} {s['count']:>8} {s['p50_ms']:>9} {s['p99_ms']:>9} {s['max_ms']:>9}")
+    for name, value in data["counters"].items():
+        if value:
+            lines.append(f"{name[:70]:70s} {value:>8}")
+    return "\n".join(lines) + "\n"
+
+
+def dump(path, format=None):
+    # Format follows the file extension unless given
+    format = format or ("json" if path.endswith(".json") else "text")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(render(format))
+
+
+def configure_from_env():
+    if os.environ.get("BANK_METRICS", "") not in ("", "0"):
+        enable()
+        path = os.environ.get("BANK_METRICS_DUMP")
+        if path:
+            atexit.register(dump, path)
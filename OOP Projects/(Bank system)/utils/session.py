@@ -1,15 +1,291 @@
 # utils/session.py
+# Session table keyed by opaque tokens. Sessions end after an idle timeout or
+# an absolute TTL, and the least recently used one is evicted past
+# max_sessions. Idle expiry is driven by one timer wheel ticked from a single
+# place (a Tk after loop or one background thread); there is no timer per
+# session. Activity only stamps last_seen, and the wheel re-files a session
+# when its slot comes round early. Only a SHA-256 of each token is kept, in
+# memory and in the optional SQLite copy that lets sessions survive a restart.
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+IDLE_TIMEOUT = float(os.environ.get("BANK_SESSION_IDLE", "600"))
+SESSION_TTL = 8 * 3600.0
+MAX_SESSIONS = 100000
+RESOLUTION = 1.0
+PERSIST_INTERVAL = 30.0
+
+
+class Session:
+    __slots__ = ("key", "user_id", "user_type", "user", "created", "last_seen", "expires_at", "slot", "on_expire")
+
+    def __init__(self, key, user_id, user_type, user, created, last_seen, expires_at, on_expire=None):
+        self.key = key
+        self.user_id = user_id
+        self.user_type = user_type
+        self.user = user
+        self.created = created
+        self.last_seen = last_seen
+        self.expires_at = expires_at
+        self.slot = None
+        self.on_expire = on_expire
+
+
+def token_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class SessionStore:
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS,
+                 resolution=RESOLUTION, persist=False):
+        self.idle_timeout = idle_timeout
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.resolution = resolution
+        self.persist = persist
+        self.sessions = OrderedDict()  # least recently used first
+        # One slot per tick across the idle timeout; deadlines further out wrap round
+        self.wheel = [set() for _ in range(int(idle_timeout / resolution) + 2)]
+        self.tick_at = self.tick_number(time.time())
+        self.dirty = set()
+        self.last_persist = time.monotonic()
+        self.lock = threading.RLock()
+        self.timer = None
+
+    def tick_number(self, when):
+        return int(when / self.resolution)
+
+    def deadline(self, session):
+        return min(session.last_seen + self.idle_timeout, session.expires_at)
+
+    def file(self, session):
+        # Puts the session in the wheel slot of its current deadline
+        if session.slot is not None:
+            self.wheel[session.slot].discard(session.key)
+        tick = max(self.tick_number(self.deadline(session)), self.tick_at + 1)
+        session.slot = tick % len(self.wheel)
+        self.wheel[session.slot].add(session.key)
+
+    def create(self, user, user_type, on_expire=None):
+        now = time.time()
+        token = secrets.token_urlsafe(32)
+        session = Session(token_key(token), user.id, user_type, user, now, now, now + self.ttl, on_expire)
+        if self.persist:
+            # Saved before the token is handed out, so no removal can race the INSERT
+            self.save(session)
+        evicted = []
+        with self.lock:
+            self.sessions[session.key] = session
+            self.file(session)
+            while len(self.sessions) > self.max_sessions:
+                evicted.append(self.remove(next(iter(self.sessions))))
+        self.forget(evicted)
+        self.notify(evicted)
+        return token
+
+    def get(self, token):
+        # Returns the live session for a token and counts the lookup as activity
+        key = token_key(token)
+        now = time.time()
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                return None
+            if self.deadline(session) <= now:
+                self.remove(key)
+                expired = session
+            else:
+                session.last_seen = now
+                self.sessions.move_to_end(key)
+                self.dirty.add(key)
+                expired = None
+        if expired is not None:
+            self.forget([expired])
+            self.notify([expired])
+            return None
+        if session.user is None:
+            session.user = load_user(session.user_id, session.user_type)
+        return session
+
+    def touch(self, token):
+        return self.get(token) is not None
+
+    def end(self, token):
+        with self.lock:
+            session = self.remove(token_key(token))
+        self.forget([session])
+        return session is not None
+
+    def end_user(self, user_id):
+        with self.lock:
+            ended = [self.remove(key) for key in [k for k, s in self.sessions.items() if s.user_id == user_id]]
+        self.forget(ended)
+
+    def remove(self, key):
+        # Drops the session from memory; called with the lock held, and the
+        # caller passes the result to forget() once the lock is released
+        session = self.sessions.pop(key, None)
+        if session is None:
+            return None
+        if session.slot is not None:
+            self.wheel[session.slot].discard(key)
+        self.dirty.discard(key)
+        return session
+
+    def forget(self, sessions):
+        # Deletes ended sessions from the SQLite copy, outside the lock so a
+        # busy database never holds up other lookups
+        keys = [(session.key,) for session in sessions if session is not None]
+        if self.persist and keys:
+            from database import transaction
+            with transaction() as conn:
+                conn.executemany("DELETE FROM sessions WHERE key = ?", keys)
+
+    def tick(self, now=None):
+        # Advances the wheel to now and ends every session whose deadline has passed
+        now = time.time() if now is None else now
+        target = self.tick_number(now)
+        expired = []
+        with self.lock:
+            if target - self.tick_at > len(self.wheel):
+                # Far behind (e.g. after a suspend): one lap visits every slot
+                self.tick_at = target - len(self.wheel)
+            while self.tick_at < target:
+                self.tick_at += 1
+                slot = self.wheel[self.tick_at % len(self.wheel)]
+                for key in list(slot):
+                    session = self.sessions[key]
+                    if self.deadline(session) <= now:
+                        expired.append(self.remove(key))
+                    else:
+                        # Active since it was filed, or due on a later round of the wheel
+                        self.file(session)
+            due = self.persist and time.monotonic() - self.last_persist >= PERSIST_INTERVAL
+        self.forget(expired)
+        if due:
+            self.flush()
+        self.notify(expired)
+        return expired
+
+    def notify(self, sessions):
+        for session in sessions:
+            if session is not None and session.on_expire is not None:
+                session.on_expire()
+
+    def start_timer(self):
+        # Background ticking for headless use; the GUI ticks from Tk instead
+        if self.timer is None:
+            self.timer = threading.Thread(target=self.run_timer, name="bank-sessions", daemon=True)
+            self.timer.start()
+
+    def run_timer(self):
+        while True:
+            time.sleep(self.resolution)
+            self.tick()
+
+    # Persistence
+
+    def save(self, session):
+        from database import connection
+        with connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (key, user_id, user_type, created, last_seen, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (session.key, session.user_id, session.user_type, session.created, session.last_seen, session.expires_at))
+
+    def flush(self):
+        # Writes batched last_seen updates
+        from database import transaction
+        with self.lock:
+            rows = [(self.sessions[k].last_seen, k) for k in self.dirty if k in self.sessions]
+            self.dirty.clear()
+            self.last_persist = time.monotonic()
+        if rows:
+            with transaction() as conn:
+                conn.executemany("UPDATE sessions SET last_seen = ? WHERE key = ?", rows)
+
+    def load(self):
+        # Restores unexpired sessions after a restart; users are loaded on first use
+        from database import transaction
+        now = time.time()
+        with transaction() as conn:
+            conn.execute("DELETE FROM sessions WHERE expires_at <= ? OR last_seen + ? <= ?", (now, self.idle_timeout, now))
+            rows = conn.execute(
+                "SELECT key, user_id, user_type, created, last_seen, expires_at FROM sessions ORDER BY last_seen").fetchall()
+        with self.lock:
+            for key, user_id, user_type, created, last_seen, expires_at in rows:
+                session = Session(key, user_id, user_type, None, created, last_seen, expires_at)
+                self.sessions[key] = session
+                self.file(session)
+        return len(rows)
+
+
+def load_user(user_id, user_type):
+    from models.models import Admin, Customer, find_user
+    row = find_user(user_id, user_type)
+    if row is None:
+        return None
+    return (Admin if user_type == "admin" else Customer).from_row(row)
+
+
+store = SessionStore()
+
+
+def configure(**options):
+    global store
+    store = SessionStore(**options)
+    return store
+
 
 class SessionManager:
-    def __init__(self, root, logout_callback):
+    # Ties one GUI sign-in to a store session: key and mouse activity keep it
+    # alive, and the Tk after loop ticks the wheel and logs out on idle timeout
+    ACTIVITY_EVENTS = ("<Any-KeyPress>", "<Any-ButtonPress>")
+
+    def __init__(self, root, logout_callback, user=None, user_type="customer"):
         self.root = root
         self.logout_callback = logout_callback
+        self.user = user
+        self.user_type = user_type
         self.active = False
+        self.token = None
+        self.after_id = None
 
     def start(self):
         self.active = True
-        # Placeholder: Add session timeout logic if needed
+        self.token = store.create(self.user, self.user_type, on_expire=self.expired)
+        for event in self.ACTIVITY_EVENTS:
+            self.root.bind_all(event, self.activity, add="+")
+        self.schedule_tick()
+
+    def activity(self, event=None):
+        if self.active:
+            store.touch(self.token)
+
+    def schedule_tick(self):
+        self.after_id = self.root.after(int(store.resolution * 1000), self.on_tick)
+
+    def on_tick(self):
+        self.after_id = None
+        store.tick()
+        if self.active:
+            self.schedule_tick()
+
+    def expired(self):
+        if self.active:
+            self.stop()
+            self.logout_callback()
 
     def stop(self):
+        if not self.active:
+            return
         self.active = False
-        # Placeholder: Add cleanup logic if needed
+        for event in self.ACTIVITY_EVENTS:
+            self.root.unbind_all(event)
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+        store.end(self.token)
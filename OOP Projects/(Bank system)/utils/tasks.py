@@ -0,0 +1,71 @@
+# utils/tasks.py
+# Runs database and bcrypt work on a thread pool so Tk callbacks never block.
+# Results are handed back to the Tk main loop through a queue polled with
+# root.after, since Tk widgets may only be touched from the main thread.
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+POLL_INTERVAL_MS = 15
+WORKERS = 4
+
+
+class TaskRunner:
+    def __init__(self, root, workers=WORKERS):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bank-task")
+        self.results = queue.SimpleQueue()
+        self.pending = 0
+        self.polling = False
+
+    def run_async(self, fn, on_done=None, on_error=None):
+        self.pending += 1
+        future = self.executor.submit(fn)
+        future.add_done_callback(lambda f: self.results.put((f, on_done, on_error)))
+        if not self.polling:
+            self.polling = True
+            self.root.after(POLL_INTERVAL_MS, self.poll)
+        return future
+
+    def poll(self):
+        while True:
+            try:
+                future, on_done, on_error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= 1
+            self.dispatch(future, on_done, on_error)
+        if self.pending:
+            self.root.after(POLL_INTERVAL_MS, self.poll)
+        else:
+            self.polling = False
+
+    def dispatch(self, future, on_done, on_error):
+        error = future.exception()
+        try:
+            if error is None:
+                if on_done is not None:
+                    on_done(future.result())
+            elif on_error is not None:
+                on_error(error)
+            else:
+                self.root.report_callback_exception(type(error), error, error.__traceback__)
+        except Exception as e:
+            # Same reporting Tk uses for exceptions raised inside button callbacks
+            self.root.report_callback_exception(type(e), e, e.__traceback__)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+runner = None
+
+
+def start(root, workers=WORKERS):
+    global runner
+    if runner is None:
+        runner = TaskRunner(root, workers)
+    return runner
+
+
+def run_async(fn, on_done=None, on_error=None):
+    return runner.run_async(fn, on_done, on_error)